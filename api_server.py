@@ -1,6 +1,5 @@
 from flask import Flask
 from flask_cors import CORS
-import boto3
 import os
 
 try:
@@ -16,32 +15,21 @@ CORS(app)
 app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['JWT_SECRET'] = config.JWT_SECRET_KEY
 
-# Parse Digital Ocean Spaces URL to extract bucket and region
-def _parse_do_url(url):
-    """Extract bucket name and region from Digital Ocean Spaces URL."""
-    url = url.replace('https://', '').replace('http://', '')
-    parts = url.split('.')
-    if len(parts) >= 3 and 'digitaloceanspaces' in url:
-        bucket = parts[0]
-        region = parts[1]
-        return bucket, region
-    raise ValueError(f"Invalid Digital Ocean Spaces URL: {url}")
+import storage
 
-DO_BUCKET, DO_REGION = _parse_do_url(config.DO_SPACES_URL)
-DO_ENDPOINT = f"https://{DO_REGION}.digitaloceanspaces.com"
-
-# Digital Ocean Spaces Setup (S3-compatible)
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=config.DO_SPACES_KEY,
-    aws_secret_access_key=config.DO_SPACES_SECRET,
-    endpoint_url=DO_ENDPOINT,
-    region_name=DO_REGION
+# Digital Ocean Spaces Setup (S3-compatible), shared and pooled.
+# Size the pool for request threads plus the handlers' background I/O pools.
+SERVER_THREADS = getattr(config, 'SERVER_THREADS', 16)
+DO_REGION = storage.DO_REGION
+s3_client = storage.get_s3_client(
+    max_pool_connections=SERVER_THREADS
+    + getattr(config, 'S3_IO_WORKERS', 8)
+    + getattr(config, 'S3_CACHE_REFRESH_WORKERS', 2)
 )
 
 # S3 Configuration
-S3_BUCKET = DO_BUCKET
-S3_PREFIX = config.S3_PREFIX
+S3_BUCKET = storage.S3_BUCKET
+S3_PREFIX = storage.S3_PREFIX
 
 # OpenRouter Configuration
 OPENROUTER_CONFIG = {
@@ -62,7 +50,10 @@ if __name__ == '__main__':
     print("=" * 60)
     print("🔷 Love-Matcher API Server Starting")
     print("=" * 60)
-    print(f"Storage: Digital Ocean Spaces")
+    if storage.STORAGE_BACKEND == 'sqlite':
+        print(f"Storage: local SQLite ({storage.LOCAL_STORE_PATH}), mirrored to Spaces: {bool(storage.archiver)}")
+    else:
+        print(f"Storage: Digital Ocean Spaces")
     print(f"Bucket: {S3_BUCKET}")
     print(f"Region: {DO_REGION}")
     print(f"Prefix: {S3_PREFIX}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark storage codecs on realistic Love-Matcher documents
+
+Compares every codec in serialization.CODECS on synthetic profiles (every profile
+dimension plus a summary) and topic documents (long message lists):
+bytes on the wire, encode/decode CPU, and end-to-end s3_get latency
+(get_object + decompress + parse) against a store.
+
+By default the store is a throwaway local SQLite store, with wire time
+estimated from --bandwidth-mbps. Pass --live to run against the configured
+storage under a bench/ prefix instead.
+
+Usage:
+    python bench_codecs.py
+    python bench_codecs.py --messages 400 --bandwidth-mbps 50
+    python bench_codecs.py --live
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import prompts
+import serialization
+
+WORDS = (
+    "faith family honest kind adventure travel mountains ocean cooking weekends church "
+    "career teacher engineer nurse children someday patient listener humor laugh loyal "
+    "quiet morning coffee books hiking dogs cats garden music guitar piano savings budget "
+    "tradition values respect communication conflict calm together home city country "
+    "parents siblings holidays dinner conversation growth health running yoga sunday"
+).split()
+
+
+def _sentence(rng, words=18):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _paragraph(rng, sentences=4):
+    return ' '.join(_sentence(rng) for _ in range(sentences))
+
+
+def make_profile(rng, idx):
+    dims = {}
+    for topic in prompts.TOPIC_GUIDANCE.values():
+        for dim in topic['dims']:
+            dims[dim] = _paragraph(rng, 2)
+    return {
+        'user_id': f"bench_user_{idx}",
+        'email': f"bench{idx}@example.com",
+        'password_hash': '$2b$12$' + 'x' * 53,
+        'age': rng.randint(20, 55),
+        'gender': rng.choice(['male', 'female']),
+        'seeking_gender': rng.choice(['male', 'female']),
+        'dimensions': dims,
+        'profile_summary': '\n\n'.join(_paragraph(rng, 5) for _ in range(4)),
+        'match_pool': [
+            {'user_id': f"bench_user_{rng.randint(0, 999)}", 'score': rng.randint(40, 95),
+             'analysis': {'reasoning': _paragraph(rng, 2), 'strengths': _sentence(rng), 'concerns': _sentence(rng)},
+             'matched_at': '2026-01-01T00:00:00'}
+            for _ in range(3)
+        ],
+        'photos': [],
+        'conversation_count': rng.randint(0, 300),
+    }
+
+
+def make_topic(rng, messages):
+    return {
+        'topic_id': 'topic_1700000000000',
+        'title': 'Getting to Know You',
+        'type': 'profile_building',
+        'status': 'active',
+        'participants': ['bench_user_0'],
+        'created_at': '2026-01-01T00:00:00',
+        'updated_at': '2026-01-01T00:00:00',
+        'messages': [
+            {'timestamp': '2026-01-01T00:00:00', 'user': _paragraph(rng, 2), 'ai': _paragraph(rng, 3),
+             'parsed_dimension': 'hobbies', 'parsed_value': _sentence(rng), 'model': 'bench-model',
+             'usage': {'prompt_tokens': 1800, 'completion_tokens': 120, 'total_tokens': 1920}}
+            for _ in range(messages)
+        ],
+    }
+
+
+def _time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def bench(docs, store, bucket, prefix, repeat, bandwidth_mbps):
+    rows = []
+    for codec in serialization.CODECS:
+        for name, doc in docs:
+            body, metadata = serialization.encode(doc, codec)
+            encode_ms = _time_ms(lambda: serialization.encode(doc, codec), repeat)
+            decode_ms = _time_ms(lambda: serialization.decode(body, metadata), repeat)
+
+            key = f"{prefix}bench/{codec}/{name}.json"
+            store.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/json',
+                             **serialization.put_kwargs(metadata))
+
+            def get():
+                response = store.get_object(Bucket=bucket, Key=key)
+                serialization.decode(response['Body'].read(), response.get('Metadata'))
+
+            get_ms = _time_ms(get, repeat)
+            wire_ms = len(body) * 8 / (bandwidth_mbps * 1000) if bandwidth_mbps else 0.0
+            rows.append((name, codec, len(body), encode_ms, decode_ms, get_ms, get_ms + wire_ms))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark storage codecs on Love-Matcher documents')
+    parser.add_argument('--messages', type=int, default=200, help='Messages in the large topic document')
+    parser.add_argument('--repeat', type=int, default=50, help='Timing repetitions per measurement')
+    parser.add_argument('--bandwidth-mbps', type=float, default=100.0,
+                        help='Link speed used to estimate wire time for the local store (0 to disable)')
+    parser.add_argument('--live', action='store_true', help='Benchmark against the configured storage')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    docs = [
+        ('profile', make_profile(rng, 0)),
+        ('topic_small', make_topic(rng, 10)),
+        (f"topic_{args.messages}", make_topic(rng, args.messages)),
+    ]
+
+    if args.live:
+        import storage
+        store, bucket, prefix = storage.get_s3_client(), storage.S3_BUCKET, storage.S3_PREFIX
+        bandwidth = 0
+    else:
+        from local_store import SQLiteObjectStore
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        store, bucket, prefix = SQLiteObjectStore(path), 'bench', ''
+        bandwidth = args.bandwidth_mbps
+
+    print(f"JSON encoder: {'orjson' if serialization.orjson else 'stdlib json'}")
+    print(f"Codecs: {', '.join(serialization.CODECS)}")
+    print(f"Store: {'configured storage' if args.live else 'local SQLite'}"
+          f"{f', wire time at {bandwidth:g} Mbps' if bandwidth else ''}\n")
+
+    rows = bench(docs, store, bucket, prefix, args.repeat, bandwidth)
+    plain_sizes = {name: size for name, codec, size, *_ in rows if codec == 'json'}
+
+    print(f"{'document':<14} {'codec':<10} {'bytes':>9} {'ratio':>6} {'enc ms':>8} {'dec ms':>8} {'get ms':>8} {'e2e ms':>8}")
+    for name, codec, size, enc, dec, get, e2e in rows:
+        ratio = plain_sizes[name] / size if size else 0
+        print(f"{name:<14} {codec:<10} {size:>9} {ratio:>5.1f}x {enc:>8.3f} {dec:>8.3f} {get:>8.3f} {e2e:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark and parity check for the batch rule-based compatibility scorer
+
+Generates synthetic profiles (messy locations, religions, children answers,
+missing and non-string dimensions, a few malformed profiles) and checks
+that rule_scoring.RuleScorer returns exactly the scores of the per-pair
+calculate_compatibility_score_fallback:
+
+    - every ordered pair of a --parity corpus
+    - the benchmark block at each size
+
+Then, for each population size, scores a sample of --rows users against
+every opposite-gender profile with both implementations and reports
+pairs/s and the projected time to score the full population
+(N/2 x N/2 pairs).
+
+Usage:
+    python bench_rule_scoring.py
+    python bench_rule_scoring.py --sizes 1000 10000 50000 --rows 200
+    python bench_rule_scoring.py --parity 800
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import rule_scoring
+from rule_scoring import calculate_compatibility_score_fallback
+
+CITIES = ['Austin', 'Dallas', 'New York', 'Brooklyn', 'Denver', 'Boise', 'Salt Lake City', 'Portland',
+          'San Antonio', 'Kansas City', 'St. Louis', 'Nashville']
+PLACES = ['{city}', '{city}, TX', 'near {city}', 'Greater {city} area', '{city} but moving soon',
+          'rural area outside {city}', 'Downtown {city}', '{CITY}']
+RELIGIONS = ['Christian', 'christian', 'Catholic', 'LDS', 'Jewish', 'Muslim', 'None', 'none really',
+             'Spiritual but none in particular', 'Agnostic', 'Baptist', 'nondenominational']
+CHILDREN = ['yes', 'Yes, 3 or 4', 'no', 'No kids', 'maybe', 'Maybe someday', 'I know I want them',
+            'not sure', 'open to it', 'definitely yes', 'none yet but yes']
+FREE_TEXT = ['Acknowledged, values this highly', 'Somewhat important', 'Prefers a quiet life',
+             'Loves it', 'Not a priority right now']
+
+
+def make_profile(rng, idx):
+    dims = {}
+    if rng.random() < 0.85:
+        city = rng.choice(CITIES)
+        dims['location'] = rng.choice(PLACES).format(city=city, CITY=city.upper())
+    if rng.random() < 0.02:
+        dims['location'] = ['not', 'a', 'string']
+    if rng.random() < 0.8:
+        dims['religion'] = rng.choice(RELIGIONS)
+    if rng.random() < 0.02:
+        dims['religion'] = None
+    if rng.random() < 0.8:
+        dims['children'] = rng.choice(CHILDREN + [True, None, 2])
+    for dim in ['education', 'career'] + rule_scoring.LIFESTYLE_DIMS:
+        if rng.random() < 0.6:
+            dims[dim] = rng.choice(FREE_TEXT)
+    profile = {
+        'user_id': f"bench_user_{idx}",
+        'gender': 'male' if idx % 2 else 'female',
+        'dimensions': dims,
+    }
+    if rng.random() < 0.95:
+        profile['age'] = rng.choice([rng.randint(18, 60), rng.randint(18, 60) + 0.5])
+    if rng.random() < 0.005:
+        profile['dimensions'] = list(dims.values())     # malformed: scored per pair
+    if rng.random() < 0.005:
+        del profile['dimensions']
+    return profile
+
+
+def check_parity(profiles, scorer, rows, cols):
+    """Compare a block against the per-pair function; returns mismatches."""
+    block = scorer.score_block(rows, cols)
+    mismatches = 0
+    for a, i in enumerate(rows):
+        for b, j in enumerate(cols):
+            expected = calculate_compatibility_score_fallback(profiles[i], profiles[j])[0]
+            if block[a, b] != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"  ❌ {profiles[i]['user_id']} x {profiles[j]['user_id']}: "
+                          f"batch {block[a, b]}, per-pair {expected}")
+    return mismatches
+
+
+def bench(size, rows, rng):
+    profiles = [make_profile(rng, i) for i in range(size)]
+    men = [i for i, p in enumerate(profiles) if p['gender'] == 'male']
+    women = [i for i, p in enumerate(profiles) if p['gender'] == 'female']
+    sample = rng.sample(men, min(rows, len(men)))
+    pairs = len(sample) * len(women)
+
+    started = time.perf_counter()
+    expected = [[calculate_compatibility_score_fallback(profiles[i], profiles[j])[0] for j in women]
+                for i in sample]
+    python_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scorer = rule_scoring.RuleScorer(profiles)
+    encode_s = time.perf_counter() - started
+    started = time.perf_counter()
+    block = scorer.score_block(sample, women)
+    numpy_s = time.perf_counter() - started
+
+    mismatches = int((block != expected).sum())
+    full_pairs = len(men) * len(women)
+    return {
+        'size': size,
+        'pairs': pairs,
+        'python_pairs_per_s': pairs / python_s,
+        'numpy_pairs_per_s': pairs / numpy_s,
+        'encode_s': encode_s,
+        'python_full_s': full_pairs / (pairs / python_s),
+        'numpy_full_s': encode_s + full_pairs / (pairs / numpy_s),
+        'mismatches': mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the batch rule-based compatibility scorer')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='Population sizes')
+    parser.add_argument('--rows', type=int, default=200, help='Users scored against the full opposite bucket')
+    parser.add_argument('--parity', type=int, default=400, help='Profiles in the all-pairs parity corpus')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if not rule_scoring.HAVE_NUMPY:
+        print("❌ numpy is not installed; RuleScorer is unavailable")
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    print(f"🔍 Parity: all ordered pairs of {args.parity} profiles")
+    corpus = [make_profile(rng, i) for i in range(args.parity)]
+    everyone = list(range(len(corpus)))
+    mismatches = check_parity(corpus, rule_scoring.RuleScorer(corpus), everyone, everyone)
+    print(f"  {len(corpus) ** 2} pairs, {mismatches} mismatches")
+
+    print(f"\n{'profiles':>9} {'pairs':>10} {'python/s':>12} {'numpy/s':>12} {'speedup':>8} "
+          f"{'encode':>8} {'full python':>12} {'full numpy':>11} {'parity':>7}")
+    for size in args.sizes:
+        r = bench(size, args.rows, rng)
+        mismatches += r['mismatches']
+        print(f"{r['size']:>9} {r['pairs']:>10} {r['python_pairs_per_s']:>12,.0f} {r['numpy_pairs_per_s']:>12,.0f} "
+              f"{r['numpy_pairs_per_s'] / r['python_pairs_per_s']:>7.1f}x {r['encode_s']:>7.2f}s "
+              f"{r['python_full_s']:>11.0f}s {r['numpy_full_s']:>10.1f}s "
+              f"{'ok' if not r['mismatches'] else r['mismatches']:>7}")
+
+    if mismatches:
+        print(f"\n❌ {mismatches} scores differ from calculate_compatibility_score_fallback")
+        sys.exit(1)
+    print("\n✓ Batch scores match calculate_compatibility_score_fallback exactly")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+In-process object cache for Love-Matcher storage reads.
+
+Holds parsed JSON documents keyed by their logical storage key
+(e.g. "profiles/{user_id}.json"), with an overall byte budget,
+least-recently-used eviction and a TTL per key family. Entries that
+carry an ETag outlive their TTL so they can be revalidated with a
+conditional GET instead of being downloaded again. Keys the store
+confirmed do not exist are remembered briefly as MISSING. Families with
+a max_stale window may be served past their TTL while a
+BackgroundRefresher reloads them.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Marker returned by TTLCache.get() for a key known not to exist
+MISSING = object()
+
+_MISSING_SIZE = 64
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'family', 'stored_at', 'etag')
+
+    def __init__(self, value, size, family, stored_at, etag=None):
+        self.value = value
+        self.size = size
+        self.family = family
+        self.stored_at = stored_at
+        self.etag = etag
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a byte budget and per-family TTLs.
+
+    family_for(key) maps a key to a family name and ttls maps each family
+    to its TTL in seconds. Sizes are supplied by the caller (the serialized
+    length of the document) since that is already known at read/write time.
+    Negative entries (set_missing) use negative_ttl regardless of family.
+    max_stale maps a family to how long past its TTL an entry may still be
+    served stale (stale-while-revalidate); families not listed get none.
+    """
+
+    def __init__(self, max_bytes, ttls, family_for, negative_ttl=10, max_stale=None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls)
+        self.negative_ttl = negative_ttl
+        self.max_stale = dict(max_stale or {})
+        self.family_for = family_for
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._revalidations = 0
+        self._negative_hits = 0
+
+    def ttl_for(self, key):
+        return self.ttls.get(self.family_for(key), 0)
+
+    def get(self, key):
+        """Return the cached value, MISSING, or None if not cached or expired.
+
+        Expired entries with an ETag or still inside their max_stale window
+        are kept for get_stale()/revalidate().
+        """
+        return self.get_versioned(key)[0]
+
+    def get_versioned(self, key):
+        """Like get(), but returns (value, etag) so callers can write back
+        conditionally against the version they read."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None, None
+            now = time.time()
+            if self._expired(entry, now):
+                if entry.etag is None and not self._servable_stale(entry, now):
+                    self._drop(key)
+                self._expirations += 1
+                self._misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            if entry.value is MISSING:
+                self._negative_hits += 1
+            return entry.value, entry.etag
+
+    def get_stale(self, key):
+        """Return (value, etag, servable) for an expired entry.
+
+        servable is True while the entry is inside its family's max_stale
+        window and may be returned to callers as-is. value is None when
+        there is nothing to revalidate or serve.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None, False
+            servable = self._servable_stale(entry, time.time())
+            if entry.etag is None and not servable:
+                return None, None, False
+            return entry.value, entry.etag, servable
+
+    def revalidate(self, key, etag):
+        """Restart the TTL of an entry the store confirmed is unchanged."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                return False
+            entry.stored_at = time.time()
+            self._entries.move_to_end(key)
+            self._revalidations += 1
+            return True
+
+    def set(self, key, value, size, etag=None, stored_at=None):
+        """Cache value. stored_at backdates the entry (e.g. when loading a
+        persisted copy) so it expires and revalidates on its original clock."""
+        if size > self.max_bytes:
+            # Never let one oversized document flush the whole cache
+            self.pop(key)
+            return
+        family = self.family_for(key)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(value, size, family, stored_at or time.time(), etag)
+            self._bytes += size
+            self._evict_to_budget()
+
+    def set_missing(self, key):
+        """Remember that the store has no object under key."""
+        self.set(key, MISSING, _MISSING_SIZE)
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'revalidations': self._revalidations,
+                'negative_hits': self._negative_hits,
+            }
+
+    # Callers must hold self._lock for the helpers below
+
+    def _expired(self, entry, now):
+        if entry.value is MISSING:
+            return now - entry.stored_at >= self.negative_ttl
+        return now - entry.stored_at >= self.ttls.get(entry.family, 0)
+
+    def _servable_stale(self, entry, now):
+        if entry.value is MISSING:
+            return False
+        age = now - entry.stored_at
+        return age < self.ttls.get(entry.family, 0) + self.max_stale.get(entry.family, 0)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict_to_budget(self):
+        if self._bytes <= self.max_bytes:
+            return
+        # Expired entries go first, then least recently used
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+            self._drop(key)
+            self._expirations += 1
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self._evictions += 1
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key runs fn(); callers arriving while it is in
+    flight wait for its result instead of repeating the work. A waiter that
+    has not seen a result after `timeout` seconds stops waiting and runs
+    fn() itself, so one stuck fetch cannot stall every request for that key.
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._leaders += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            return fn()
+        with self._lock:
+            self._coalesced += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self._leaders,
+                'coalesced': self._coalesced,
+                'timeouts': self._timeouts,
+            }
+
+
+class BackgroundRefresher:
+    """Small thread pool that reloads stale cache entries off the request path.
+
+    submit(key, fn) schedules fn() unless a refresh for key is already
+    queued or running, and counts each call as a stale read served.
+    """
+
+    def __init__(self, max_workers=2):
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-refresh')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stale_served = 0
+        self._refreshes = 0
+        self._errors = 0
+
+    def submit(self, key, fn):
+        with self._lock:
+            self._stale_served += 1
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, key, fn)
+
+    def _run(self, key, fn):
+        try:
+            fn()
+            with self._lock:
+                self._refreshes += 1
+        except Exception as e:
+            print(f"Background refresh failed for {key}: {e}")
+            with self._lock:
+                self._errors += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stale_served': self._stale_served,
+                'refreshes': self._refreshes,
+                'refresh_errors': self._errors,
+                'pending': len(self._pending),
+            }
@@ -0,0 +1,154 @@
+"""
+Persistent on-disk L2 cache for Love-Matcher storage reads
+
+Sits under the in-memory TTLCache so a restarted API server starts warm.
+Entries hold the stored object body (as written, codec and all), its ETag
+and when it was fetched, in a local SQLite database. handlers.py treats an
+L2 hit exactly like an L1 entry with the same age: still inside its
+family's TTL it is served as-is, older than that it is revalidated with a
+conditional GET (If-None-Match) on first use.
+
+Reads of keys worth preloading are also recorded in an access log; at
+startup warm_keys() lists the most recently used ones so they can be
+loaded and revalidated before traffic arrives.
+"""
+
+import threading
+import time
+
+import sqlite_util
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    metadata TEXT,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+CREATE TABLE IF NOT EXISTS access_log (
+    key TEXT PRIMARY KEY,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS access_log_accessed_at ON access_log (accessed_at);
+"""
+
+
+class DiskCache:
+    """Byte-bounded persistent cache of raw object bodies keyed like L1."""
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, access_flush_interval=5.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.access_flush_interval = access_flush_interval
+        self._conn = sqlite_util.ThreadLocalConnection(path)
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._last_access_flush = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        self._bytes = conn.execute('SELECT COALESCE(SUM(length(body)), 0) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        """Return (body, etag, metadata_json, stored_at) or None."""
+        conn = self._conn()
+        row = conn.execute('SELECT body, etag, metadata, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with conn:
+            conn.execute('UPDATE entries SET used_at = ? WHERE key = ?', (time.time(), key))
+        return row
+
+    def set(self, key, body, etag, metadata=None, stored_at=None):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            old = conn.execute('SELECT length(body) FROM entries WHERE key = ?', (key,)).fetchone()
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, body, etag, metadata, stored_at, used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, etag, metadata, stored_at or now, now)
+            )
+        with self._lock:
+            self._bytes += len(body) - (old[0] if old else 0)
+            self.writes += 1
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def touch(self, key, stored_at=None):
+        """Restart an entry's age after the store confirmed it unchanged."""
+        conn = self._conn()
+        with conn:
+            conn.execute('UPDATE entries SET stored_at = ? WHERE key = ?', (stored_at or time.time(), key))
+
+    def pop(self, key):
+        conn = self._conn()
+        with conn:
+            old = conn.execute('SELECT length(body) FROM entries WHERE key = ?', (key,)).fetchone()
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        if old:
+            with self._lock:
+                self._bytes -= old[0]
+
+    def _evict(self):
+        """Drop least recently used entries until back under 90% of budget."""
+        conn = self._conn()
+        target = self.max_bytes * 0.9
+        with conn:
+            rows = conn.execute('SELECT key, length(body) FROM entries ORDER BY used_at').fetchall()
+            dropped = []
+            with self._lock:
+                for key, size in rows:
+                    if self._bytes <= target:
+                        break
+                    dropped.append((key,))
+                    self._bytes -= size
+                self.evictions += len(dropped)
+            conn.executemany('DELETE FROM entries WHERE key = ?', dropped)
+
+    # -- access log ----------------------------------------------------------
+
+    def record_access(self, key):
+        """Note that key was read; batched to disk every few seconds."""
+        now = time.time()
+        with self._lock:
+            self._accessed[key] = now
+            if now - self._last_access_flush < self.access_flush_interval:
+                return
+            batch, self._accessed = self._accessed, {}
+            self._last_access_flush = now
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO access_log (key, accessed_at) VALUES (?, ?)',
+                             list(batch.items()))
+
+    def warm_keys(self, limit, max_age):
+        """Most recently accessed keys, newest first, seen within max_age seconds."""
+        return [row[0] for row in self._conn().execute(
+            'SELECT key FROM access_log WHERE accessed_at >= ? ORDER BY accessed_at DESC LIMIT ?',
+            (time.time() - max_age, limit)
+        )]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,211 @@
+"""
+Local text embeddings and approximate nearest-neighbour candidate retrieval
+
+Profile dimensions are free text written by the chat LLM, which exact rule
+matching mostly misses. This module turns each profile's dimensions into a
+hashed character n-gram TF-IDF vector (CPU only, no model download) and
+finds the most similar candidates with an IVF index over NumPy:
+
+    - embed_text() hashes every 3-5 character n-gram of the lowered text
+      into `dim` buckets (sublinear term frequency)
+    - EmbeddingCache keeps those vectors in SQLite keyed by a hash of the
+      text, so unchanged profiles are never re-embedded
+    - ProfileEmbeddings applies IDF weights computed over the run's
+      profiles and L2-normalizes, so a dot product is cosine similarity
+    - IVFIndex clusters one bucket of vectors with spherical k-means and
+      answers top-k queries by scanning only the closest clusters
+
+Needs the optional `numpy` package (check HAVE_NUMPY).
+"""
+
+import hashlib
+import math
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import sqlite_util
+
+HAVE_NUMPY = np is not None
+
+# Part of every cache key; bump when embed_text() changes
+EMBEDDING_VERSION = 1
+NGRAM_SIZES = (3, 4, 5)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    text_hash TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vectors_used_at ON vectors (used_at);
+"""
+
+
+def profile_text(profile):
+    """The text embedded for a profile: its dimensions, one per line."""
+    dims = profile.get('dimensions', {})
+    if not isinstance(dims, dict):
+        return ''
+    return '\n'.join(f"{key}: {value}" for key, value in sorted(dims.items()) if value)
+
+
+def text_hash(text, dim):
+    return hashlib.sha256(f"v{EMBEDDING_VERSION}:{dim}:{text}".encode('utf-8')).hexdigest()[:32]
+
+
+def embed_text(text, dim):
+    """Hashed character n-gram term frequencies (1 + log tf), float32[dim]."""
+    vector = np.zeros(dim, dtype=np.float32)
+    text = ' '.join(text.lower().split())
+    if not text:
+        return vector
+    counts = {}
+    padded = f" {text} ".encode('utf-8')
+    for n in NGRAM_SIZES:
+        for start in range(len(padded) - n + 1):
+            bucket = zlib.crc32(padded[start:start + n]) % dim
+            counts[bucket] = counts.get(bucket, 0) + 1
+    buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    vector[buckets] = 1 + np.log(tf)
+    return vector
+
+
+class EmbeddingCache:
+    """SQLite-backed store of raw (pre-IDF) vectors keyed by text hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite_util.ThreadLocalConnection(path)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def get_many(self, hashes):
+        """{text_hash: float32 vector} for the hashes that are cached."""
+        conn = self._conn()
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM vectors WHERE text_hash IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((h, np.frombuffer(blob, dtype=np.float32)) for h, blob in rows)
+        if found:
+            with conn:
+                conn.executemany('UPDATE vectors SET used_at = ? WHERE text_hash = ?',
+                                 [(time.time(), h) for h in found])
+        return found
+
+    def set_many(self, items):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO vectors (text_hash, vector, used_at) VALUES (?, ?, ?)',
+                             [(h, v.astype(np.float32).tobytes(), now) for h, v in items])
+
+    def prune(self, max_age):
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute('DELETE FROM vectors WHERE used_at < ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+
+class ProfileEmbeddings:
+    """
+    TF-IDF vectors for a run's profiles (rows follow `profiles`), built
+    from cached raw vectors where possible.
+    """
+
+    def __init__(self, profiles, dim=256, cache=None):
+        self.profiles = list(profiles)
+        self.dim = dim
+        texts = [profile_text(p) for p in self.profiles]
+        hashes = [text_hash(t, dim) for t in texts]
+        cached = cache.get_many(set(hashes)) if cache else {}
+        self.cached = sum(1 for h in hashes if h in cached)
+
+        computed = {}
+        raw = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, (text, h) in enumerate(zip(texts, hashes)):
+            vector = cached.get(h)
+            if vector is None:
+                vector = computed.get(h)
+                if vector is None:
+                    vector = computed[h] = embed_text(text, dim)
+            raw[row] = vector
+        self.computed = len(computed)
+        if cache and computed:
+            cache.set_many(computed.items())
+
+        df = (raw > 0).sum(axis=0)
+        idf = np.log((1 + len(texts)) / (1 + df)).astype(np.float32) + 1
+        vectors = raw * idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1, norms)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over unit vectors. Spherical k-means (seeded, so
+    runs are reproducible) splits them into ~sqrt(N) lists; a query scans
+    the n_probe lists whose centroids are closest, adding more lists when
+    too few accepted results turn up. Below exact_below vectors a single
+    list is kept and every query is exact.
+    """
+
+    def __init__(self, vectors, n_lists=None, n_probe=8, iterations=8, seed=0, exact_below=1000):
+        self.vectors = vectors
+        n = len(vectors)
+        self.n_probe = n_probe
+        n_lists = n_lists or max(1, int(math.sqrt(n)))
+        if n < max(4 * n_lists, exact_below) or n_lists == 1:
+            self.centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+            self.lists = [np.arange(n)]
+            return
+        rng = np.random.RandomState(seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            # An emptied list keeps its old centroid
+            centroids = np.where(norms[:, None] > 0, sums / np.where(norms == 0, 1, norms)[:, None], centroids)
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+
+    def search(self, query, k, accept=None):
+        """
+        Rows of the k most similar accepted vectors, best first (ties by
+        row), and how many vectors were compared.
+        """
+        list_order = np.argsort(-(self.centroids @ query), kind='stable')
+        found, compared, probed = [], 0, 0
+        while probed < len(list_order):
+            probe = list_order[probed:probed + (self.n_probe if not probed else len(list_order))]
+            probed += len(probe)
+            members = np.sort(np.concatenate([self.lists[c] for c in probe]))
+            compared += len(members)
+            scores = self.vectors[members] @ query
+            accepted = 0
+            for i in np.argsort(-scores, kind='stable'):
+                row = int(members[i])
+                if accept is None or accept(row):
+                    found.append((-float(scores[i]), row))
+                    accepted += 1
+                    if accepted == k:
+                        break
+            if len(found) >= k:
+                break
+        found.sort()
+        return [row for _, row in found[:k]], compared
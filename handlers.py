@@ -1,19 +1,30 @@
-from flask import request, jsonify
+from flask import request, jsonify, g, has_request_context
 from functools import wraps
 import jwt
 from datetime import datetime, timedelta
 import json
 import requests
 import bcrypt
+import copy
 import time
 import os
 import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from werkzeug.utils import secure_filename
+from botocore.exceptions import ClientError
 
 import config
+import journal
+import match_state
 import prompts
+import serialization
+import shared_cache
+import storage
+from cache import TTLCache, SingleFlight, BackgroundRefresher, MISSING
+from disk_cache import DiskCache
 
 ADMIN_USER_ID = 'lovedashmatcher_love-matcher_com'
 
@@ -31,26 +42,124 @@ ALLOWED_PHOTO_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_PHOTO_SIZE = 5 * 1024 * 1024  # 5MB
 MAX_PHOTOS_PER_USER = 3
 
-# In-memory TTL cache
-_s3_cache: dict = {}
-_s3_cache_ts: dict = {}
-
-_TTL_PROFILE = 60      # seconds
-_TTL_MEMBER_LIST = 300
-_TTL_CHAT = 10
-_TTL_MATCH = 600
-
-
-def _ttl_for(key: str) -> float:
+# Optional cache shared by all workers/nodes, with invalidation broadcast
+_shared_cache = shared_cache.from_config()
+
+# In-memory TTL cache. With the shared tier's invalidations in place,
+# per-process copies can live much longer.
+if _shared_cache is None:
+    _TTL_PROFILE = 60      # seconds
+    _TTL_MEMBER_LIST = 300
+    _TTL_CHAT = 10
+    _TTL_MATCH = 600
+else:
+    _TTL_PROFILE = 900
+    _TTL_MEMBER_LIST = 900
+    _TTL_CHAT = 300
+    _TTL_MATCH = 1800
+_TTL_MISSING = getattr(config, 'S3_CACHE_MISSING_TTL', 10)
+
+S3_CACHE_MAX_BYTES = getattr(config, 'S3_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+# How long past its TTL a family may be served while it refreshes in the background
+S3_CACHE_MAX_STALE = getattr(config, 'S3_CACHE_MAX_STALE', {
+    'member_list': 600,
+    'profile': 30,
+})
+
+
+def _family_for(key: str) -> str:
     if 'profiles/' in key:
-        return _TTL_PROFILE
+        return 'profile'
     if key == MEMBER_LIST_KEY:
-        return _TTL_MEMBER_LIST
+        return 'member_list'
     if 'chat/' in key or 'topics/' in key or 'match_topics/' in key:
-        return _TTL_CHAT
+        return 'chat'
     if 'matches/' in key:
-        return _TTL_MATCH
-    return _TTL_PROFILE
+        return 'match'
+    return 'default'
+
+
+_s3_cache = TTLCache(
+    max_bytes=S3_CACHE_MAX_BYTES,
+    ttls={
+        'profile': _TTL_PROFILE,
+        'member_list': _TTL_MEMBER_LIST,
+        'chat': _TTL_CHAT,
+        'match': _TTL_MATCH,
+        'default': _TTL_PROFILE,
+    },
+    family_for=_family_for,
+    negative_ttl=_TTL_MISSING,
+    max_stale=S3_CACHE_MAX_STALE,
+)
+
+# Persistent L2 under _s3_cache so restarts start warm. Opt-in: it keeps
+# profiles (password hashes, emails) and chat topics on local disk
+S3_DISK_CACHE_PATH = getattr(config, 'S3_DISK_CACHE_PATH', None)
+S3_DISK_CACHE_MAX_BYTES = getattr(config, 'S3_DISK_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+_disk_cache = DiskCache(S3_DISK_CACHE_PATH, S3_DISK_CACHE_MAX_BYTES) if S3_DISK_CACHE_PATH else None
+
+# Startup warm-up: preload the most recently read profiles / topic indexes
+S3_CACHE_WARM_KEYS = getattr(config, 'S3_CACHE_WARM_KEYS', 500)
+S3_CACHE_WARM_MAX_AGE = getattr(config, 'S3_CACHE_WARM_MAX_AGE', 24 * 3600)
+
+
+def _evict_cached(key):
+    _s3_cache.pop(key)
+    if _disk_cache is not None:
+        _disk_cache.pop(key)
+
+
+def _remember_missing(key):
+    """Negative-cache key. Profiles are only cached as missing when the
+    shared tier is on: without its invalidations, a user who registers on
+    another worker would be refused here until the entry expired."""
+    if _shared_cache is None and _family_for(key) == 'profile':
+        _s3_cache.pop(key)
+    else:
+        _s3_cache.set_missing(key)
+
+
+def _evict_everywhere(key):
+    """Drop key from every cache tier, e.g. after a write conflict showed
+    the version they hold is out of date."""
+    _evict_cached(key)
+    if _shared_cache is not None:
+        _shared_cache.delete(key)
+
+
+if _shared_cache is not None:
+    # Another worker or node wrote/deleted this key: drop our copies
+    _shared_cache.subscribe(_evict_cached)
+_s3_refresher = BackgroundRefresher(max_workers=getattr(config, 'S3_CACHE_REFRESH_WORKERS', 2))
+
+# Shared pool for concurrent storage I/O (bulk reads/writes, end-of-request flushes)
+S3_IO_WORKERS = getattr(config, 'S3_IO_WORKERS', 8)
+_s3_io_pool = ThreadPoolExecutor(max_workers=S3_IO_WORKERS, thread_name_prefix='s3-io')
+
+# Concurrent misses on the same key share one storage fetch
+S3_FETCH_WAIT_TIMEOUT = getattr(config, 'S3_FETCH_WAIT_TIMEOUT', 5.0)
+_s3_flight = SingleFlight(timeout=S3_FETCH_WAIT_TIMEOUT)
+
+# Families written conditionally on the ETag they were read at, so
+# concurrent workers cannot silently overwrite each other's changes
+S3_VERSIONED_FAMILIES = getattr(config, 'S3_VERSIONED_FAMILIES', {'profile'})
+S3_WRITE_RETRIES = getattr(config, 'S3_WRITE_RETRIES', 5)
+
+# Optional local write-ahead journal: writes to unversioned families are
+# fsync'd locally and uploaded in the background (see journal.py).
+# Versioned families always write through so If-Match keeps working.
+STORAGE_JOURNAL_DIR = getattr(config, 'STORAGE_JOURNAL_DIR', None)
+_journal = None  # WriteJournal, started in register_routes
+
+# Leave a matching/dirty/ marker when a save changes a profile's matching
+# state, for incremental matching runs (see match_state.py)
+MATCH_DIRTY_MARKERS = getattr(config, 'MATCH_DIRTY_MARKERS', True)
+
+
+def _ttl_for(key: str) -> float:
+    return _s3_cache.ttl_for(key)
 
 # JWT decorator for email-password authentication
 def token_required(f):
@@ -74,28 +183,412 @@ def token_required(f):
     return decorated
 
 # Helper functions
+def _client_error_status(e):
+    return e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+
+def _is_missing_key_error(e):
+    return e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404')
+
+class _RequestUnitOfWork:
+    """Per-request identity map and write buffer.
+
+    Each key is read from the cache/store at most once per request and every
+    later s3_get returns the same object. s3_put calls are held in `pending`
+    (last write per key wins) and flushed together once the handler returns.
+
+    `versions` remembers the ETag each key was read at so versioned keys are
+    flushed conditionally. Keys changed only through s3_update keep their
+    mutations, which are replayed onto the latest copy if the write conflicts.
+    `fingerprints` holds each profile's matching state as read, so a flush
+    can tell whether the save needs a dirty marker.
+    """
+
+    def __init__(self):
+        self.identity = {}
+        self.versions = {}
+        self.pending = {}
+        self.mutations = {}
+        self.overwritten = set()
+        self.fingerprints = {}
+        self.reads_local = 0
+        self.reads_fetched = 0
+        self.writes_buffered = 0
+        self.writes_flushed = 0
+        self.writes_merged = 0
+
+def _unit_of_work():
+    if not has_request_context():
+        return None
+    uow = g.get('s3_unit_of_work')
+    if uow is None:
+        uow = g.s3_unit_of_work = _RequestUnitOfWork()
+    return uow
+
 def s3_get(key):
-    cached = _s3_cache.get(key)
-    if cached is not None and time.time() - _s3_cache_ts.get(key, 0) < _ttl_for(key):
-        return cached
+    uow = _unit_of_work()
+    if uow is None:
+        return _s3_get_shared(key)
+    if key in uow.identity:
+        uow.reads_local += 1
+        return uow.identity[key]
+    data, etag = _s3_get_versioned(key)
+    return _remember_read(uow, key, data, etag)
+
+def _remember_read(uow, key, data, etag):
+    """Record a read in the identity map and return the request's copy.
+    The cached object is shared by every request, and handlers edit in
+    place, so each request works on its own copy until it flushes."""
+    data = copy.deepcopy(data)
+    uow.identity[key] = data
+    uow.versions[key] = etag
+    if _family_for(key) == 'profile':
+        uow.fingerprints[key] = match_state.matching_fingerprint(data)
+    uow.reads_fetched += 1
+    return data
+
+def s3_get_many(keys):
+    """Fetch several keys concurrently; results follow the order of keys."""
+    uow = _unit_of_work()
+    results = [None] * len(keys)
+    to_fetch = {}
+    for i, key in enumerate(keys):
+        if uow is not None and key in uow.identity:
+            uow.reads_local += 1
+            results[i] = uow.identity[key]
+        else:
+            to_fetch.setdefault(key, []).append(i)
+    futures = {key: _s3_io_pool.submit(_s3_get_versioned, key) for key in to_fetch}
+    for key, future in futures.items():
+        data, etag = future.result()
+        if uow is not None:
+            data = _remember_read(uow, key, data, etag)
+        for i in to_fetch[key]:
+            results[i] = data
+    return results
+
+def _s3_get_shared(key):
+    return _s3_get_versioned(key)[0]
+
+def _s3_get_versioned(key):
+    """Return (data, etag) for key; etag is None when the key is missing."""
+    if _disk_cache is not None and _is_warmable(key):
+        _disk_cache.record_access(key)
+    cached, etag = _s3_cache.get_versioned(key)
+    if cached is MISSING:
+        return None, None
+    if cached is not None:
+        return cached, etag
+    stale, etag, servable = _s3_cache.get_stale(key)
+    if servable:
+        _s3_refresher.submit(key, lambda: _s3_flight.do(key, lambda: _s3_fetch(key)))
+        return stale, etag
+    return _s3_flight.do(key, lambda: _s3_fetch(key))
+
+def _is_warmable(key):
+    return _family_for(key) in ('profile', 'member_list') or \
+        (key.startswith('topics/') and key.endswith('/index.json'))
+
+def _persist(key, body, etag, metadata):
+    if _disk_cache is not None and etag:
+        _disk_cache.set(key, body, etag, json.dumps(metadata) if metadata else None)
+
+def _s3_load_persisted(key):
+    """Copy key's L2 entry into _s3_cache on its original clock.
+    Returns (data, etag, fresh), or None if L2 has no copy."""
+    row = _disk_cache.get(key)
+    if row is None:
+        return None
+    body, etag, metadata, stored_at = row
+    plain = serialization.decompress(body, json.loads(metadata) if metadata else None)
+    data = serialization.loads(plain)
+    _s3_cache.set(key, data, len(plain), etag=etag, stored_at=stored_at)
+    return data, etag, time.time() - stored_at < _s3_cache.ttl_for(key)
+
+def _s3_revalidated(key, etag):
+    _s3_cache.revalidate(key, etag)
+    if _disk_cache is not None:
+        _disk_cache.touch(key)
+
+def _object_key(key):
+    """Full storage key for a logical key under the configured layout."""
+    return f"{S3_PREFIX}{storage.physical_key(key)}"
+
+def _journaled(key):
+    return _journal is not None and _family_for(key) not in S3_VERSIONED_FAMILIES
+
+def _s3_fetch(key):
+    if _journaled(key):
+        # Our own write may not have reached the store yet
+        pending = _journal.get(_object_key(key))
+        if pending is not None:
+            op, body, metadata, pending_etag = pending
+            if op == 'delete':
+                _remember_missing(key)
+                return None, None
+            plain = serialization.decompress(body, metadata)
+            data = serialization.loads(plain)
+            _s3_cache.set(key, data, len(plain), etag=pending_etag)
+            return data, pending_etag
+    # Expired entry with an ETag: ask the store whether it changed
+    stale, etag, _ = _s3_cache.get_stale(key)
+    if etag is None and _disk_cache is not None:
+        persisted = _s3_load_persisted(key)
+        if persisted is not None:
+            stale, etag, fresh = persisted
+            if fresh:
+                return stale, etag
+    if _shared_cache is not None:
+        shared = _shared_cache.get(key)
+        if shared is not None:
+            body, shared_etag = shared
+            if etag and shared_etag == etag:
+                _s3_revalidated(key, etag)
+                return stale, etag
+            plain = serialization.decompress(body)
+            data = serialization.loads(plain)
+            _s3_cache.set(key, data, len(plain), etag=shared_etag)
+            _persist(key, body, shared_etag, None)
+            return data, shared_etag
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
-        data = json.loads(response['Body'].read())
-        _s3_cache[key] = data
-        _s3_cache_ts[key] = time.time()
-        return data
+        if etag:
+            response = storage.get_object(s3_client, S3_BUCKET, S3_PREFIX, key, IfNoneMatch=etag)
+        else:
+            response = storage.get_object(s3_client, S3_BUCKET, S3_PREFIX, key)
+        body = response['Body'].read()
+        plain = serialization.decompress(body, response.get('Metadata'))
+        data = serialization.loads(plain)
+        _s3_cache.set(key, data, len(plain), etag=response.get('ETag'))
+        _persist(key, body, response.get('ETag'), response.get('Metadata'))
+        if _shared_cache is not None:
+            # A write may have landed since this read began; never replace its entry
+            _shared_cache.add(key, body, response.get('ETag'), _s3_cache.ttl_for(key))
+        return data, response.get('ETag')
+    except ClientError as e:
+        if etag and _client_error_status(e) == 304:
+            _s3_revalidated(key, etag)
+            return stale, etag
+        if _is_missing_key_error(e):
+            # Only a confirmed NoSuchKey is cached; transient errors are not
+            _remember_missing(key)
+            if _disk_cache is not None:
+                _disk_cache.pop(key)
+        return None, None
     except:
-        return None
+        return None, None
+
+def _s3_read_latest(key):
+    """Read key straight from the store, bypassing every cache tier.
+    Returns (data, etag), or (None, None) if the key no longer exists."""
+    try:
+        response = storage.get_object(s3_client, S3_BUCKET, S3_PREFIX, key)
+    except ClientError as e:
+        if _is_missing_key_error(e):
+            return None, None
+        raise
+    return serialization.decode(response['Body'].read(), response.get('Metadata')), response.get('ETag')
 
 def s3_put(key, data):
-    s3_client.put_object(
-        Bucket=S3_BUCKET,
-        Key=f"{S3_PREFIX}{key}",
-        Body=json.dumps(data),
-        ContentType='application/json'
-    )
-    _s3_cache[key] = data
-    _s3_cache_ts[key] = time.time()
+    uow = _unit_of_work()
+    if uow is None:
+        _s3_write(key, data)
+        return
+    # Inside a request: buffer and write once when the handler is done
+    uow.identity[key] = data
+    uow.pending[key] = data
+    uow.overwritten.add(key)
+    uow.writes_buffered += 1
+
+def s3_update(key, mutate):
+    """Read-modify-write key without losing concurrent updates.
+
+    mutate(data) edits the document in place and may return False to skip
+    the write. If another writer changed the key first, mutate is re-applied
+    to the latest copy and the write retried, so it must only depend on its
+    argument and values captured when it was created. Returns the updated
+    document, or None if the key does not exist.
+
+    Inside a request the write joins the buffer and the retry happens at
+    flush time; a later plain s3_put of the same key disables the merge.
+    """
+    uow = _unit_of_work()
+    if uow is None:
+        data, etag = _s3_get_versioned(key)
+        data = copy.deepcopy(data)  # never edit the cached object in place
+        for _ in range(S3_WRITE_RETRIES):
+            if data is None or mutate(data) is False:
+                return data
+            try:
+                _s3_write(key, data, etag)
+                return data
+            except storage.WriteConflict:
+                data, etag = _s3_read_latest(key)
+        raise storage.WriteConflict(key)
+    data = s3_get(key)
+    if data is None or mutate(data) is False:
+        return data
+    uow.mutations.setdefault(key, []).append(mutate)
+    uow.pending[key] = data
+    uow.writes_buffered += 1
+    return data
+
+def s3_put_many(items):
+    """Write several (key, data) pairs. Inside a request they join the write
+    buffer; otherwise they are written concurrently and the first failure
+    is raised once every write has finished."""
+    uow = _unit_of_work()
+    if uow is not None:
+        for key, data in items:
+            s3_put(key, data)
+        return
+    futures = [_s3_io_pool.submit(_s3_write, key, data) for key, data in items]
+    errors = []
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+def _s3_write(key, data, expected_etag=storage.UNCONDITIONAL):
+    plain = serialization.dumps(data)
+    body, metadata = serialization.compress(plain)
+    if _journaled(key) and expected_etag is storage.UNCONDITIONAL:
+        response = {'ETag': _journal.put(_object_key(key), body, 'application/json', metadata)}
+    else:
+        response = _s3_write_through(key, body, metadata, expected_etag)
+    _s3_cache.set(key, data, len(plain), etag=response.get('ETag'))
+    _persist(key, body, response.get('ETag'), metadata)
+    if _shared_cache is not None:
+        _shared_cache.set(key, body, response.get('ETag'), _s3_cache.ttl_for(key))
+        _shared_cache.publish_invalidation(key)
+
+def _s3_write_through(key, body, metadata, expected_etag):
+    try:
+        return storage.put_object_versioned(
+            s3_client,
+            expected_etag,
+            Bucket=S3_BUCKET,
+            Key=_object_key(key),
+            Body=body,
+            ContentType='application/json',
+            **serialization.put_kwargs(metadata)
+        )
+    except storage.WriteConflict as e:
+        # Our cached copy is out of date, and so may be the tiers it came from
+        _evict_everywhere(key)
+        raise storage.WriteConflict(key) from e
+
+def _s3_delete_object(key):
+    """Delete key from the store, through the journal when it applies.
+    Legacy-layout copies go too so reads cannot fall back to them."""
+    for physical in storage.physical_keys(key):
+        if _journaled(key):
+            _journal.delete(f"{S3_PREFIX}{physical}")
+        else:
+            s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{physical}")
+    if _family_for(key) == 'profile':
+        _mark_match_dirty(key, 'profile_deleted')
+
+def _mark_match_dirty(key, reason):
+    """Drop a dirty marker for the profile at key (never fails the request)."""
+    user_id = match_state.profile_user_id(key)
+    if not MATCH_DIRTY_MARKERS or not user_id:
+        return
+    try:
+        match_state.mark_dirty(s3_client, S3_BUCKET, S3_PREFIX, user_id, reason)
+    except Exception as e:
+        print(f"⚠️ Failed to mark {user_id} for incremental matching: {e}")
+
+def _s3_mark_deleted(key):
+    _remember_missing(key)
+    if _disk_cache is not None:
+        _disk_cache.pop(key)
+    shared_cache.invalidate(_shared_cache, key)
+    uow = _unit_of_work()
+    if uow is not None:
+        uow.identity[key] = None
+        uow.versions[key] = None
+        uow.pending.pop(key, None)
+        uow.mutations.pop(key, None)
+
+def warm_cache():
+    """Preload recently read keys from L2 and revalidate them against the
+    store, so the first requests after a restart are cache hits."""
+    keys = _disk_cache.warm_keys(S3_CACHE_WARM_KEYS, S3_CACHE_WARM_MAX_AGE)
+    if not keys:
+        return
+    started = time.time()
+    revalidations = _s3_cache.stats()['revalidations']
+    loaded = sum(1 for data in _s3_io_pool.map(_s3_get_shared, keys) if data is not None)
+    print(f"🔥 Cache warm-up: {loaded}/{len(keys)} keys in {time.time() - started:.1f}s "
+          f"({_s3_cache.stats()['revalidations'] - revalidations} revalidated from disk)")
+
+def _flush_key(uow, key, data):
+    """Write one buffered key, replaying its s3_update mutations onto the
+    latest copy after a conflict. Returns the number of merges."""
+    if _family_for(key) not in S3_VERSIONED_FAMILIES:
+        _s3_write(key, data)
+        _note_saved(uow, key, data)
+        return 0
+    expected = uow.versions.get(key, storage.UNCONDITIONAL)
+    mutations = [] if key in uow.overwritten else uow.mutations.get(key, [])
+    merges = 0
+    for _ in range(S3_WRITE_RETRIES):
+        try:
+            _s3_write(key, data, expected)
+            _note_saved(uow, key, data)
+            return merges
+        except storage.WriteConflict:
+            if not mutations:
+                raise
+            data, expected = _s3_read_latest(key)
+            if data is None:
+                return merges  # deleted meanwhile; don't bring it back
+            for mutate in mutations:
+                mutate(data)
+            merges += 1
+    raise storage.WriteConflict(key)
+
+def _note_saved(uow, key, data):
+    """Mark a saved profile dirty if its matching state changed since read."""
+    if _family_for(key) == 'profile' and match_state.matching_fingerprint(data) != uow.fingerprints.get(key):
+        _mark_match_dirty(key, 'profile_saved')
+
+def _flush_pending_writes(uow):
+    """Write every buffered key concurrently. Returns a list of (key, error)."""
+    pending, uow.pending = uow.pending, {}
+    futures = {key: _s3_io_pool.submit(_flush_key, uow, key, data) for key, data in pending.items()}
+    errors = []
+    for key, future in futures.items():
+        try:
+            uow.writes_merged += future.result()
+            uow.writes_flushed += 1
+        except Exception as e:
+            # The cached copies are likely out of date
+            _evict_everywhere(key)
+            errors.append((key, e))
+    return errors
+
+def _finish_request_storage(response):
+    uow = g.get('s3_unit_of_work')
+    if uow is None:
+        return response
+    errors = _flush_pending_writes(uow)
+    if errors:
+        for key, e in errors:
+            print(f"❌ Failed to save {key}: {e}")
+        if all(isinstance(e, storage.WriteConflict) for _, e in errors):
+            response = jsonify({'error': 'Your changes conflicted with another update. Please try again.',
+                                'conflict': True})
+            response.status_code = 409
+        else:
+            response = jsonify({'error': 'Failed to save changes'})
+            response.status_code = 500
+    response.headers['X-Storage-Reads'] = f"local={uow.reads_local}; fetched={uow.reads_fetched}"
+    response.headers['X-Storage-Writes'] = (f"buffered={uow.writes_buffered}; flushed={uow.writes_flushed}; "
+                                            f"merged={uow.writes_merged}")
+    return response
 
 def get_member_count():
     """Get current member count from S3"""
@@ -161,9 +654,7 @@ def upload_photo_to_s3(file, user_id):
             ACL='public-read'
         )
 
-        url = _do_spaces_url(key)
-        _s3_cache[key] = None  # evict stale cache entry if any
-        return url
+        return _do_spaces_url(key)
     except Exception as e:
         print(f"Error uploading photo to DO Spaces: {e}")
         return None
@@ -179,9 +670,7 @@ def delete_photo_from_s3(photo_url):
             # Legacy AWS URL format stored before this fix
             key = photo_url.split('.amazonaws.com/', 1)[1]
         s3_client.delete_object(Bucket=S3_BUCKET, Key=key)
-        cache_key = key.replace(S3_PREFIX, '', 1)
-        _s3_cache.pop(cache_key, None)
-        _s3_cache_ts.pop(cache_key, None)
+        _s3_cache.pop(key.replace(S3_PREFIX, '', 1))
         return True
     except Exception as e:
         print(f"Error deleting photo from DO Spaces: {e}")
@@ -380,6 +869,7 @@ Respond with ONLY a valid JSON array of exactly 3 objects. No other text:
         'topics': []
     }
 
+    writes = []
     for i, topic_spec in enumerate(topics_data[:3]):
         topic_id = f"match_topic_{int(time.time() * 1000) + i}"
         topic_data = {
@@ -399,7 +889,7 @@ Respond with ONLY a valid JSON array of exactly 3 objects. No other text:
                 }
             ]
         }
-        save_match_topic(pair_key, topic_id, topic_data)
+        writes.append((get_match_topic_key(pair_key, topic_id), topic_data))
         index['topics'].append({
             'topic_id': topic_id,
             'title': topic_spec['title'],
@@ -408,7 +898,8 @@ Respond with ONLY a valid JSON array of exactly 3 objects. No other text:
             'message_count': 1
         })
 
-    save_match_topic_index(pair_key, index)
+    writes.append((get_match_topic_index_key(pair_key), index))
+    s3_put_many(writes)
     print(f"Created 3 match topics for {pair_key}")
 
 
@@ -834,8 +1325,9 @@ def chat():
 
     # Only count real messages toward conversation count
     if not is_start:
-        profile['conversation_count'] = profile.get('conversation_count', 0) + 1
-        s3_put(f"profiles/{request.user_id}.json", profile)
+        def count_message(profile):
+            profile['conversation_count'] = profile.get('conversation_count', 0) + 1
+        s3_update(f"profiles/{request.user_id}.json", count_message)
 
     # Resolve topic: use provided, find active, or create new
     topic_data = None
@@ -893,72 +1385,75 @@ def chat():
             ai_response = _re.sub(r'\[SUGGEST_TOPIC:[^\]]+\]', '', ai_response).strip()
 
         # Update profile dimensions from response
-        profile_updated = False
-        user_lower = user_message.lower()
-
-        if 'my name is' in user_lower or 'call me' in user_lower:
-            import re
-            name_match = re.search(r"(?:my name is|call me)\s+([A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)", user_message, re.IGNORECASE)
-            if name_match:
-                profile['name'] = name_match.group(1).strip()
-                profile_updated = True
-
-        if ' in ' in user_lower or 'from ' in user_lower or 'live' in user_lower:
-            import re
-            location_match = re.search(r"(?:in|from|live in|located in)\s+([A-Z][a-zA-Z\s,]+(?:[A-Z]{2})?)", user_message)
-            if location_match:
-                profile['location'] = location_match.group(1).strip()
-                profile_updated = True
-
-        if parsed_response['dimension'] and parsed_response['dimension'] != 'none':
-            if parsed_response['value'] and parsed_response['value'] != 'none':
-                if 'dimensions' not in profile:
-                    profile['dimensions'] = {}
-                profile['dimensions'][parsed_response['dimension']] = parsed_response['value']
-
-                if parsed_response['dimension'] == 'name':
-                    profile['name'] = str(parsed_response['value'])
+        def apply_profile_updates(profile):
+            profile_updated = False
+            user_lower = user_message.lower()
+
+            if 'my name is' in user_lower or 'call me' in user_lower:
+                import re
+                name_match = re.search(r"(?:my name is|call me)\s+([A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)", user_message, re.IGNORECASE)
+                if name_match:
+                    profile['name'] = name_match.group(1).strip()
                     profile_updated = True
-                elif parsed_response['dimension'] == 'location':
-                    profile['location'] = str(parsed_response['value'])
+
+            if ' in ' in user_lower or 'from ' in user_lower or 'live' in user_lower:
+                import re
+                location_match = re.search(r"(?:in|from|live in|located in)\s+([A-Z][a-zA-Z\s,]+(?:[A-Z]{2})?)", user_message)
+                if location_match:
+                    profile['location'] = location_match.group(1).strip()
                     profile_updated = True
-                elif parsed_response['dimension'] == 'age':
-                    try:
-                        profile['age'] = int(parsed_response['value'])
+
+            if parsed_response['dimension'] and parsed_response['dimension'] != 'none':
+                if parsed_response['value'] and parsed_response['value'] != 'none':
+                    if 'dimensions' not in profile:
+                        profile['dimensions'] = {}
+                    profile['dimensions'][parsed_response['dimension']] = parsed_response['value']
+
+                    if parsed_response['dimension'] == 'name':
+                        profile['name'] = str(parsed_response['value'])
                         profile_updated = True
-                    except (ValueError, TypeError):
-                        pass
-                elif parsed_response['dimension'] == 'about':
-                    profile['about'] = str(parsed_response['value'])
+                    elif parsed_response['dimension'] == 'location':
+                        profile['location'] = str(parsed_response['value'])
+                        profile_updated = True
+                    elif parsed_response['dimension'] == 'age':
+                        try:
+                            profile['age'] = int(parsed_response['value'])
+                            profile_updated = True
+                        except (ValueError, TypeError):
+                            pass
+                    elif parsed_response['dimension'] == 'about':
+                        profile['about'] = str(parsed_response['value'])
+                        profile_updated = True
+
+                    if parsed_response['dimension'] == 'gender':
+                        gender_value = str(parsed_response['value']).lower()
+                        if 'male' in gender_value and 'female' not in gender_value:
+                            profile['gender'] = 'male'
+                        elif 'female' in gender_value:
+                            profile['gender'] = 'female'
+                        else:
+                            profile['gender'] = gender_value
+
+                    if parsed_response['dimension'] == 'seeking_gender':
+                        seeking_value = str(parsed_response['value']).lower()
+                        if 'male' in seeking_value and 'female' not in seeking_value:
+                            profile['seeking_gender'] = 'male'
+                        elif 'female' in seeking_value:
+                            profile['seeking_gender'] = 'female'
+                        else:
+                            profile['seeking_gender'] = seeking_value
+
+                    dimensions_count = len(profile['dimensions'])
+                    profile['completion_percentage'] = round((dimensions_count / 29) * 100)
+                    if dimensions_count >= 29:
+                        profile['profile_complete'] = True
                     profile_updated = True
+            return profile_updated
 
-                if parsed_response['dimension'] == 'gender':
-                    gender_value = str(parsed_response['value']).lower()
-                    if 'male' in gender_value and 'female' not in gender_value:
-                        profile['gender'] = 'male'
-                    elif 'female' in gender_value:
-                        profile['gender'] = 'female'
-                    else:
-                        profile['gender'] = gender_value
-
-                if parsed_response['dimension'] == 'seeking_gender':
-                    seeking_value = str(parsed_response['value']).lower()
-                    if 'male' in seeking_value and 'female' not in seeking_value:
-                        profile['seeking_gender'] = 'male'
-                    elif 'female' in seeking_value:
-                        profile['seeking_gender'] = 'female'
-                    else:
-                        profile['seeking_gender'] = seeking_value
-
-                dimensions_count = len(profile['dimensions'])
-                profile['completion_percentage'] = round((dimensions_count / 29) * 100)
-                if dimensions_count >= 29:
-                    profile['profile_complete'] = True
-                profile_updated = True
-                print(f"Updated dimension '{parsed_response['dimension']}' in topic '{topic_data['title']}'")
-
-        if profile_updated:
-            s3_put(f"profiles/{request.user_id}.json", profile)
+        s3_update(f"profiles/{request.user_id}.json", apply_profile_updates)
+        if parsed_response['dimension'] and parsed_response['dimension'] != 'none' \
+                and parsed_response['value'] and parsed_response['value'] != 'none':
+            print(f"Updated dimension '{parsed_response['dimension']}' in topic '{topic_data['title']}'")
 
     elif llm_response and 'error' in llm_response:
         print(f"LLM error in chat: {llm_response['error']}")
@@ -1127,9 +1622,8 @@ def delete_topic_handler(topic_id):
     # Delete topic data file from S3
     try:
         key = get_topic_key(request.user_id, topic_id)
-        s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
-        _s3_cache.pop(key, None)
-        _s3_cache_ts.pop(key, None)
+        _s3_delete_object(key)
+        _s3_mark_deleted(key)
     except Exception as e:
         print(f"Error deleting topic file: {e}")
     return jsonify({'success': True, 'topic_id': topic_id})
@@ -1300,6 +1794,13 @@ Only respond if you have something genuinely useful to add. If the conversation
     })
 
 
+def _remove_from_pool(profile, user_id):
+    """Drop user_id from profile's match pool and pair choice (s3_update mutation)."""
+    profile['match_pool'] = [e for e in profile.get('match_pool', []) if e.get('user_id') != user_id]
+    if profile.get('pair_choice') == user_id:
+        profile['pair_choice'] = None
+        profile['pair_choice_at'] = None
+
 def get_mutual_pair_id(profile):
     """Return the user_id this user is mutually paired with, or None."""
     my_choice = profile.get('pair_choice')
@@ -1331,11 +1832,11 @@ def get_matches():
     matches_out = []
     paired_with_id = None
 
-    for entry in match_pool:
-        other_id = entry.get('user_id')
-        if not other_id:
-            continue
-        other = s3_get(f"profiles/{other_id}.json")
+    pool_entries = [e for e in match_pool if e.get('user_id')]
+    pool_profiles = s3_get_many([f"profiles/{e['user_id']}.json" for e in pool_entries])
+
+    for entry, other in zip(pool_entries, pool_profiles):
+        other_id = entry['user_id']
         if not other:
             continue
 
@@ -1456,17 +1957,16 @@ Write 3–4 paragraphs that paint a vivid, honest portrait of who this person is
 @token_required
 def toggle_matching_active():
     """Toggle user's active/inactive status for matching"""
-    profile = s3_get(f"profiles/{request.user_id}.json")
-    if not profile:
-        return jsonify({'error': 'Profile not found'}), 404
-    
     data = request.json
     active = data.get('active', True)
-    
-    profile['matching_active'] = active
-    profile['matching_active_updated_at'] = datetime.utcnow().isoformat()
-    
-    s3_put(f"profiles/{request.user_id}.json", profile)
+    now = datetime.utcnow().isoformat()
+
+    def set_active(profile):
+        profile['matching_active'] = active
+        profile['matching_active_updated_at'] = now
+
+    if not s3_update(f"profiles/{request.user_id}.json", set_active):
+        return jsonify({'error': 'Profile not found'}), 404
     
     return jsonify({
         'matching_active': active,
@@ -1489,9 +1989,13 @@ def pair_match():
     if not any(e.get('user_id') == target_id for e in pool):
         return jsonify({'error': 'That user is not in your match pool'}), 400
 
-    profile['pair_choice'] = target_id
-    profile['pair_choice_at'] = datetime.utcnow().isoformat()
-    s3_put(f"profiles/{request.user_id}.json", profile)
+    now = datetime.utcnow().isoformat()
+
+    def choose(profile):
+        profile['pair_choice'] = target_id
+        profile['pair_choice_at'] = now
+
+    s3_update(f"profiles/{request.user_id}.json", choose)
 
     other = s3_get(f"profiles/{target_id}.json")
     mutual = bool(other and other.get('pair_choice') == request.user_id)
@@ -1520,13 +2024,12 @@ def pair_match():
 @token_required
 def unpair_match():
     """Clear your pairing choice, locking the conversation."""
-    profile = s3_get(f"profiles/{request.user_id}.json")
-    if not profile:
-        return jsonify({'error': 'Profile not found'}), 404
+    def clear_choice(profile):
+        profile['pair_choice'] = None
+        profile['pair_choice_at'] = None
 
-    profile['pair_choice'] = None
-    profile['pair_choice_at'] = None
-    s3_put(f"profiles/{request.user_id}.json", profile)
+    if not s3_update(f"profiles/{request.user_id}.json", clear_choice):
+        return jsonify({'error': 'Profile not found'}), 404
 
     return jsonify({'success': True, 'message': 'Pairing removed. Choose another match anytime.'})
 
@@ -1539,28 +2042,23 @@ def dismiss_match():
     if not target_id:
         return jsonify({'error': 'user_id required'}), 400
 
-    profile = s3_get(f"profiles/{request.user_id}.json")
-    if not profile:
-        return jsonify({'error': 'Profile not found'}), 404
+    user_id = request.user_id
 
-    profile['match_pool'] = [e for e in profile.get('match_pool', []) if e.get('user_id') != target_id]
-    if 'rejected_matches' not in profile:
-        profile['rejected_matches'] = []
-    if target_id not in profile['rejected_matches']:
-        profile['rejected_matches'].append(target_id)
-    if profile.get('pair_choice') == target_id:
-        profile['pair_choice'] = None
-        profile['pair_choice_at'] = None
-    s3_put(f"profiles/{request.user_id}.json", profile)
+    def reject(profile):
+        profile['match_pool'] = [e for e in profile.get('match_pool', []) if e.get('user_id') != target_id]
+        if 'rejected_matches' not in profile:
+            profile['rejected_matches'] = []
+        if target_id not in profile['rejected_matches']:
+            profile['rejected_matches'].append(target_id)
+        if profile.get('pair_choice') == target_id:
+            profile['pair_choice'] = None
+            profile['pair_choice_at'] = None
+
+    if not s3_update(f"profiles/{user_id}.json", reject):
+        return jsonify({'error': 'Profile not found'}), 404
 
     # Remove this user from the other person's pool too
-    other = s3_get(f"profiles/{target_id}.json")
-    if other:
-        other['match_pool'] = [e for e in other.get('match_pool', []) if e.get('user_id') != request.user_id]
-        if other.get('pair_choice') == request.user_id:
-            other['pair_choice'] = None
-            other['pair_choice_at'] = None
-        s3_put(f"profiles/{target_id}.json", other)
+    s3_update(f"profiles/{target_id}.json", lambda other: _remove_from_pool(other, user_id))
 
     return jsonify({'success': True, 'message': 'Match removed from your pool.'})
 
@@ -1675,15 +2173,7 @@ def delete_account():
             other_id = entry.get('user_id')
             if not other_id:
                 continue
-            other_profile = s3_get(f"profiles/{other_id}.json")
-            if other_profile:
-                other_profile['match_pool'] = [
-                    e for e in other_profile.get('match_pool', []) if e.get('user_id') != user_id
-                ]
-                if other_profile.get('pair_choice') == user_id:
-                    other_profile['pair_choice'] = None
-                    other_profile['pair_choice_at'] = None
-                s3_put(f"profiles/{other_id}.json", other_profile)
+            s3_update(f"profiles/{other_id}.json", lambda other: _remove_from_pool(other, user_id))
 
         # Delete photos from S3
         for photo_url in profile.get('photos', []):
@@ -1694,13 +2184,13 @@ def delete_account():
 
         # Delete profile
         try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}profiles/{user_id}.json")
+            _s3_delete_object(f"profiles/{user_id}.json")
         except Exception as e:
             print(f"Error deleting profile from S3: {e}")
 
         # Delete chat history
         try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}chat/{user_id}_history.json")
+            _s3_delete_object(f"chat/{user_id}_history.json")
         except Exception:
             pass
 
@@ -1715,8 +2205,8 @@ def delete_account():
             print(f"Error removing from member list: {e}")
 
         # Evict caches
-        _s3_cache.pop(f"profiles/{user_id}.json", None)
-        _s3_cache_ts.pop(f"profiles/{user_id}.json", None)
+        _s3_mark_deleted(f"profiles/{user_id}.json")
+        _s3_mark_deleted(f"chat/{user_id}_history.json")
 
         print(f"✅ Account deleted: {user_id}")
         return jsonify({'success': True, 'message': 'Account deleted successfully'})
@@ -1894,9 +2384,9 @@ def admin_stats():
     active_count = 0
     matched_count = 0
     total_conversations = 0
-    for m in members:
+    member_profiles = s3_get_many([f"profiles/{m.get('user_id')}.json" for m in members])
+    for m, profile in zip(members, member_profiles):
         uid = m.get('user_id')
-        profile = s3_get(f"profiles/{uid}.json")
         if not profile:
             continue
         matching_active = profile.get('matching_active', False)
@@ -1941,8 +2431,9 @@ def admin_user_transcript(target_user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     index = load_topic_index(target_user_id)
     topics_data = []
-    for t in index.get('topics', []):
-        topic = load_topic(target_user_id, t['topic_id'])
+    entries = index.get('topics', [])
+    topics = s3_get_many([get_topic_key(target_user_id, t['topic_id']) for t in entries])
+    for t, topic in zip(entries, topics):
         if topic:
             topics_data.append({
                 'topic_id': t['topic_id'],
@@ -1952,16 +2443,38 @@ def admin_user_transcript(target_user_id):
             })
     return jsonify({'user_id': target_user_id, 'topics': topics_data})
 
+@token_required
+def admin_cache_stats():
+    if request.user_id != ADMIN_USER_ID:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({
+        's3_cache': _s3_cache.stats(),
+        's3_single_flight': _s3_flight.stats(),
+        's3_refresher': _s3_refresher.stats(),
+        'storage': storage.metrics.stats(),
+        'archiver': storage.archiver.stats() if storage.archiver else None,
+        'journal': _journal.stats() if _journal else None,
+        'disk_cache': _disk_cache.stats() if _disk_cache else None,
+    })
+
 
 # Register all routes with the Flask app
 def register_routes(app, s3_client_instance, s3_bucket, s3_prefix, openrouter_cfg):
-    global s3_client, S3_BUCKET, S3_PREFIX, jwt_secret, openrouter_config
+    global s3_client, S3_BUCKET, S3_PREFIX, jwt_secret, openrouter_config, _journal
     s3_client = s3_client_instance
     S3_BUCKET = s3_bucket
     S3_PREFIX = s3_prefix
     jwt_secret = app.config['JWT_SECRET']
     openrouter_config = openrouter_cfg
-    
+
+    if STORAGE_JOURNAL_DIR and _journal is None:
+        _journal = journal.WriteJournal(STORAGE_JOURNAL_DIR, s3_client, S3_BUCKET).start()
+
+    if _disk_cache is not None and S3_CACHE_WARM_KEYS:
+        threading.Thread(target=warm_cache, name='cache-warmup', daemon=True).start()
+
+    app.after_request(_finish_request_storage)
+
     app.add_url_rule('/ping', 'ping', ping, methods=['GET'])
     app.add_url_rule('/register', 'register', register, methods=['POST'])
     app.add_url_rule('/login', 'login', login, methods=['POST'])
@@ -1971,6 +2484,7 @@ def register_routes(app, s3_client_instance, s3_bucket, s3_prefix, openrouter_cf
     app.add_url_rule('/verify-token', 'verify_token', verify_token, methods=['POST'])
     app.add_url_rule('/admin/stats', 'admin_stats', admin_stats, methods=['GET'])
     app.add_url_rule('/admin/transcript/<target_user_id>', 'admin_user_transcript', admin_user_transcript, methods=['GET'])
+    app.add_url_rule('/admin/cache-stats', 'admin_cache_stats', admin_cache_stats, methods=['GET'])
     app.add_url_rule('/profile', 'get_profile', get_profile, methods=['GET'])
     app.add_url_rule('/profile', 'update_profile', update_profile, methods=['PUT'])
     app.add_url_rule('/profile/photos', 'upload_photo', upload_photo, methods=['POST'])
@@ -0,0 +1,471 @@
+"""
+Local write-ahead journal for Love-Matcher storage writes
+
+With STORAGE_JOURNAL_DIR set, s3_put appends each write to a local journal,
+fsyncs it and returns; the caller never waits on object storage. A
+background uploader drains the journal to the remote store:
+
+    - every process on the host appends to the same journal under an
+      exclusive flock, so journal order is the order writes happened in,
+      whichever Gunicorn worker made them
+    - exactly one process at a time (the holder of uploader.lock) uploads;
+      the others stand by and take over when it exits
+    - records are uploaded in journal order, and several queued writes to
+      the same key collapse into one upload of the newest, so a key never
+      goes backwards
+    - a failed upload stays queued and is retried with backoff
+    - the position of the first record not yet uploaded is checkpointed;
+      after a restart everything from the checkpoint on is uploaded again
+    - replication lag (age of the oldest record not yet uploaded) is
+      exposed through stats()
+
+The journal is a series of segment files (segment-{position}.log, named
+after the journal position of their first byte). Appends go to the newest
+segment, which is rolled once it reaches _SEGMENT_BYTES; segments wholly
+before the checkpoint are deleted. A record's position is its sequence
+number.
+
+Every process also reads the records other processes append, so get()
+returns the newest pending write to a key from any worker.
+
+Record format: 8-byte header (header length, body length, big-endian
+uint32s), JSON header, raw body. A torn record at the end of the journal
+(power loss mid-append) is discarded at startup; its write was never
+acknowledged.
+
+Journals written by older versions (one journal-N.log per process) are
+imported at startup once no running process holds them.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+_RECORD_HEADER = struct.Struct('>II')
+
+# Roll to a new segment once the newest one is this large
+_SEGMENT_BYTES = 16 * 1024 * 1024
+
+_LEGACY_JOURNAL = re.compile(r'journal-\d+\.log$')
+
+
+class _Record:
+    __slots__ = ('seq', 'key', 'op', 'body', 'content_type', 'metadata', 'etag', 'appended_at')
+
+    def __init__(self, seq, key, op, body, content_type, metadata, etag, appended_at):
+        self.seq = seq
+        self.key = key
+        self.op = op
+        self.body = body
+        self.content_type = content_type
+        self.metadata = metadata
+        self.etag = etag
+        self.appended_at = appended_at
+
+
+def _etag(body):
+    # Same value S3/Spaces report for a single-part PUT
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def _encode(key, op, body, content_type, metadata, ts):
+    header = json.dumps({
+        'key': key, 'op': op, 'ts': ts,
+        'content_type': content_type, 'metadata': metadata or None,
+    }).encode('utf-8')
+    return _RECORD_HEADER.pack(len(header), len(body)) + header + body
+
+
+def _records(data):
+    """Yield (start, end, header, body) for each complete record in data;
+    stops at a torn or still-being-written record."""
+    offset = 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        header_len, body_len = _RECORD_HEADER.unpack_from(data, offset)
+        end = offset + _RECORD_HEADER.size + header_len + body_len
+        if end > len(data):
+            return
+        header = json.loads(data[offset + _RECORD_HEADER.size:offset + _RECORD_HEADER.size + header_len])
+        yield offset, end, header, data[end - body_len:end]
+        offset = end
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteJournal:
+    """Durable host-wide queue of object writes, drained to remote storage."""
+
+    def __init__(self, directory, remote_client, bucket, interval=0.2, batch_size=100, workers=4):
+        self.directory = directory
+        self.remote = remote_client
+        self.bucket = bucket
+        self.interval = interval
+        self.batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()        # in-memory state
+        self._write_lock = threading.Lock()  # appends from this process's threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='journal-upload')
+
+        self._pending = OrderedDict()  # position -> _Record, in journal order
+        self._latest = {}              # key -> newest pending _Record
+        self.appends = 0
+        self.uploaded = 0
+        self.failures = 0
+        self._last_upload_lag = 0.0
+
+        self._append_lock = open(os.path.join(directory, 'journal.lock'), 'a+b')
+        self._uploader_lock_path = os.path.join(directory, 'uploader.lock')
+        self._uploader_lock = None  # open file while this process is the uploader
+        self._checkpoint_path = os.path.join(directory, 'checkpoint')
+
+        with self._write_lock, self._appending():
+            self._repair_tail()
+            self._sweep_legacy()
+        self._read_pos = self._read_checkpoint()
+        with self._lock:
+            self._catch_up()
+            self.replayed = len(self._pending)
+        if self.replayed:
+            print(f"📒 {self.replayed} journaled writes pending upload in {directory}")
+
+    # -- files ---------------------------------------------------------------
+
+    @contextmanager
+    def _appending(self):
+        """Hold the host-wide append lock."""
+        fcntl.flock(self._append_lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._append_lock.fileno(), fcntl.LOCK_UN)
+
+    def _segment_path(self, base):
+        return os.path.join(self.directory, f"segment-{base:020d}.log")
+
+    def _segments(self):
+        """[(base position, path)] of every segment, oldest first."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.log'):
+                segments.append((int(name[len('segment-'):-len('.log')]), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _tail_segment(self):
+        """(base, path) of the segment to append to, rolling it when full.
+        Caller holds the append lock."""
+        segments = self._segments()
+        if segments:
+            base, path = segments[-1]
+            size = os.path.getsize(path)
+            if size < _SEGMENT_BYTES:
+                return base, path
+            base += size
+        else:
+            base = self._read_checkpoint()
+        path = self._segment_path(base)
+        open(path, 'ab').close()
+        _fsync_dir(self.directory)
+        return base, path
+
+    def _read_checkpoint(self):
+        try:
+            with open(self._checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self, position):
+        tmp = self._checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path)
+
+    def _repair_tail(self):
+        """Drop a torn record at the end of the newest segment. Caller holds
+        the append lock, so no live append can be in progress."""
+        segments = self._segments()
+        if not segments:
+            return
+        _, path = segments[-1]
+        with open(path, 'r+b') as f:
+            data = f.read()
+            complete = 0
+            for _, end, _, _ in _records(data):
+                complete = end
+            if complete < len(data):
+                print(f"⚠️ Discarding torn record at the end of {path}")
+                f.truncate(complete)
+                os.fsync(f.fileno())
+
+    def _sweep_legacy(self):
+        """Import unuploaded writes from per-process journal-N.log files that
+        no running process holds, oldest first. Caller holds the append lock."""
+        imported = []
+        for name in sorted(os.listdir(self.directory)):
+            if not _LEGACY_JOURNAL.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # still owned by a running process
+                try:
+                    with open(path + '.checkpoint') as c:
+                        checkpoint = int(c.read().strip() or 0)
+                except FileNotFoundError:
+                    checkpoint = 0
+                for _, _, header, body in _records(f.read()):
+                    if header['seq'] > checkpoint:
+                        imported.append((header['ts'], header, body))
+                for leftover in (path, path + '.checkpoint'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        if not imported:
+            return
+        imported.sort(key=lambda item: item[0])
+        for ts, header, body in imported:
+            self._write(_encode(header['key'], header['op'], body, header.get('content_type'),
+                                header.get('metadata'), ts))
+        print(f"📒 Imported {len(imported)} writes from per-process journals")
+
+    def _write(self, data):
+        """Append one encoded record to the journal and fsync it. Caller
+        holds the append lock. A failed write is cut off again so the next
+        record starts on a record boundary."""
+        _, path = self._tail_segment()
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        try:
+            start = os.fstat(fd).st_size
+            try:
+                if os.write(fd, data) != len(data):
+                    raise OSError(f"short write to {path}")
+                os.fsync(fd)
+            except BaseException:
+                os.ftruncate(fd, start)
+                raise
+        finally:
+            os.close(fd)
+
+    # -- reading -------------------------------------------------------------
+
+    def _catch_up(self):
+        """Queue records appended since the last call (by any process) and
+        drop those the uploader has checkpointed. Caller holds self._lock."""
+        checkpoint = self._read_checkpoint()
+        while self._pending:
+            position, record = next(iter(self._pending.items()))
+            if position >= checkpoint:
+                break
+            del self._pending[position]
+            if self._latest.get(record.key) is record:
+                del self._latest[record.key]
+
+        position = max(self._read_pos, checkpoint)
+        for base, path in self._segments():
+            try:
+                if base + os.path.getsize(path) <= position:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(max(0, position - base))
+                    data = f.read()
+            except FileNotFoundError:
+                continue  # compacted meanwhile: wholly before the checkpoint
+            start = max(position, base)
+            consumed = 0
+            for offset, end, header, body in _records(data):
+                self._enqueue(_Record(start + offset, header['key'], header['op'], body,
+                                      header.get('content_type'), header.get('metadata'),
+                                      _etag(body), header['ts']))
+                consumed = end
+            position = start + consumed
+            if consumed < len(data):
+                break  # a record is still being written; read it next time
+        self._read_pos = position
+
+    def _enqueue(self, record):
+        self._pending[record.seq] = record
+        self._latest[record.key] = record
+
+    # -- appends -------------------------------------------------------------
+
+    def _append(self, key, op, body=b'', content_type=None, metadata=None):
+        data = _encode(key, op, body, content_type, metadata, time.time())
+        with self._write_lock, self._appending():
+            self._write(data)
+        with self._lock:
+            self._catch_up()
+            self.appends += 1
+        self._wake.set()
+        return _etag(body)
+
+    def put(self, key, body, content_type=None, metadata=None):
+        """Durably queue a put. Returns the ETag the object will have."""
+        return self._append(key, 'put', body, content_type, metadata)
+
+    def delete(self, key):
+        """Durably queue a delete."""
+        self._append(key, 'delete')
+
+    def get(self, key):
+        """Newest write to key not yet uploaded, from any process on this
+        host, as (op, body, metadata, etag), or None. Lets readers see
+        journaled writes before they reach S3."""
+        with self._lock:
+            self._catch_up()
+            record = self._latest.get(key)
+            if record is None:
+                return None
+            return record.op, record.body, record.metadata, record.etag
+
+    # -- uploader ------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='journal-uploader', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            while self.drain_once():
+                pass
+        if self._uploader_lock is not None:
+            self._uploader_lock.close()  # closing drops the flock
+            self._uploader_lock = None
+
+    def _loop(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                progressed = self.drain_once()
+                backoff = self.interval
+                if not progressed:
+                    self._wake.wait(self.interval)
+                    self._wake.clear()
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Journal upload failed, retrying in {backoff:.1f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _acquire_uploader(self):
+        """Become (or stay) the host's uploader; False if another process is."""
+        if self._uploader_lock is None:
+            f = open(self._uploader_lock_path, 'a+b')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._uploader_lock = f
+        return True
+
+    def _upload(self, record):
+        if record.op == 'delete':
+            self.remote.delete_object(Bucket=self.bucket, Key=record.key)
+            return
+        params = {'Bucket': self.bucket, 'Key': record.key, 'Body': record.body}
+        if record.content_type:
+            params['ContentType'] = record.content_type
+        if record.metadata:
+            params['Metadata'] = record.metadata
+        self.remote.put_object(**params)
+
+    def _compact(self, checkpoint):
+        """Delete segments that end at or before the checkpoint (never the newest)."""
+        segments = self._segments()
+        for (_, path), (next_base, _) in zip(segments, segments[1:]):
+            if next_base <= checkpoint:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def drain_once(self):
+        """Upload one batch if this process is the uploader. Returns True if
+        any records were processed; raises the first upload error after the
+        rest of the batch is done."""
+        if not self._acquire_uploader():
+            with self._lock:
+                self._catch_up()
+            return False
+        with self._lock:
+            self._catch_up()
+            batch = list(self._pending.values())[:self.batch_size]
+        if not batch:
+            return False
+        # Newest record per key; distinct keys upload in parallel
+        newest = {}
+        for record in batch:
+            newest[record.key] = record
+        futures = {key: self._pool.submit(self._upload, record) for key, record in newest.items()}
+        errors = []
+        done_keys = set()
+        for key, future in futures.items():
+            try:
+                future.result()
+                done_keys.add(key)
+            except Exception as e:
+                errors.append(e)
+
+        now = time.time()
+        with self._lock:
+            for record in batch:
+                if record.key in done_keys:
+                    self._pending.pop(record.seq, None)
+                    if self._latest.get(record.key) is record:
+                        del self._latest[record.key]
+            if done_keys:
+                self.uploaded += len(done_keys)
+                self._last_upload_lag = now - min(newest[k].appended_at for k in done_keys)
+            # Everything before the oldest pending record is safely uploaded
+            checkpoint = next(iter(self._pending)) if self._pending else self._read_pos
+            self._write_checkpoint(checkpoint)
+        self._compact(checkpoint)
+        if errors:
+            raise errors[0]
+        return True
+
+    def stats(self):
+        with self._lock:
+            self._catch_up()
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                'path': self.directory,
+                'uploader': self._uploader_lock is not None,
+                'segments': len(self._segments()),
+                'pending': len(self._pending),
+                'pending_bytes': sum(len(r.body) for r in self._pending.values()),
+                'replication_lag_s': round(time.time() - oldest.appended_at, 3) if oldest else 0.0,
+                'last_upload_lag_s': round(self._last_upload_lag, 3),
+                'appends': self.appends,
+                'uploaded': self.uploaded,
+                'failures': self.failures,
+                'replayed': self.replayed,
+            }
@@ -0,0 +1,377 @@
+"""
+Embedded local object store for Love-Matcher
+
+SQLiteObjectStore is a drop-in backend for the S3 client used by s3_get /
+s3_put and the scripts. It implements the subset of the boto3 S3 client
+interface this codebase relies on:
+
+    get_object, head_object, put_object, delete_object, delete_objects,
+    head_bucket, list_objects_v2, get_paginator('list_objects_v2'), meta.endpoint_url
+
+and raises botocore ClientError with the same codes S3 uses (NoSuchKey,
+304 Not Modified), so callers cannot tell it apart from Spaces. Objects
+are kept in a SQLite database in WAL mode under the same keys
+("{prefix}profiles/...", "{prefix}topics/...", ...).
+
+Every write is also recorded in an outbox table in the same transaction.
+ObjectArchiver drains the outbox in the background and mirrors each write
+to remote object storage, so Spaces stays a complete copy of the data.
+Every process using the database runs an archiver, but only the one
+holding an flock on "{path}.archiver.lock" drains the outbox.
+"""
+
+import fcntl
+import hashlib
+import io
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+import sqlite_util
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT NOT NULL,
+    content_type TEXT,
+    content_encoding TEXT,
+    metadata TEXT,
+    acl TEXT,
+    last_modified REAL NOT NULL,
+    PRIMARY KEY (bucket, key)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+"""
+
+
+def _client_error(operation, code, status, message):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': message},
+         'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation,
+    )
+
+
+def _to_bytes(body):
+    if hasattr(body, 'read'):
+        body = body.read()
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return bytes(body)
+
+
+class _Meta:
+    def __init__(self, endpoint_url):
+        self.endpoint_url = endpoint_url
+
+
+class _ListObjectsV2Paginator:
+    def __init__(self, store):
+        self._store = store
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self._store.list_objects_v2(ContinuationToken=token, **kwargs) if token \
+                else self._store.list_objects_v2(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            token = page['NextContinuationToken']
+
+
+class SQLiteObjectStore:
+    """S3-compatible object store on a local SQLite database (WAL mode).
+
+    endpoint_url is reported through meta.endpoint_url so public photo URLs
+    still point at the remote store the archiver mirrors to.
+    """
+
+    def __init__(self, path, endpoint_url='', metrics=None):
+        self.path = path
+        self.meta = _Meta(endpoint_url)
+        self.metrics = metrics
+        self._conn = sqlite_util.ThreadLocalConnection(path)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _record(self, operation, started, error=False):
+        if self.metrics is not None:
+            self.metrics.record(operation, (time.perf_counter() - started) * 1000, error=error)
+
+    # -- reads ---------------------------------------------------------------
+
+    def _row(self, bucket, key):
+        return self._conn().execute(
+            'SELECT body, etag, content_type, content_encoding, metadata, last_modified '
+            'FROM objects WHERE bucket = ? AND key = ?', (bucket, key)
+        ).fetchone()
+
+    def _describe(self, row):
+        body, etag, content_type, content_encoding, metadata, last_modified = row
+        response = {
+            'ETag': etag,
+            'ContentLength': len(body),
+            'ContentType': content_type or 'binary/octet-stream',
+            'LastModified': datetime.fromtimestamp(last_modified, tz=timezone.utc),
+            'Metadata': json.loads(metadata) if metadata else {},
+        }
+        if content_encoding:
+            response['ContentEncoding'] = content_encoding
+        return response
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        started = time.perf_counter()
+        row = self._row(Bucket, Key)
+        if row is None:
+            self._record('GetObject', started)
+            raise _client_error('GetObject', 'NoSuchKey', 404, 'The specified key does not exist.')
+        if IfNoneMatch is not None and IfNoneMatch == row[1]:
+            self._record('GetObject', started)
+            raise _client_error('GetObject', '304', 304, 'Not Modified')
+        response = self._describe(row)
+        response['Body'] = io.BytesIO(row[0])
+        self._record('GetObject', started)
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        started = time.perf_counter()
+        row = self._row(Bucket, Key)
+        self._record('HeadObject', started)
+        if row is None:
+            raise _client_error('HeadObject', '404', 404, 'Not Found')
+        return self._describe(row)
+
+    def head_bucket(self, Bucket, **kwargs):
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, StartAfter=None,
+                        MaxKeys=1000, **kwargs):
+        started = time.perf_counter()
+        after = ContinuationToken or StartAfter or ''
+        rows = self._conn().execute(
+            'SELECT key, length(body), etag, last_modified FROM objects '
+            'WHERE bucket = ? AND key >= ? AND key < ? AND key > ? ORDER BY key LIMIT ?',
+            (Bucket, Prefix, Prefix + '\U0010ffff', after, MaxKeys + 1)
+        ).fetchall()
+        truncated = len(rows) > MaxKeys
+        rows = rows[:MaxKeys]
+        response = {'KeyCount': len(rows), 'IsTruncated': truncated, 'Prefix': Prefix}
+        if rows:
+            response['Contents'] = [
+                {'Key': key, 'Size': size, 'ETag': etag,
+                 'LastModified': datetime.fromtimestamp(ts, tz=timezone.utc)}
+                for key, size, etag, ts in rows
+            ]
+        if truncated:
+            response['NextContinuationToken'] = rows[-1][0]
+        self._record('ListObjectsV2', started)
+        return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f"No local paginator for {operation_name}")
+        return _ListObjectsV2Paginator(self)
+
+    # -- writes --------------------------------------------------------------
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType=None, ContentEncoding=None,
+                   Metadata=None, ACL=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        started = time.perf_counter()
+        body = _to_bytes(Body)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            if IfMatch is not None or IfNoneMatch is not None:
+                # Take the write lock before checking so the check and the write are atomic
+                conn.execute('BEGIN IMMEDIATE')
+                current = conn.execute('SELECT etag FROM objects WHERE bucket = ? AND key = ?',
+                                       (Bucket, Key)).fetchone()
+                if (IfNoneMatch == '*' and current is not None) or \
+                        (IfMatch is not None and (current is None or current[0] != IfMatch)):
+                    self._record('PutObject', started)
+                    raise _client_error('PutObject', 'PreconditionFailed', 412,
+                                        'At least one of the pre-conditions you specified did not hold')
+            conn.execute(
+                'INSERT OR REPLACE INTO objects '
+                '(bucket, key, body, etag, content_type, content_encoding, metadata, acl, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (Bucket, Key, body, etag, ContentType, ContentEncoding,
+                 json.dumps(Metadata) if Metadata else None, ACL, now)
+            )
+            conn.execute('INSERT INTO outbox (bucket, key, op, enqueued_at) VALUES (?, ?, ?, ?)',
+                         (Bucket, Key, 'put', now))
+        self._record('PutObject', started)
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        started = time.perf_counter()
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM objects WHERE bucket = ? AND key = ?', (Bucket, Key))
+            conn.execute('INSERT INTO outbox (bucket, key, op, enqueued_at) VALUES (?, ?, ?, ?)',
+                         (Bucket, Key, 'delete', time.time()))
+        self._record('DeleteObject', started)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        started = time.perf_counter()
+        keys = [obj['Key'] for obj in Delete.get('Objects', [])]
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany('DELETE FROM objects WHERE bucket = ? AND key = ?', [(Bucket, key) for key in keys])
+            conn.executemany('INSERT INTO outbox (bucket, key, op, enqueued_at) VALUES (?, ?, ?, ?)',
+                             [(Bucket, key, 'delete', now) for key in keys])
+        self._record('DeleteObjects', started)
+        return {} if Delete.get('Quiet') else {'Deleted': [{'Key': key} for key in keys]}
+
+    # -- outbox (used by ObjectArchiver) -------------------------------------
+
+    def outbox_batch(self, limit=100):
+        return self._conn().execute(
+            'SELECT seq, bucket, key, op, enqueued_at FROM outbox ORDER BY seq LIMIT ?', (limit,)
+        ).fetchall()
+
+    def outbox_done(self, seqs):
+        conn = self._conn()
+        with conn:
+            conn.executemany('DELETE FROM outbox WHERE seq = ?', [(s,) for s in seqs])
+
+    def outbox_stats(self):
+        count, oldest = self._conn().execute('SELECT COUNT(*), MIN(enqueued_at) FROM outbox').fetchone()
+        return {'pending': count, 'oldest_age_s': round(time.time() - oldest, 1) if oldest else 0.0}
+
+    def read_for_archive(self, bucket, key):
+        return self._conn().execute(
+            'SELECT body, content_type, content_encoding, metadata, acl FROM objects '
+            'WHERE bucket = ? AND key = ?', (bucket, key)
+        ).fetchone()
+
+
+class ObjectArchiver:
+    """Background thread mirroring local writes to remote object storage.
+
+    Outbox rows are processed in order. Several queued writes to the same
+    key collapse into one upload of its current contents. A failed upload
+    leaves its rows queued and is retried with backoff; rows survive
+    restarts because they live in the same database as the objects.
+
+    Only one archiver per database drains at a time (an exclusive flock on
+    lock_path), otherwise two processes could upload the same key at
+    different versions with the older one landing last. The others stand
+    by and retry the lock every interval, taking over when its holder exits.
+    """
+
+    def __init__(self, store, remote_client, remote_bucket=None, interval=1.0, batch_size=100,
+                 lock_path=None):
+        self.store = store
+        self.remote = remote_client
+        self.remote_bucket = remote_bucket
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_path = lock_path or f"{store.path}.archiver.lock"
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.uploaded = 0
+        self.deleted = 0
+        self.failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='object-archiver', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, drain=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            self.drain_once()
+        self._release()
+
+    def _acquire(self):
+        """Take (or keep) the per-database archiver lock; False if another process holds it."""
+        if self._lock_file is None:
+            f = open(self.lock_path, 'a+b')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._lock_file = f
+        return True
+
+    def _release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # closing drops the flock
+            self._lock_file = None
+
+    def _loop(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                progressed = self.drain_once()
+                backoff = self.interval
+                if not progressed:
+                    self._stop.wait(self.interval)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Archiver upload failed, retrying in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def drain_once(self):
+        """Mirror one batch of outbox rows. Returns True if any were processed."""
+        if not self._acquire():
+            return False
+        rows = self.store.outbox_batch(self.batch_size)
+        if not rows:
+            return False
+        # Latest op per key wins; keys are handled in order of first appearance
+        latest = {}
+        for seq, bucket, key, op, _ in rows:
+            latest[(bucket, key)] = op
+        for (bucket, key), op in latest.items():
+            target_bucket = self.remote_bucket or bucket
+            current = self.store.read_for_archive(bucket, key)
+            if op == 'delete' or current is None:
+                self.remote.delete_object(Bucket=target_bucket, Key=key)
+                self.deleted += 1
+            else:
+                body, content_type, content_encoding, metadata, acl = current
+                params = {'Bucket': target_bucket, 'Key': key, 'Body': body}
+                if content_type:
+                    params['ContentType'] = content_type
+                if content_encoding:
+                    params['ContentEncoding'] = content_encoding
+                if metadata:
+                    params['Metadata'] = json.loads(metadata)
+                if acl:
+                    params['ACL'] = acl
+                self.remote.put_object(**params)
+                self.uploaded += 1
+            self.store.outbox_done([seq for seq, b, k, _, _ in rows if (b, k) == (bucket, key)])
+        return True
+
+    def stats(self):
+        stats = self.store.outbox_stats()
+        stats.update({'uploaded': self.uploaded, 'deleted': self.deleted, 'failures': self.failures,
+                      'active': self._lock_file is not None})
+        return stats
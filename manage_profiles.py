@@ -4,27 +4,27 @@ Profile Management Script for Love Matcher
 Inspect and manage member profiles stored in S3
 """
 
-import boto3
 import json
-from datetime import datetime
-import config
+import match_state
+import serialization
+import shared_cache
+import storage
 
-# Initialize S3 client
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
-    region_name=config.AWS_REGION
-)
+# Shared Digital Ocean Spaces client
+s3 = storage.get_s3_client()
+
+S3_BUCKET = storage.S3_BUCKET
+S3_PREFIX = storage.S3_PREFIX
+
+# Invalidate API workers' cached copies of anything edited here
+_shared_cache = shared_cache.from_config()
 
-S3_BUCKET = config.S3_BUCKET
-S3_PREFIX = config.S3_PREFIX
 
 def s3_get(key):
     """Get object from S3"""
     try:
-        response = s3.get_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
-        return json.loads(response['Body'].read())
+        response = storage.get_object(s3, S3_BUCKET, S3_PREFIX, key)
+        return serialization.decode(response['Body'].read(), response.get('Metadata'))
     except Exception as e:
         print(f"Error reading {key}: {e}")
         return None
@@ -32,12 +32,15 @@ def s3_get(key):
 def s3_put(key, data):
     """Put object to S3"""
     try:
+        body, metadata = serialization.encode(data)
         s3.put_object(
             Bucket=S3_BUCKET,
-            Key=f"{S3_PREFIX}{key}",
-            Body=json.dumps(data, indent=2),
-            ContentType='application/json'
+            Key=f"{S3_PREFIX}{storage.physical_key(key)}",
+            Body=body,
+            ContentType='application/json',
+            **serialization.put_kwargs(metadata)
         )
+        shared_cache.invalidate(_shared_cache, key)
         print(f"✓ Saved {key}")
     except Exception as e:
         print(f"Error saving {key}: {e}")
@@ -45,13 +48,7 @@ def s3_put(key, data):
 def s3_list_profiles():
     """List all profile files in S3"""
     try:
-        response = s3.list_objects_v2(
-            Bucket=S3_BUCKET,
-            Prefix=f"{S3_PREFIX}profiles/"
-        )
-        if 'Contents' in response:
-            return [obj['Key'].replace(S3_PREFIX, '') for obj in response['Contents']]
-        return []
+        return storage.list_keys(s3, S3_BUCKET, S3_PREFIX, 'profiles/')
     except Exception as e:
         print(f"Error listing profiles: {e}")
         return []
@@ -132,6 +129,7 @@ def update_profile_field(user_id, field_path, value):
     current[fields[-1]] = value
     
     s3_put(f"profiles/{user_id}.json", profile)
+    match_state.mark_dirty(s3, S3_BUCKET, S3_PREFIX, user_id, 'admin_update')
     print(f"✓ Updated {field_path} = {value}")
 
 def delete_profile(user_id, confirm=False):
@@ -141,7 +139,10 @@ def delete_profile(user_id, confirm=False):
         return
     
     try:
-        s3.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}profiles/{user_id}.json")
+        for physical in storage.physical_keys(f"profiles/{user_id}.json"):
+            s3.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{physical}")
+        shared_cache.invalidate(_shared_cache, f"profiles/{user_id}.json")
+        match_state.mark_dirty(s3, S3_BUCKET, S3_PREFIX, user_id, 'profile_deleted')
         print(f"✓ Deleted profile: {user_id}")
     except Exception as e:
         print(f"Error deleting profile: {e}")
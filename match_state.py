@@ -0,0 +1,130 @@
+"""
+Change tracking for incremental matching runs
+
+The API server drops a small marker object under matching/dirty/ whenever
+a save changes a profile's matching state (its matching data, seeking
+gender, matching_active flag, match pool or rejections) and when a profile
+is deleted. run_matching.py keeps a local snapshot of every profile from
+its last successful run; an incremental run downloads only the profiles
+with a marker, evaluates only those users, and clears the markers it
+consumed.
+
+A changed user can still alter an unchanged user's best candidates: by
+entering or leaving their bucket it moves others into or out of their
+shortlist (or changes who they would pick first). So besides the changed
+users, an incremental run re-evaluates every unchanged user with free
+pool slots whose candidate bucket a changed user was or is in; pairs
+that did not change are answered by the persistent score cache.
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime
+
+import prompts
+import sqlite_util
+
+DIRTY_ROOT = 'matching/dirty/'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    etag TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def dirty_key(user_id):
+    return f"{DIRTY_ROOT}{user_id}.json"
+
+
+def profile_user_id(key):
+    """user_id for a logical profiles/{user_id}.json key, else None."""
+    if key.startswith('profiles/') and key.endswith('.json'):
+        return key[len('profiles/'):-len('.json')]
+    return None
+
+
+def matching_fingerprint(profile):
+    """Hash of everything a matching run reads from a profile."""
+    if not isinstance(profile, dict):
+        return None
+    state = {
+        'data': prompts.extract_matching_data(profile),
+        'seeking_gender': profile.get('seeking_gender'),
+        'matching_active': profile.get('matching_active', False),
+        'pool': sorted(str(e.get('user_id')) for e in profile.get('match_pool', []) if isinstance(e, dict)),
+        'rejected': sorted(str(r) for r in profile.get('rejected_matches', [])),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def mark_dirty(client, bucket, prefix, user_id, reason):
+    """Record that user_id needs re-evaluating in the next incremental run."""
+    client.put_object(
+        Bucket=bucket,
+        Key=f"{prefix}{dirty_key(user_id)}",
+        Body=json.dumps({'user_id': user_id, 'reason': reason, 'marked_at': time.time()}).encode('utf-8'),
+        ContentType='application/json',
+    )
+
+
+def list_dirty(client, bucket, prefix):
+    """{user_id: LastModified} for every pending marker."""
+    dirty = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}{DIRTY_ROOT}"):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(prefix) + len(DIRTY_ROOT):]
+            if name.endswith('.json'):
+                dirty[name[:-len('.json')]] = obj['LastModified']
+    return dirty
+
+
+def clear_dirty(client, bucket, prefix, before):
+    """Delete markers last written before `before` (an aware datetime);
+    markers rewritten since are kept for the next run. Returns the count."""
+    stale = [user_id for user_id, modified in list_dirty(client, bucket, prefix).items() if modified < before]
+    for start in range(0, len(stale), 1000):
+        client.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': f"{prefix}{dirty_key(user_id)}"} for user_id in stale[start:start + 1000]],
+            'Quiet': True,
+        })
+    return len(stale)
+
+
+class ProfileSnapshot:
+    """Local SQLite copy of every profile (with ETag) as of the last run."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite_util.ThreadLocalConnection(path)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def load(self):
+        """{user_id: (profile, etag)}"""
+        return {user_id: (json.loads(body), etag) for user_id, body, etag in
+                self._conn().execute('SELECT user_id, body, etag FROM profiles')}
+
+    def replace(self, profiles, run_started):
+        """Store {user_id: (profile, etag)} as the snapshot of a run that
+        started at run_started (an aware datetime)."""
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM profiles')
+            conn.executemany('INSERT INTO profiles (user_id, body, etag) VALUES (?, ?, ?)',
+                             [(user_id, json.dumps(profile), etag) for user_id, (profile, etag) in profiles.items()])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_run', ?)",
+                         (run_started.isoformat(),))
+
+    def last_run(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'last_run'").fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
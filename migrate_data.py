@@ -1,10 +1,11 @@
-import boto3
 import os
 import sys
 import mimetypes
 from botocore.exceptions import ClientError, NoCredentialsError
 from dotenv import load_dotenv
 
+from storage import make_client
+
 # Load environment variables
 load_dotenv()
 
@@ -60,11 +61,7 @@ def migrate():
 
     # 2. Setup Clients
     try:
-        source_client = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
+        source_client = make_client(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
         # Verify source access
         print(f"Testing access to source bucket: {SOURCE_BUCKET}...")
         source_client.head_bucket(Bucket=SOURCE_BUCKET)
@@ -75,10 +72,9 @@ def migrate():
 
     try:
         dest_bucket, dest_region, dest_endpoint = get_do_bucket_and_region(DO_SPACES_URL)
-        dest_client = boto3.client(
-            's3',
-            aws_access_key_id=DO_SPACES_KEY,
-            aws_secret_access_key=DO_SPACES_SECRET,
+        dest_client = make_client(
+            DO_SPACES_KEY,
+            DO_SPACES_SECRET,
             endpoint_url=dest_endpoint,
             region_name=dest_region
         )
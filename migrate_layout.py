@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Online migration of profiles and topics to the hash-sharded key layout
+
+Copies every layout-1 object under profiles/ and topics/ to its layout-2
+location (profiles/{shard}/{user}.json, topics/{shard}/{user}/...; see
+storage.sharded_key). Safe to run while the API serves traffic:
+
+    - copies are create-only (If-None-Match: *), so a newer write the API
+      already made at the sharded location is never overwritten; the
+      migration refuses to run with S3_CONDITIONAL_WRITES off
+    - readers fall back to the legacy location until the copy exists
+    - with --delete-legacy the old object is removed only once its sharded
+      copy is in place
+
+Every API server and script must run with STORAGE_KEY_LAYOUT = 2 before
+migrating, otherwise they keep writing to the legacy location.
+
+Usage:
+    python migrate_layout.py --dry-run
+    python migrate_layout.py
+    python migrate_layout.py --delete-legacy --workers 16
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import storage
+
+S3_BUCKET = storage.S3_BUCKET
+S3_PREFIX = storage.S3_PREFIX
+
+
+def legacy_objects(s3):
+    """Yield (legacy_key, sharded_key) for every object still in layout 1."""
+    for root in storage.SHARDED_ROOTS:
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{S3_PREFIX}{root}"):
+            for obj in page.get('Contents', []):
+                key = obj['Key'][len(S3_PREFIX):]
+                target = storage.sharded_key(key)
+                if target != key and storage.logical_key(key) == key:
+                    yield key, target
+
+
+def migrate_one(s3, key, target, delete_legacy):
+    """Copy one object; returns 'copied', 'exists', 'missing' or 'skipped'."""
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
+    except ClientError as e:
+        if storage.is_missing_key(e):
+            return 'missing'
+        raise
+    body = response['Body'].read()
+    try:
+        written = storage.put_object_if_absent(
+            s3,
+            Bucket=S3_BUCKET,
+            Key=f"{S3_PREFIX}{target}",
+            Body=body,
+            ContentType=response.get('ContentType') or 'application/json',
+            Metadata=response.get('Metadata') or {},
+        )
+    except storage.WriteConflict:
+        written = None
+    if written is False:
+        # The store stopped honouring If-None-Match; keep the legacy copy
+        return 'skipped'
+    result = 'copied' if written else 'exists'
+    if delete_legacy:
+        s3.delete_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move profiles and topics to the hash-sharded key layout')
+    parser.add_argument('--dry-run', action='store_true', help='List what would move without copying')
+    parser.add_argument('--delete-legacy', action='store_true', help='Delete each legacy object after copying')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent copies')
+    parser.add_argument('--force', action='store_true', help='Run even if STORAGE_KEY_LAYOUT is not 2')
+    args = parser.parse_args()
+
+    if storage.STORAGE_KEY_LAYOUT < 2 and not args.force and not args.dry_run:
+        print("❌ STORAGE_KEY_LAYOUT is 1. Switch every server and script to layout 2 first "
+              "(or pass --force).")
+        sys.exit(1)
+
+    if not storage.S3_CONDITIONAL_WRITES and not args.dry_run:
+        print("❌ S3_CONDITIONAL_WRITES is off. Copies must be create-only, or they could "
+              "overwrite newer objects the API already wrote at the sharded keys.")
+        sys.exit(1)
+
+    s3 = storage.get_s3_client(max_pool_connections=args.workers + 2)
+    print("=" * 60)
+    print(f"🔀 Key layout migration {'(DRY RUN)' if args.dry_run else ''}")
+    print(f"Bucket: {S3_BUCKET}  Prefix: {S3_PREFIX}")
+    print("=" * 60)
+
+    pending = list(legacy_objects(s3))
+    print(f"Found {len(pending)} objects in the legacy layout")
+    if args.dry_run:
+        for key, target in pending[:20]:
+            print(f"  {key} -> {target}")
+        if len(pending) > 20:
+            print(f"  ... and {len(pending) - 20} more")
+        return
+
+    counts = {'copied': 0, 'exists': 0, 'missing': 0, 'skipped': 0, 'failed': 0}
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [(key, pool.submit(migrate_one, s3, key, target, args.delete_legacy))
+                   for key, target in pending]
+        for done, (key, future) in enumerate(futures, 1):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"  ❌ {key}: {e}")
+            if done % 500 == 0:
+                print(f"  ... {done}/{len(futures)} ({done / (time.time() - started):.0f} objects/s)")
+
+    print(f"\n✓ Copied {counts['copied']}, already migrated {counts['exists']}, "
+          f"vanished {counts['missing']}, skipped {counts['skipped']}, failed {counts['failed']} "
+          f"in {time.time() - started:.1f}s")
+    if counts['skipped']:
+        print("⚠️ The store rejected conditional writes part-way through; skipped objects "
+              "were left in the legacy layout")
+    if counts['failed'] or counts['skipped']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -637,6 +637,10 @@ Now engage with this user — ask your first (or next) question and guide the co
 # MATCH COMPATIBILITY PROMPT - For ranking match suitability
 # ============================================================================
 
+# Bump when the compatibility prompt or the profile data sent with it
+# changes; pair scores cached under an older version are then ignored
+MATCH_PROMPT_VERSION = 1
+
 MATCH_COMPATIBILITY_PROMPT = """You are a compatibility analyst for Love-Matcher, a marriage-focused matchmaking service for adults 18+.
 
 Your task is to analyze two user profiles and provide a compatibility score from 0-100, where:
@@ -684,6 +688,16 @@ Respond with ONLY a JSON object in this exact format:
 
 Now analyze the two profiles provided and return your compatibility assessment in JSON format."""
 
+def extract_matching_data(profile):
+    """Profile data sent to the LLM for matching (excludes sensitive fields)"""
+    return {
+        'user_id': profile.get('user_id', 'unknown'),
+        'age': profile.get('age'),
+        'gender': profile.get('gender'),
+        'dimensions': profile.get('dimensions', {}),
+        'completion_percentage': profile.get('completion_percentage', 0)
+    }
+
 def build_match_compatibility_prompt(profile1, profile2):
     """
     Build prompt for LLM to evaluate match compatibility
@@ -697,16 +711,6 @@ def build_match_compatibility_prompt(profile1, profile2):
     """
     import json
     
-    # Extract relevant profile data for matching (exclude sensitive fields)
-    def extract_matching_data(profile):
-        return {
-            'user_id': profile.get('user_id', 'unknown'),
-            'age': profile.get('age'),
-            'gender': profile.get('gender'),
-            'dimensions': profile.get('dimensions', {}),
-            'completion_percentage': profile.get('completion_percentage', 0)
-        }
-    
     p1_data = extract_matching_data(profile1)
     p2_data = extract_matching_data(profile2)
     
@@ -1,37 +1,36 @@
 #!/usr/bin/env python3
 """One-time script: set all user passwords to a given value."""
-import json
-import boto3
 import bcrypt
 import sys
 
-import config
+import serialization
+import shared_cache
+import storage
 
 NEW_PASSWORD = sys.argv[1] if len(sys.argv) > 1 else '11111111'
 
-DO_BUCKET = 'mithril-media'
-DO_REGION = 'sfo3'
-DO_ENDPOINT = f"https://{DO_REGION}.digitaloceanspaces.com"
-S3_PREFIX = config.S3_PREFIX
+DO_BUCKET = storage.S3_BUCKET
+S3_PREFIX = storage.S3_PREFIX
+
+s3 = storage.get_s3_client()
+
+# Invalidate API workers' cached copies of every profile rewritten here
+_shared_cache = shared_cache.from_config()
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=config.DO_SPACES_KEY,
-    aws_secret_access_key=config.DO_SPACES_SECRET,
-    endpoint_url=DO_ENDPOINT,
-    region_name=DO_REGION
-)
 
 def s3_get(key):
     try:
-        r = s3.get_object(Bucket=DO_BUCKET, Key=f"{S3_PREFIX}{key}")
-        return json.loads(r['Body'].read())
+        r = storage.get_object(s3, DO_BUCKET, S3_PREFIX, key)
+        return serialization.decode(r['Body'].read(), r.get('Metadata'))
     except:
         return None
 
 def s3_put(key, data):
-    s3.put_object(Bucket=DO_BUCKET, Key=f"{S3_PREFIX}{key}",
-                  Body=json.dumps(data), ContentType='application/json')
+    body, metadata = serialization.encode(data)
+    s3.put_object(Bucket=DO_BUCKET, Key=f"{S3_PREFIX}{storage.physical_key(key)}",
+                  Body=body, ContentType='application/json',
+                  **serialization.put_kwargs(metadata))
+    shared_cache.invalidate(_shared_cache, key)
 
 member_list = s3_get('member_list.json') or {'members': []}
 members = member_list.get('members', [])
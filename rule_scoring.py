@@ -0,0 +1,273 @@
+"""
+Rule-based compatibility scoring for Love-Matcher matching
+
+calculate_compatibility_score_fallback() scores one pair in pure Python.
+It is the fallback when LLM scoring fails and the prefilter that picks
+which candidates reach the LLM.
+
+RuleScorer computes exactly the same scores for whole blocks of pairs
+with NumPy. Every profile is encoded once into arrays: age, lowered
+location/religion codes, location tokens, children intent flags and a
+presence bitmask for the education, career and lifestyle dimensions.
+Profiles whose fields the arrays cannot represent (non-dict dimensions,
+non-numeric ages) are scored with the per-pair function instead, so
+results always match it. RuleScorer needs the optional `numpy` package;
+check HAVE_NUMPY first.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+LIFESTYLE_DIMS = ['social_energy', 'domestic', 'cleanliness', 'food', 'travel',
+                  'hobbies', 'culture', 'humor', 'pets', 'substances']
+
+
+def calculate_compatibility_score_fallback(profile1, profile2):
+    """
+    Simple rule-based compatibility scoring as fallback
+    Returns a score between 0-100
+    """
+    score = 0
+    max_score = 0
+
+    dims1 = profile1.get('dimensions', {})
+    dims2 = profile2.get('dimensions', {})
+
+    # Age compatibility (within 5 years = good)
+    if 'age' in profile1 and 'age' in profile2:
+        age_diff = abs(profile1['age'] - profile2['age'])
+        if age_diff <= 5:
+            score += 10
+        elif age_diff <= 10:
+            score += 5
+        max_score += 10
+
+    # Location compatibility
+    if 'location' in dims1 and 'location' in dims2:
+        if isinstance(dims1['location'], str) and isinstance(dims2['location'], str):
+            if dims1['location'].lower() == dims2['location'].lower():
+                score += 15
+            elif any(word in dims1['location'].lower() for word in dims2['location'].lower().split()):
+                score += 8
+        max_score += 15
+
+    # Religion compatibility (high weight for traditional marriage focus)
+    if 'religion' in dims1 and 'religion' in dims2:
+        if isinstance(dims1['religion'], str) and isinstance(dims2['religion'], str):
+            if dims1['religion'].lower() == dims2['religion'].lower():
+                score += 20
+            elif 'none' in dims1['religion'].lower() and 'none' in dims2['religion'].lower():
+                score += 15
+        max_score += 20
+
+    # Children desires
+    if 'children' in dims1 and 'children' in dims2:
+        children1 = str(dims1['children']).lower()
+        children2 = str(dims2['children']).lower()
+        if ('yes' in children1 and 'yes' in children2) or ('no' in children1 and 'no' in children2):
+            score += 15
+        elif 'maybe' in children1 or 'maybe' in children2:
+            score += 8
+        max_score += 15
+
+    # Education compatibility
+    if 'education' in dims1 and 'education' in dims2:
+        score += 5
+        max_score += 5
+
+    # Career/Finances alignment
+    if 'career' in dims1 and 'career' in dims2:
+        score += 5
+        max_score += 5
+
+    # Lifestyle dimensions
+    for dim in LIFESTYLE_DIMS:
+        if dim in dims1 and dim in dims2:
+            score += 2
+            max_score += 2
+
+    # Calculate percentage
+    if max_score == 0:
+        return 60, {'reasoning': 'Insufficient profile data for accurate matching', 'strengths': 'Unknown', 'concerns': 'Incomplete profiles'}
+
+    final_score = int((score / max_score) * 100)
+    return final_score, {'reasoning': 'Rule-based fallback scoring', 'strengths': 'Basic compatibility', 'concerns': 'Limited analysis'}
+
+
+# Presence bits: education, career, then the lifestyle dimensions (2 points each)
+_BIT_EDUCATION = 1 << 0
+_BIT_CAREER = 1 << 1
+_LIFESTYLE_SHIFT = 2
+
+# Pair scores per block chunk (rows x cols), bounds temporary array memory
+_CHUNK_PAIRS = 1 << 20
+
+
+class RuleScorer:
+    """
+    Profiles encoded once into arrays; scores blocks of pairs with the
+    same result as calculate_compatibility_score_fallback(profile_i,
+    profile_j)[0]. Rows and columns are positions in `profiles`.
+    """
+
+    def __init__(self, profiles):
+        self.profiles = list(profiles)
+        self.position = {p.get('user_id'): i for i, p in enumerate(self.profiles)}
+        n = len(self.profiles)
+
+        self.irregular = np.zeros(n, dtype=bool)
+        self.has_age = np.zeros(n, dtype=bool)
+        self.age = np.zeros(n, dtype=np.float64)
+        self.has_loc = np.zeros(n, dtype=bool)
+        self.loc_code = np.full(n, -1, dtype=np.int64)      # -1: not a string
+        self.has_rel = np.zeros(n, dtype=bool)
+        self.rel_code = np.full(n, -1, dtype=np.int64)
+        self.rel_none = np.zeros(n, dtype=bool)
+        self.has_children = np.zeros(n, dtype=bool)
+        self.children_yes = np.zeros(n, dtype=bool)
+        self.children_no = np.zeros(n, dtype=bool)
+        self.children_maybe = np.zeros(n, dtype=bool)
+        self.presence = np.zeros(n, dtype=np.int64)
+
+        locations = {}   # lowered location -> code
+        religions = {}
+        for i, profile in enumerate(self.profiles):
+            dims = profile.get('dimensions', {})
+            if not isinstance(dims, dict):
+                self.irregular[i] = True
+                continue
+            if 'age' in profile:
+                age = profile['age']
+                if not isinstance(age, (int, float)) or (isinstance(age, int) and abs(age) > 2 ** 53):
+                    self.irregular[i] = True
+                    continue
+                self.has_age[i] = True
+                self.age[i] = age
+            if 'location' in dims:
+                self.has_loc[i] = True
+                if isinstance(dims['location'], str):
+                    self.loc_code[i] = locations.setdefault(dims['location'].lower(), len(locations))
+            if 'religion' in dims:
+                self.has_rel[i] = True
+                if isinstance(dims['religion'], str):
+                    religion = dims['religion'].lower()
+                    self.rel_code[i] = religions.setdefault(religion, len(religions))
+                    self.rel_none[i] = 'none' in religion
+            if 'children' in dims:
+                children = str(dims['children']).lower()
+                self.has_children[i] = True
+                self.children_yes[i] = 'yes' in children
+                self.children_no[i] = 'no' in children
+                self.children_maybe[i] = 'maybe' in children
+            bits = 0
+            if 'education' in dims:
+                bits |= _BIT_EDUCATION
+            if 'career' in dims:
+                bits |= _BIT_CAREER
+            for b, dim in enumerate(LIFESTYLE_DIMS):
+                if dim in dims:
+                    bits |= 1 << (_LIFESTYLE_SHIFT + b)
+            self.presence[i] = bits
+
+        # Location words: per distinct lowered location, its split() tokens
+        # as vocabulary ids, flattened with per-location offsets
+        self._locations = list(locations)
+        self._vocab = {}
+        flat, self._tok_start = [], [0]
+        for location in self._locations:
+            for word in location.split():
+                flat.append(self._vocab.setdefault(word, len(self._vocab)))
+            self._tok_start.append(len(flat))
+        self._tok_flat = np.array(flat, dtype=np.int64)
+        self._tok_start = np.array(self._tok_start, dtype=np.int64)
+        self._max_word = max((len(w) for w in self._vocab), default=0)
+
+        # Points per presence bitmask overlap: 5 each for education and
+        # career, 2 per lifestyle dimension (max grows by the same amount)
+        masks = np.arange(1 << (_LIFESTYLE_SHIFT + len(LIFESTYLE_DIMS)), dtype=np.int64)
+        self._presence_points = (5 * (masks & _BIT_EDUCATION > 0) + 5 * (masks & _BIT_CAREER > 0)
+                                 + 2 * np.array([bin(m >> _LIFESTYLE_SHIFT).count('1') for m in masks]))
+
+    def _word_hits(self, code):
+        """Bool per location code: does any of its words occur in location `code`?"""
+        text = self._locations[code]
+        mask = np.zeros(len(self._vocab), dtype=bool)
+        for start in range(len(text)):
+            for end in range(start + 1, min(len(text), start + self._max_word) + 1):
+                word_id = self._vocab.get(text[start:end])
+                if word_id is not None:
+                    mask[word_id] = True
+        hits = np.concatenate(([0], np.cumsum(mask[self._tok_flat])))
+        return hits[self._tok_start[1:]] - hits[self._tok_start[:-1]] > 0
+
+    def _location_partial(self, rows, cols):
+        """Word-overlap matrix for the rows x cols chunk (string locations only)."""
+        partial = np.zeros((len(rows), len(cols)), dtype=bool)
+        row_codes = self.loc_code[rows]
+        col_codes = self.loc_code[cols]
+        col_is_str = col_codes >= 0
+        for code in np.unique(row_codes[row_codes >= 0]):
+            hits = self._word_hits(code)
+            partial[row_codes == code] = col_is_str & hits[np.where(col_is_str, col_codes, 0)]
+        return partial
+
+    def _score_chunk(self, rows, cols):
+        r = rows[:, None]
+        c = cols[None, :]
+
+        both = self.has_age[r] & self.has_age[c]
+        diff = np.abs(self.age[r] - self.age[c])
+        score = np.where(both, np.where(diff <= 5, 10, np.where(diff <= 10, 5, 0)), 0)
+        max_score = 10 * both
+
+        both = self.has_loc[r] & self.has_loc[c]
+        strings = both & (self.loc_code[r] >= 0) & (self.loc_code[c] >= 0)
+        equal = strings & (self.loc_code[r] == self.loc_code[c])
+        partial = strings & ~equal & self._location_partial(rows, cols)
+        score = score + 15 * equal + 8 * partial
+        max_score = max_score + 15 * both
+
+        both = self.has_rel[r] & self.has_rel[c]
+        strings = both & (self.rel_code[r] >= 0) & (self.rel_code[c] >= 0)
+        equal = strings & (self.rel_code[r] == self.rel_code[c])
+        none = strings & ~equal & self.rel_none[r] & self.rel_none[c]
+        score = score + 20 * equal + 15 * none
+        max_score = max_score + 20 * both
+
+        both = self.has_children[r] & self.has_children[c]
+        agree = (self.children_yes[r] & self.children_yes[c]) | (self.children_no[r] & self.children_no[c])
+        maybe = self.children_maybe[r] | self.children_maybe[c]
+        score = score + np.where(both, np.where(agree, 15, np.where(maybe, 8, 0)), 0)
+        max_score = max_score + 15 * both
+
+        shared = self._presence_points[self.presence[r] & self.presence[c]]
+        score = score + shared
+        max_score = max_score + shared
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            final = np.where(max_score == 0, 60, ((score / max_score) * 100).astype(np.int64, copy=False))
+
+        irregular = self.irregular[r] | self.irregular[c]
+        if irregular.any():
+            for a, b in zip(*np.nonzero(irregular)):
+                final[a, b] = calculate_compatibility_score_fallback(
+                    self.profiles[rows[a]], self.profiles[cols[b]])[0]
+        return final
+
+    def score_block(self, rows, cols):
+        """int64 array [len(rows), len(cols)] of scores for profile rows[a] x cols[b]."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        out = np.empty((len(rows), len(cols)), dtype=np.int64)
+        step = max(1, _CHUNK_PAIRS // max(1, len(cols)))
+        for start in range(0, len(rows), step):
+            out[start:start + step] = self._score_chunk(rows[start:start + step], cols)
+        return out
+
+    def score_row(self, row, cols):
+        """Scores for profile `row` against each of cols."""
+        return self.score_block([row], cols)[0]
@@ -4,12 +4,16 @@ Daily matching script for Love-Matcher
 Run via crontab to assign matches to active profiles
 """
 
-import boto3
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import random
 import sys
+import threading
+import time
 import requests
+from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import config
@@ -23,47 +27,276 @@ except ImportError:
     print("ERROR: prompts.py not found")
     sys.exit(1)
 
-# AWS S3 Setup
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
-    region_name=config.AWS_REGION
-)
-
-S3_BUCKET = config.S3_BUCKET
-S3_PREFIX = config.S3_PREFIX
+import embeddings
+import match_state
+import rule_scoring
+import score_cache
+import serialization
+import shared_cache
+import storage
+from rule_scoring import calculate_compatibility_score_fallback
+
+# Bounded pool for bulk storage reads/writes
+S3_IO_WORKERS = getattr(config, 'S3_IO_WORKERS', 8)
+_s3_io_pool = ThreadPoolExecutor(max_workers=S3_IO_WORKERS, thread_name_prefix='s3-io')
+# Profile downloads queued at once while loading (bounds memory, not speed)
+S3_LOAD_IN_FLIGHT = getattr(config, 'S3_LOAD_IN_FLIGHT', S3_IO_WORKERS * 4)
+
+# Digital Ocean Spaces (shared client, pooled for the I/O workers)
+s3_client = storage.get_s3_client(max_pool_connections=S3_IO_WORKERS + 2)
+
+S3_BUCKET = storage.S3_BUCKET
+S3_PREFIX = storage.S3_PREFIX
+
+# Tell API workers to drop their cached copies of profiles we rewrite
+_shared_cache = shared_cache.from_config()
+
+# Attempts per profile when live traffic changes it while we are matching
+S3_WRITE_RETRIES = getattr(config, 'S3_WRITE_RETRIES', 5)
+
+# Persistent LLM pair scores, reused until either profile, the model or the
+# match prompt changes (None disables). Unused entries expire after a while.
+SCORE_CACHE_PATH = getattr(config, 'SCORE_CACHE_PATH', 'match_scores.db')
+SCORE_CACHE_MAX_AGE = getattr(config, 'SCORE_CACHE_MAX_AGE', 30 * 86400)
+_score_cache = score_cache.ScoreCache(SCORE_CACHE_PATH) if SCORE_CACHE_PATH else None
+
+# Prompt identity for score cache keys: the declared version plus a digest
+# of the prompt text, so an edit without a version bump still invalidates
+MATCH_PROMPT_ID = f"v{prompts.MATCH_PROMPT_VERSION}-{score_cache.content_hash(prompts.MATCH_COMPATIBILITY_PROMPT)[:8]}"
+
+# Local copy of every profile as of the last successful run, which lets
+# --incremental runs download only profiles with a dirty marker (None disables)
+MATCH_SNAPSHOT_PATH = getattr(config, 'MATCH_SNAPSHOT_PATH', 'match_snapshot.db')
+# Markers this much older than the run start are cleared; covers clock
+# skew between this host and the store (re-processing a user is harmless)
+MATCH_DIRTY_SKEW = timedelta(minutes=5)
 
 def s3_get(key):
     """Get object from S3"""
+    return s3_get_versioned(key)[0]
+
+def s3_get_versioned(key):
+    """Get object from S3 with its ETag, or (None, None)"""
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=f"{S3_PREFIX}{key}")
-        return json.loads(response['Body'].read())
+        return s3_get_sized(key)[:2]
     except:
-        return None
+        return None, None
 
-def s3_put(key, data):
-    """Put object to S3"""
-    s3_client.put_object(
+def s3_get_sized(key):
+    """
+    Get object from S3 as (data, etag, bytes transferred). A missing key
+    gives (None, None, 0) and an undecodable body (None, etag, size); any
+    other error is raised, so a transient failure is never taken for a
+    deleted profile.
+    """
+    try:
+        response = storage.get_object(s3_client, S3_BUCKET, S3_PREFIX, key)
+    except ClientError as e:
+        if storage.is_missing_key(e):
+            return None, None, 0
+        raise
+    body = response['Body'].read()
+    try:
+        data = serialization.decode(body, response.get('Metadata'))
+    except Exception:
+        data = None
+    return data, response.get('ETag'), len(body)
+
+def s3_put(key, data, expected_etag=storage.UNCONDITIONAL):
+    """Put object to S3, optionally only if it is still at expected_etag.
+    Returns the new ETag."""
+    body, metadata = serialization.encode(data)
+    response = storage.put_object_versioned(
+        s3_client,
+        expected_etag,
         Bucket=S3_BUCKET,
-        Key=f"{S3_PREFIX}{key}",
-        Body=json.dumps(data),
-        ContentType='application/json'
+        Key=f"{S3_PREFIX}{storage.physical_key(key)}",
+        Body=body,
+        ContentType='application/json',
+        **serialization.put_kwargs(metadata)
     )
+    shared_cache.invalidate(_shared_cache, key)
+    return response.get('ETag')
+
+def s3_update(key, data, etag, mutate, refresh=False):
+    """Write data (read at etag). If the object changed meanwhile, re-read it,
+    re-apply mutate and retry. With refresh, start from a fresh read instead
+    (for copies that may be old). Returns (data, etag, merges) as stored;
+    data is None if the object was deleted meanwhile."""
+    if refresh:
+        data, etag, _ = s3_get_sized(key)
+        if data is None:
+            return None, None, 0
+        mutate(data)
+    for merges in range(S3_WRITE_RETRIES):
+        try:
+            return data, s3_put(key, data, etag), merges
+        except storage.WriteConflict:
+            data, etag, _ = s3_get_sized(key)
+            if data is None:
+                return None, None, merges + 1  # deleted meanwhile
+            mutate(data)
+    raise storage.WriteConflict(key)
+
+def s3_update_many(items):
+    """Run s3_update for several (key, data, etag, mutate, refresh) concurrently.
+    Returns (total merges, [(data, etag) per item]); raises the first failure"""
+    futures = [_s3_io_pool.submit(s3_update, *item) for item in items]
+    merges, results, errors = 0, [], []
+    for future in futures:
+        try:
+            data, etag, item_merges = future.result()
+            merges += item_merges
+            results.append((data, etag))
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return merges, results
+
+def merge_pool_entries(profile, entries):
+    """Re-apply this run's pool additions to a profile that changed under us,
+    respecting anything the user dismissed or added in the meantime"""
+    pool = profile.setdefault('match_pool', [])
+    rejected = set(profile.get('rejected_matches', []))
+    for entry in entries:
+        if len(pool) >= 3:
+            break
+        if entry['user_id'] in rejected or any(e.get('user_id') == entry['user_id'] for e in pool):
+            continue
+        pool.append(entry)
 
-def s3_list_profiles():
-    """List all profile keys in S3"""
-    try:
-        response = s3_client.list_objects_v2(
-            Bucket=S3_BUCKET,
-            Prefix=f"{S3_PREFIX}profiles/"
-        )
-        if 'Contents' not in response:
-            return []
-        return [obj['Key'] for obj in response['Contents'] if obj['Key'].endswith('.json')]
-    except Exception as e:
-        print(f"Error listing profiles: {e}")
-        return []
+def iter_profile_keys():
+    """Stream every profile key in S3 (logical keys, e.g. profiles/{user}.json)
+    page by page. Listing errors propagate: a partial listing would silently
+    leave users out of the run."""
+    for key in storage.iter_keys(s3_client, S3_BUCKET, S3_PREFIX, 'profiles/'):
+        if key.endswith('.json'):
+            yield key
+
+def load_profiles(keys, progress_every=5.0):
+    """
+    Download keys on the S3 I/O pool with at most S3_LOAD_IN_FLIGHT requests
+    outstanding, consuming `keys` lazily so listing and loading overlap.
+    Returns ([(key, data, etag)] sorted by key, stats), printing progress
+    every progress_every seconds. A failed download raises (see
+    s3_get_sized) rather than leaving the profile out of the run.
+    """
+    results = []
+    in_flight = deque()
+    loaded_bytes = 0
+    started = last_report = time.time()
+
+    def collect():
+        nonlocal loaded_bytes
+        key, future = in_flight.popleft()
+        data, etag, size = future.result()
+        results.append((key, data, etag))
+        loaded_bytes += size
+
+    for key in keys:
+        if len(in_flight) >= S3_LOAD_IN_FLIGHT:
+            collect()
+            if time.time() - last_report >= progress_every:
+                last_report = time.time()
+                elapsed = last_report - started
+                print(f"  … {len(results)} loaded ({len(results) / elapsed:.0f} profiles/s, "
+                      f"{loaded_bytes / elapsed / 1e6:.2f} MB/s)")
+        in_flight.append((key, _s3_io_pool.submit(s3_get_sized, key)))
+    while in_flight:
+        collect()
+
+    elapsed = time.time() - started
+    results.sort(key=lambda r: r[0])
+    return results, {
+        'profiles': len(results),
+        'bytes': loaded_bytes,
+        'seconds': round(elapsed, 2),
+        'profiles_per_s': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'mb_per_s': round(loaded_bytes / elapsed / 1e6, 2) if elapsed else 0.0,
+    }
+
+class LLMScheduler:
+    """
+    Adaptive limit on in-flight OpenRouter calls (AIMD): a 429 halves the
+    limit, and each run of `limit` healthy responses raises it by one, up
+    to `maximum`. Also collects call latencies for the run summary.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.in_flight = 0
+        self._healthy = 0
+        self._cond = threading.Condition()
+        self.latencies = []
+        self.throttled = 0
+        self.min_limit = self.limit
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, rate_limited=False):
+        with self._cond:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            if rate_limited:
+                self.throttled += 1
+                self._healthy = 0
+                self.limit = max(1, self.limit // 2)
+                self.min_limit = min(self.min_limit, self.limit)
+            else:
+                self._healthy += 1
+                if self._healthy >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._healthy = 0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+        return {
+            'llm_calls': len(latencies),
+            'latency_p50_s': percentile(0.50),
+            'latency_p95_s': percentile(0.95),
+            'rate_limited': self.throttled,
+            'concurrency': self.maximum,
+            'min_concurrency': self.min_limit,
+        }
+
+# Concurrent OpenRouter calls during scoring (--concurrency overrides)
+LLM_CONCURRENCY = getattr(config, 'LLM_CONCURRENCY', 8)
+# Attempts after a 429 before falling back to rule-based scoring
+LLM_RATE_LIMIT_RETRIES = getattr(config, 'LLM_RATE_LIMIT_RETRIES', 4)
+_llm_scheduler = LLMScheduler(LLM_CONCURRENCY)
+
+# Candidates per user sent to LLM scoring after the rule-based prefilter
+# (0 scores every eligible candidate; --shortlist overrides)
+MATCH_SHORTLIST_SIZE = getattr(config, 'MATCH_SHORTLIST_SIZE', 15)
+
+# How the shortlist is picked: 'rules' ranks every eligible candidate with
+# the rule-based scorer, 'embedding' asks an IVF index over local text
+# embeddings of the dimensions for the nearest ones (--retrieval overrides).
+# Embedding vectors are cached by text hash and expire like pair scores.
+MATCH_RETRIEVAL = getattr(config, 'MATCH_RETRIEVAL', 'rules')
+EMBEDDING_DIM = getattr(config, 'EMBEDDING_DIM', 256)
+EMBEDDING_CACHE_PATH = getattr(config, 'EMBEDDING_CACHE_PATH', 'match_embeddings.db')
+IVF_PROBES = getattr(config, 'IVF_PROBES', 8)
+_embedding_cache = None
+
+def get_embedding_cache():
+    """Embedding vector cache, opened on first use (None if disabled)"""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_PATH:
+        _embedding_cache = embeddings.EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
 
 def call_openrouter_completion(prompt, temperature=0.3, max_tokens=500):
     """
@@ -87,12 +320,25 @@ def call_openrouter_completion(prompt, temperature=0.3, max_tokens=500):
             'max_tokens': max_tokens
         }
         
-        response = requests.post(
-            config.OPENROUTER_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            _llm_scheduler.acquire()
+            started = time.time()
+            response = None
+            try:
+                response = requests.post(
+                    config.OPENROUTER_API_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=30
+                )
+            finally:
+                _llm_scheduler.release(time.time() - started,
+                                       rate_limited=response is not None and response.status_code == 429)
+            if response.status_code != 429 or attempt == LLM_RATE_LIMIT_RETRIES:
+                break
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.replace('.', '', 1).isdigit() else 2 ** attempt
+            time.sleep(min(delay, 60) * (0.5 + random.random() / 2))
         
         if response.status_code >= 400:
             print(f"⚠️ OpenRouter error {response.status_code}: {response.text}")
@@ -108,11 +354,25 @@ def call_openrouter_completion(prompt, temperature=0.3, max_tokens=500):
         print(f"❌ Error calling OpenRouter: {e}")
         return None
 
+def score_cache_key(profile1, profile2):
+    """Cache key for a pair: order-independent, changes with either profile's matching data"""
+    return score_cache.pair_key(
+        profile1.get('user_id', 'unknown'), score_cache.content_hash(prompts.extract_matching_data(profile1)),
+        profile2.get('user_id', 'unknown'), score_cache.content_hash(prompts.extract_matching_data(profile2)),
+        config.OPENROUTER_MODEL, MATCH_PROMPT_ID
+    )
+
 def calculate_compatibility_score(profile1, profile2):
     """
     LLM-based compatibility scoring using OpenRouter /completion endpoint
     Returns a score between 0-100 and analysis details
     """
+    cache_key = score_cache_key(profile1, profile2) if _score_cache else None
+    if cache_key:
+        cached = _score_cache.get(cache_key)
+        if cached:
+            return cached
+
     # Build compatibility analysis prompt
     prompt = prompts.build_match_compatibility_prompt(profile1, profile2)
     
@@ -141,86 +401,14 @@ def calculate_compatibility_score(profile1, profile2):
             return calculate_compatibility_score_fallback(profile1, profile2)
         
         print(f"  💡 LLM Match Score: {score}% - {analysis.get('reasoning', 'N/A')[:60]}...")
+        if cache_key:
+            _score_cache.set(cache_key, score, analysis)
         return score, analysis
         
     except (json.JSONDecodeError, ValueError) as e:
         print(f"  ⚠️ Failed to parse LLM response: {e}, using fallback")
         return calculate_compatibility_score_fallback(profile1, profile2)
 
-def calculate_compatibility_score_fallback(profile1, profile2):
-    """
-    Simple rule-based compatibility scoring as fallback
-    Returns a score between 0-100
-    """
-    score = 0
-    max_score = 0
-    
-    dims1 = profile1.get('dimensions', {})
-    dims2 = profile2.get('dimensions', {})
-    
-    # Age compatibility (within 5 years = good)
-    if 'age' in profile1 and 'age' in profile2:
-        age_diff = abs(profile1['age'] - profile2['age'])
-        if age_diff <= 5:
-            score += 10
-        elif age_diff <= 10:
-            score += 5
-        max_score += 10
-    
-    # Location compatibility
-    if 'location' in dims1 and 'location' in dims2:
-        if isinstance(dims1['location'], str) and isinstance(dims2['location'], str):
-            if dims1['location'].lower() == dims2['location'].lower():
-                score += 15
-            elif any(word in dims1['location'].lower() for word in dims2['location'].lower().split()):
-                score += 8
-        max_score += 15
-    
-    # Religion compatibility (high weight for traditional marriage focus)
-    if 'religion' in dims1 and 'religion' in dims2:
-        if isinstance(dims1['religion'], str) and isinstance(dims2['religion'], str):
-            if dims1['religion'].lower() == dims2['religion'].lower():
-                score += 20
-            elif 'none' in dims1['religion'].lower() and 'none' in dims2['religion'].lower():
-                score += 15
-        max_score += 20
-    
-    # Children desires
-    if 'children' in dims1 and 'children' in dims2:
-        children1 = str(dims1['children']).lower()
-        children2 = str(dims2['children']).lower()
-        if ('yes' in children1 and 'yes' in children2) or ('no' in children1 and 'no' in children2):
-            score += 15
-        elif 'maybe' in children1 or 'maybe' in children2:
-            score += 8
-        max_score += 15
-    
-    # Education compatibility
-    if 'education' in dims1 and 'education' in dims2:
-        score += 5
-        max_score += 5
-    
-    # Career/Finances alignment
-    if 'career' in dims1 and 'career' in dims2:
-        score += 5
-        max_score += 5
-    
-    # Lifestyle dimensions
-    lifestyle_dims = ['social_energy', 'domestic', 'cleanliness', 'food', 'travel', 
-                      'hobbies', 'culture', 'humor', 'pets', 'substances']
-    
-    for dim in lifestyle_dims:
-        if dim in dims1 and dim in dims2:
-            score += 2
-            max_score += 2
-    
-    # Calculate percentage
-    if max_score == 0:
-        return 60, {'reasoning': 'Insufficient profile data for accurate matching', 'strengths': 'Unknown', 'concerns': 'Incomplete profiles'}
-    
-    final_score = int((score / max_score) * 100)
-    return final_score, {'reasoning': 'Rule-based fallback scoring', 'strengths': 'Basic compatibility', 'concerns': 'Limited analysis'}
-
 def normalize_gender(g):
     if not g:
         return None
@@ -232,10 +420,177 @@ def normalize_gender(g):
     return g
 
 
-def find_top_matches_for_user(user_profile, all_profiles, n=3, verbose=False):
+def changed_buckets(profiles):
+    """(gender, seeking) buckets the given profile versions were matchable in"""
+    buckets = set()
+    for profile in profiles:
+        gender = normalize_gender(profile.get('gender'))
+        seeking = normalize_gender(profile.get('seeking_gender'))
+        if profile.get('matching_active', False) and gender and seeking:
+            buckets.add((gender, seeking))
+    return buckets
+
+def sees_bucket(profile, buckets):
+    """Whether any of buckets is this profile's candidate bucket"""
+    return (normalize_gender(profile.get('seeking_gender')), normalize_gender(profile.get('gender'))) in buckets
+
+
+class CandidateIndex:
+    """
+    Matchable profiles bucketed by normalized (gender, seeking_gender),
+    built once per run. Only profiles that are matching_active and have
+    both fields set are indexed; rejections are kept as sets.
+    """
+
+    def __init__(self, profiles):
+        self.buckets = {}
+        self.rejected = {}
+        self.considered = 0
+        self.shortlisted = 0
+        self._scorer = None
+        self.embeddings = None
+        self._ivf = {}
+        for profile in profiles:
+            if not profile.get('matching_active', False):
+                continue
+            gender = normalize_gender(profile.get('gender'))
+            seeking = normalize_gender(profile.get('seeking_gender'))
+            if not gender or not seeking:
+                continue
+            self.buckets.setdefault((gender, seeking), []).append(profile)
+            self.rejected[profile['user_id']] = set(profile.get('rejected_matches', []))
+
+    def candidates_for(self, gender, seeking):
+        """Profiles of gender `seeking` who are seeking `gender`"""
+        return self.buckets.get((seeking, gender), [])
+
+    def has_rejected(self, user_id, other_id):
+        return other_id in self.rejected.get(user_id, ())
+
+    def shortlist(self, user_profile, candidates, k):
+        """
+        The k candidates with the best rule-based score, in their original
+        order (ties keep the earlier candidate). Returns all of them when
+        k is 0 or there are no more than k.
+        """
+        self.considered += len(candidates)
+        if not k or len(candidates) <= k:
+            self.shortlisted += len(candidates)
+            return candidates
+        scores = self._rule_scores(user_profile, candidates)
+        ranked = sorted(range(len(candidates)), key=lambda i: -scores[i])[:k]
+        self.shortlisted += k
+        return [candidates[i] for i in sorted(ranked)]
+
+    def _rule_scores(self, user_profile, candidates):
+        """Rule-based scores of user_profile x each candidate, batched with
+        NumPy when available (one encoding of every indexed profile per run)."""
+        if not rule_scoring.HAVE_NUMPY:
+            return [calculate_compatibility_score_fallback(user_profile, c)[0] for c in candidates]
+        if self._scorer is None:
+            self._scorer = rule_scoring.RuleScorer(p for bucket in self.buckets.values() for p in bucket)
+        position = self._scorer.position
+        row = position.get(user_profile['user_id'])
+        cols = [position.get(c['user_id']) for c in candidates]
+        encoded = self._scorer.profiles
+        if (row is None or None in cols or encoded[row] is not user_profile
+                or any(encoded[j] is not c for j, c in zip(cols, candidates))):
+            return [calculate_compatibility_score_fallback(user_profile, c)[0] for c in candidates]
+        return self._scorer.score_row(row, cols).tolist()
+
+    def nearest(self, user_profile, gender, seeking, k, accept):
+        """
+        Up to k accepted candidates from the complementary bucket whose
+        dimension embeddings are closest to user_profile's, in bucket order.
+        Returns None when user_profile is not indexed.
+        """
+        if self.embeddings is None:
+            self.embeddings = embeddings.ProfileEmbeddings(
+                (p for bucket in self.buckets.values() for p in bucket),
+                dim=EMBEDDING_DIM, cache=get_embedding_cache())
+            self._rows = {id(p): row for row, p in enumerate(self.embeddings.profiles)}
+        row = self._rows.get(id(user_profile))
+        if row is None:
+            return None
+        bucket_key = (seeking, gender)
+        bucket = self.buckets.get(bucket_key, [])
+        if bucket_key not in self._ivf:
+            vectors = self.embeddings.vectors[[self._rows[id(p)] for p in bucket]]
+            self._ivf[bucket_key] = embeddings.IVFIndex(vectors, n_probe=IVF_PROBES)
+        found, compared = self._ivf[bucket_key].search(
+            self.embeddings.vectors[row], k, lambda i: accept(bucket[i]))
+        self.considered += compared
+        self.shortlisted += len(found)
+        return [bucket[i] for i in sorted(found)]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+
+class PairScores:
+    """
+    Per-run memo of compatibility scores keyed by the unordered pair, so
+    B x A reuses the result computed for A x B. Scoring only reads
+    matching data, which does not change during a run.
+
+    score_many() scores one user's candidates on `workers` threads (the
+    LLMScheduler decides how many calls are actually in flight) and returns
+    results in candidate order, so the greedy pool filling is unchanged.
+    """
+
+    def __init__(self, workers=1):
+        self.scores = {}
+        self.reused = 0
+        self.scoring_time = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm') if workers > 1 else None
+
+    def _compute(self, profile1, profile2):
+        result = calculate_compatibility_score(profile1, profile2)
+        return result if isinstance(result, tuple) else (result, {})
+
+    def score(self, profile1, profile2):
+        return self.score_many(profile1, [profile2])[0]
+
+    def score_many(self, profile, candidates):
+        """Scores for profile x each candidate, as (score, analysis), in order."""
+        keys = [tuple(sorted((profile['user_id'], c['user_id']))) for c in candidates]
+        todo = {}
+        for key, candidate in zip(keys, candidates):
+            if key in self.scores:
+                self.reused += 1
+            else:
+                todo.setdefault(key, candidate)
+        if todo:
+            started = time.time()
+            if self._pool is None or len(todo) == 1:
+                results = [self._compute(profile, c) for c in todo.values()]
+            else:
+                results = list(self._pool.map(lambda c: self._compute(profile, c), todo.values()))
+            self.scores.update(zip(todo.keys(), results))
+            self.scoring_time += time.time() - started
+        return [self.scores[key] for key in keys]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def stats(self):
+        return {
+            'pairs_scored': len(self.scores),
+            'reused': self.reused,
+            'scoring_time_s': round(self.scoring_time, 2),
+            'pairs_per_s': round(len(self.scores) / self.scoring_time, 2) if self.scoring_time else 0.0,
+        }
+
+
+def find_top_matches_for_user(user_profile, index, n=3, verbose=False, pair_scores=None, shortlist=0,
+                              retrieval='rules'):
     """
     Find up to n compatible matches for a user, sorted by score descending.
-    Returns list of (profile, score, analysis).
+    index is the run's CandidateIndex, pair_scores its PairScores memo (if any).
+    With shortlist > 0 only that many candidates go on to LLM scoring: the
+    best by the rule-based scorer, or with retrieval='embedding' the
+    nearest by dimension embeddings. Returns list of (profile, score, analysis).
     """
     user_id = user_profile['user_id']
     user_gender_n = normalize_gender(user_profile.get('gender'))
@@ -255,38 +610,45 @@ def find_top_matches_for_user(user_profile, all_profiles, n=3, verbose=False):
 
     scored = []
 
-    for candidate in all_profiles:
+    def is_eligible(candidate):
         cid = candidate['user_id']
         if cid == user_id:
-            continue
-        if not candidate.get('matching_active', False):
-            continue
+            return False
         if cid in pool_ids:
-            continue
+            return False
         if cid in rejected_ids:
-            continue
-        if user_id in candidate.get('rejected_matches', []):
-            continue
-
-        cg = normalize_gender(candidate.get('gender'))
-        cs = normalize_gender(candidate.get('seeking_gender'))
-        if not cg or not cs:
-            continue
-        if user_seeking_n != cg or cs != user_gender_n:
-            continue
-
-        if verbose:
-            print(f"     → Scoring {cid}")
-
-        score_result = calculate_compatibility_score(user_profile, candidate)
-        score, analysis = score_result if isinstance(score_result, tuple) else (score_result, {})
+            return False
+        if index.has_rejected(cid, user_id):
+            return False
+        return True
+
+    # The complementary bucket is already active, gendered and seeking us
+    bucket = index.candidates_for(user_gender_n, user_seeking_n)
+    eligible = None
+    if retrieval == 'embedding' and shortlist:
+        eligible = index.nearest(user_profile, user_gender_n, user_seeking_n, shortlist, is_eligible)
+    if eligible is None:
+        eligible = index.shortlist(user_profile, [c for c in bucket if is_eligible(c)], shortlist)
+
+    if verbose and eligible:
+        print(f"     → Scoring {len(eligible)} of {len(bucket)} candidates")
+
+    if pair_scores is not None:
+        results = pair_scores.score_many(user_profile, eligible)
+    else:
+        results = []
+        for candidate in eligible:
+            score_result = calculate_compatibility_score(user_profile, candidate)
+            results.append(score_result if isinstance(score_result, tuple) else (score_result, {}))
 
+    for candidate, (score, analysis) in zip(eligible, results):
+        cid = candidate['user_id']
         if score >= 15:
             scored.append((candidate, score, analysis))
             if verbose:
-                print(f"       Score: {score}%  ✓")
+                print(f"       {cid}: {score}%  ✓")
         elif verbose:
-            print(f"       Score: {score}%  (below threshold)")
+            print(f"       {cid}: {score}%  (below threshold)")
 
     scored.sort(key=lambda x: x[1], reverse=True)
     result = scored[:n]
@@ -299,40 +661,93 @@ def find_top_matches_for_user(user_profile, all_profiles, n=3, verbose=False):
 
     return result
 
-def run_matching(dry_run=False, verbose=False):
+def save_run_state(snapshot, profiles, run_started):
+    """Snapshot this run's profiles ({user_id: (profile, etag)}) and clear
+    the dirty markers it consumed"""
+    if snapshot is not None:
+        snapshot.replace(profiles, run_started)
+    cleared = match_state.clear_dirty(s3_client, S3_BUCKET, S3_PREFIX, run_started - MATCH_DIRTY_SKEW)
+    print(f"📸 Saved snapshot of {len(profiles)} profiles, cleared {cleared} change markers")
+
+def run_matching(dry_run=False, verbose=False, concurrency=None, shortlist=None, retrieval=None,
+                 incremental=False):
     """Main matching algorithm - runs daily
     
     Args:
         dry_run: If True, only simulate matching without saving changes
         verbose: If True, output detailed matching progress
+        concurrency: Max concurrent LLM scoring calls (default LLM_CONCURRENCY)
+        shortlist: Candidates per user sent to the LLM (default MATCH_SHORTLIST_SIZE, 0 = all)
+        retrieval: 'rules' or 'embedding' shortlist selection (default MATCH_RETRIEVAL)
+        incremental: If True, only evaluate users changed since the last run
     """
+    global _llm_scheduler
+    concurrency = concurrency or LLM_CONCURRENCY
+    shortlist = MATCH_SHORTLIST_SIZE if shortlist is None else shortlist
+    retrieval = retrieval or MATCH_RETRIEVAL
+    if retrieval == 'embedding' and not embeddings.HAVE_NUMPY:
+        print("⚠️ Embedding retrieval needs numpy; using rule-based retrieval")
+        retrieval = 'rules'
+    _llm_scheduler = LLMScheduler(concurrency)
+
     print("\n" + "=" * 60)
     print(f"🎯 Love-Matcher Daily Matching {'(DRY RUN)' if dry_run else ''}")
     print(f"Run time: {datetime.utcnow().isoformat()}")
     print("=" * 60 + "\n")
-    
-    # Get all profile keys
-    print("📂 Loading profiles from S3...")
-    profile_keys = s3_list_profiles()
-    print(f"✓ Found {len(profile_keys)} total profile files in S3")
-    
-    # Load all profiles
-    print("\n📊 Loading and validating profiles...")
+
+    run_started = datetime.now(timezone.utc)
+    snapshot = match_state.ProfileSnapshot(MATCH_SNAPSHOT_PATH) if MATCH_SNAPSHOT_PATH else None
+    dirty_ids = None  # None: every user is evaluated
+    touched = set()   # candidate buckets changed users were or are in
+    if incremental:
+        last_run = snapshot.last_run() if snapshot else None
+        if last_run is None:
+            print("⚠️  No snapshot from a previous run; running a full match instead\n")
+        else:
+            dirty_ids = set(match_state.list_dirty(s3_client, S3_BUCKET, S3_PREFIX))
+
     all_profiles = []
     invalid_profiles = []
-    for key in profile_keys:
-        # Extract just the filename part after the prefix
-        filename = key.replace(f"{S3_PREFIX}profiles/", "")
-        profile = s3_get(f"profiles/{filename}")
-        if profile and isinstance(profile, dict):
+    etags = {}  # user_id -> ETag at load time, for conflict-checked saves
+    if dirty_ids is not None:
+        print(f"📂 Incremental run: {len(dirty_ids)} users changed since {last_run.isoformat()}")
+        loaded = snapshot.load()
+        changed = sorted(dirty_ids)
+        previous = [loaded[uid][0] for uid in changed if uid in loaded]
+        fetched, load_stats = load_profiles(f"profiles/{uid}.json" for uid in changed)
+        for key, profile, etag in fetched:
+            user_id = match_state.profile_user_id(key)
+            if profile and isinstance(profile, dict):
+                loaded[user_id] = (profile, etag)
+            else:
+                loaded.pop(user_id, None)  # deleted (or unreadable, as in a full run)
+        for user_id, (profile, etag) in loaded.items():
             all_profiles.append(profile)
-        else:
-            invalid_profiles.append(filename)
-            print(f"  ⚠️  Skipping invalid profile: {filename}")
-    
-    print(f"✓ Loaded {len(all_profiles)} valid profiles")
-    if invalid_profiles:
-        print(f"✗ Skipped {len(invalid_profiles)} invalid profiles")
+            etags[user_id] = etag
+        print(f"✓ {len(all_profiles)} profiles: {len(changed)} refreshed from S3, the rest from the snapshot")
+        touched = changed_buckets(previous + [loaded[uid][0] for uid in changed if uid in loaded])
+    else:
+        # Stream profile keys from the listing straight into the loader
+        print(f"📂 Loading profiles from S3 ({S3_IO_WORKERS} workers, up to {S3_LOAD_IN_FLIGHT} in flight)...")
+        fetched, load_stats = load_profiles(iter_profile_keys())
+        print(f"✓ Found {len(fetched)} total profile files in S3")
+
+        # Validate
+        print("\n📊 Validating profiles...")
+        for key, profile, etag in fetched:
+            filename = key.replace("profiles/", "", 1)
+            if profile and isinstance(profile, dict):
+                all_profiles.append(profile)
+                etags[profile.get('user_id')] = etag
+            else:
+                invalid_profiles.append(filename)
+                print(f"  ⚠️  Skipping invalid profile: {filename}")
+
+        print(f"✓ Loaded {len(all_profiles)} valid profiles")
+        if invalid_profiles:
+            print(f"✗ Skipped {len(invalid_profiles)} invalid profiles")
+    print(f"⏱️  Downloaded {load_stats['profiles']} profiles in {load_stats['seconds']}s "
+          f"({load_stats['profiles_per_s']} profiles/s, {load_stats['mb_per_s']} MB/s)")
     
     # Data checking - profile status breakdown
     print("\n📈 Profile Status Breakdown:")
@@ -347,32 +762,50 @@ def run_matching(dry_run=False, verbose=False):
     print(f"  Free members: {free_members}")
     print(f"  Paid members: {total_users - free_members}")
 
-    # Users who are active and whose pool has fewer than 3 entries
+    # Users who are active and whose pool has fewer than 3 entries (in an
+    # incremental run, only those changed since the last run plus those
+    # whose candidate bucket a change touched)
     print("\n🔍 Filtering users needing matches...")
     users_needing_matches = [
         p for p in all_profiles
         if p.get('matching_active', False)
         and len(p.get('match_pool', [])) < 3
+        and (dirty_ids is None or p.get('user_id') in dirty_ids or sees_bucket(p, touched))
     ]
+    if dirty_ids is not None:
+        print(f"  Changed users with room: {sum(1 for p in users_needing_matches if p.get('user_id') in dirty_ids)}, "
+              f"unchanged users re-evaluated for touched buckets: "
+              f"{sum(1 for p in users_needing_matches if p.get('user_id') not in dirty_ids)}")
     users_needing_matches.sort(key=lambda p: len(p.get('dimensions', {})), reverse=True)
 
     print(f"  Users with room for more matches: {len(users_needing_matches)}")
 
-    if len(users_needing_matches) < 2:
+    # A full run needs two such users; a changed user can match anyone
+    if len(users_needing_matches) < (1 if dirty_ids is not None else 2):
         print("\n⚠️  Not enough users needing matches")
+        if not dry_run:
+            save_run_state(snapshot, {p['user_id']: (p, etags.get(p['user_id'])) for p in all_profiles},
+                           run_started)
         return {
             'success': True,
             'pool_additions': 0,
             'reason': 'Not enough users needing matches',
             'total_profiles': len(all_profiles),
+            'incremental': dirty_ids is not None,
+            'profile_load': load_stats,
         }
 
     # Track all pool additions made this run
     pool_additions = []
     profiles_to_save = set()
+    added_entries = {}  # user_id -> pool entries added this run
 
     # Build quick lookup map (we modify profiles in-place so candidates see updates)
     profile_map = {p['user_id']: p for p in all_profiles}
+    index = CandidateIndex(all_profiles)
+    pair_scores = PairScores(workers=concurrency)
+    if verbose:
+        print(f"  Candidate index: {len(index)} matchable profiles in {len(index.buckets)} buckets")
 
     print("\n💑 Starting match-pool filling...")
     if verbose:
@@ -389,7 +822,8 @@ def run_matching(dry_run=False, verbose=False):
             print(f"User {idx}/{len(users_needing_matches)}: {user_id} (needs {slots} more)")
             print(f"{'='*60}")
 
-        top = find_top_matches_for_user(user, all_profiles, n=slots, verbose=verbose)
+        top = find_top_matches_for_user(user, index, n=slots, verbose=verbose, pair_scores=pair_scores,
+                                        shortlist=shortlist, retrieval=retrieval)
 
         now = datetime.utcnow().isoformat()
 
@@ -399,12 +833,14 @@ def run_matching(dry_run=False, verbose=False):
             # Add to user's pool
             if 'match_pool' not in user:
                 user['match_pool'] = []
-            user['match_pool'].append({
+            entry = {
                 'user_id': cid,
                 'score': score,
                 'analysis': analysis or {},
                 'matched_at': now,
-            })
+            }
+            user['match_pool'].append(entry)
+            added_entries.setdefault(user_id, []).append(entry)
             profiles_to_save.add(user_id)
 
             # Add user to candidate's pool (if they still have room and not already there)
@@ -413,12 +849,14 @@ def run_matching(dry_run=False, verbose=False):
             if len(cand_pool) < 3 and not any(e['user_id'] == user_id for e in cand_pool):
                 if 'match_pool' not in cand:
                     cand['match_pool'] = []
-                cand['match_pool'].append({
+                entry = {
                     'user_id': user_id,
                     'score': score,
                     'analysis': analysis or {},
                     'matched_at': now,
-                })
+                }
+                cand['match_pool'].append(entry)
+                added_entries.setdefault(cid, []).append(entry)
                 profiles_to_save.add(cid)
 
             pool_additions.append({'user1': user_id, 'user2': cid, 'score': score})
@@ -428,8 +866,27 @@ def run_matching(dry_run=False, verbose=False):
     # Save all modified profiles
     if not dry_run:
         print(f"\n💾 Saving {len(profiles_to_save)} updated profiles...")
-        for uid in profiles_to_save:
-            s3_put(f"profiles/{uid}.json", profile_map[uid])
+        save_ids = sorted(profiles_to_save)
+        # Snapshot copies can be days old (only matching changes leave a
+        # marker): re-read them and re-apply this run's additions rather than
+        # write them back. Without conditional writes If-Match protects
+        # nothing, so every save does that.
+        refresh_all = not storage.S3_CONDITIONAL_WRITES
+        merges, saved = s3_update_many([
+            (f"profiles/{uid}.json", profile_map[uid], etags.get(uid, storage.UNCONDITIONAL),
+             lambda p, entries=added_entries[uid]: merge_pool_entries(p, entries),
+             refresh_all or (dirty_ids is not None and uid not in dirty_ids))
+            for uid in save_ids
+        ])
+        if merges:
+            print(f"  🔀 Merged into {merges} profiles that changed during the run")
+        state = {uid: (profile, etags.get(uid)) for uid, profile in profile_map.items()}
+        for uid, (profile, etag) in zip(save_ids, saved):
+            if profile is None:
+                state.pop(uid, None)
+            else:
+                state[uid] = (profile, etag)
+        save_run_state(snapshot, state, run_started)
     else:
         print(f"\n🔸 DRY RUN — would save {len(profiles_to_save)} profiles")
 
@@ -437,16 +894,52 @@ def run_matching(dry_run=False, verbose=False):
     if unfilled:
         print(f"\n  ⚠️  {unfilled} users still have fewer than 3 matches (pool exhausted)")
     
+    pair_scores.close()
+    pair_stats = pair_scores.stats()
+    pair_stats.update(_llm_scheduler.stats())
+    pair_stats.update({'shortlist': shortlist, 'retrieval': retrieval, 'candidates_considered': index.considered,
+                       'candidates_shortlisted': index.shortlisted})
+    print()
+    if shortlist:
+        print(f"🎯 Prefilter ({retrieval}): {index.shortlisted} of {index.considered} candidate evaluations "
+              f"sent to LLM scoring (top {shortlist} per user)")
+    if index.embeddings is not None:
+        pair_stats.update({'embeddings_cached': index.embeddings.cached, 'embeddings_computed': index.embeddings.computed})
+        print(f"🧭 Embeddings: {len(index.embeddings.profiles)} profiles, {index.embeddings.cached} from cache, "
+              f"{index.embeddings.computed} new texts embedded")
+        if get_embedding_cache():
+            get_embedding_cache().prune(SCORE_CACHE_MAX_AGE)
+    print(f"♻️  Pair scores: {pair_stats['pairs_scored']} unique pairs scored, "
+          f"{pair_stats['reused']} reused in the reverse direction ({pair_stats['reused']} scoring calls saved)")
+    print(f"⚡ Scoring: {pair_stats['pairs_per_s']} pairs/s over {pair_stats['scoring_time_s']}s, "
+          f"{pair_stats['llm_calls']} LLM calls (p50 {pair_stats['latency_p50_s']}s, p95 {pair_stats['latency_p95_s']}s), "
+          f"concurrency {pair_stats['min_concurrency']}-{pair_stats['concurrency']}, "
+          f"{pair_stats['rate_limited']} rate-limited")
+
+    score_stats = _score_cache.stats() if _score_cache else None
+    if score_stats:
+        pruned = _score_cache.prune(SCORE_CACHE_MAX_AGE)
+        print(f"\n🗄️  Score cache: {score_stats['hits']} hits, {score_stats['misses']} misses "
+              f"({score_stats['hit_rate']:.1%} hit rate), {score_stats['stores']} new scores stored"
+              f"{f', {pruned} expired' if pruned else ''}")
+
     print("\n" + "=" * 60)
     print(f"✓ Matching complete: {len(pool_additions)} pool additions")
+    print(f"  Profile load: {load_stats['profiles']} in {load_stats['seconds']}s "
+          f"({load_stats['profiles_per_s']} profiles/s, {load_stats['mb_per_s']} MB/s)")
     print("=" * 60 + "\n")
 
     log_entry = {
         'timestamp': datetime.utcnow().isoformat(),
         'total_profiles': len(all_profiles),
         'users_needing_matches': len(users_needing_matches),
+        'incremental': dirty_ids is not None,
+        'changed_users': len(dirty_ids) if dirty_ids is not None else None,
         'pool_additions': len(pool_additions),
         'additions': pool_additions,
+        'profile_load': load_stats,
+        'pair_scores': pair_stats,
+        'score_cache': score_stats,
         'dry_run': dry_run,
     }
 
@@ -461,7 +954,11 @@ def run_matching(dry_run=False, verbose=False):
         'pool_additions': len(pool_additions),
         'total_profiles': len(all_profiles),
         'users_needing_matches': len(users_needing_matches),
+        'incremental': dirty_ids is not None,
         'additions': pool_additions,
+        'profile_load': load_stats,
+        'pair_scores': pair_stats,
+        'score_cache': score_stats,
         'dry_run': dry_run,
     }
 
@@ -471,10 +968,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run daily matching for Love-Matcher')
     parser.add_argument('--dry-run', action='store_true', help='Simulate matching without saving changes')
     parser.add_argument('--verbose', '-v', action='store_true', help='Show detailed matching progress')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help=f'Max concurrent LLM scoring calls (default {LLM_CONCURRENCY})')
+    parser.add_argument('--shortlist', type=int, default=None,
+                        help=f'Candidates per user sent to LLM scoring (default {MATCH_SHORTLIST_SIZE}, 0 = all)')
+    parser.add_argument('--retrieval', choices=['rules', 'embedding'], default=None,
+                        help=f'How the shortlist is picked (default {MATCH_RETRIEVAL})')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only evaluate users changed since the last successful run')
     args = parser.parse_args()
     
     try:
-        result = run_matching(dry_run=args.dry_run, verbose=args.verbose)
+        result = run_matching(dry_run=args.dry_run, verbose=args.verbose, concurrency=args.concurrency,
+                              shortlist=args.shortlist, retrieval=args.retrieval,
+                              incremental=args.incremental)
         if result:
             print(f"\n✅ Result: {result}")
             sys.exit(0)
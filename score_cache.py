@@ -0,0 +1,98 @@
+"""
+Persistent pairwise compatibility score cache for run_matching.py
+
+LLM scores are stored in a local SQLite database keyed by the unordered
+user pair, a content hash of each side's matching data (what the prompt
+actually sends: age, gender, dimensions, ...), the scoring model and the
+match prompt version. A pair is only re-scored when one of the two
+profiles changed, the model changed or the prompt was revised.
+Rule-based fallback scores are never stored, so a failed LLM call is
+retried on the next run.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+import sqlite_util
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    pair_key TEXT PRIMARY KEY,
+    score INTEGER NOT NULL,
+    analysis TEXT NOT NULL,
+    scored_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_used_at ON scores (used_at);
+"""
+
+
+def content_hash(data):
+    """Stable hash of a JSON-serializable value."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()[:32]
+
+
+def pair_key(user_a, hash_a, user_b, hash_b, model, prompt_version):
+    """Key for an unordered pair: the same for (a, b) and (b, a)."""
+    sides = sorted([(user_a, hash_a), (user_b, hash_b)])
+    return '|'.join([sides[0][0], sides[0][1], sides[1][0], sides[1][1], model, str(prompt_version)])
+
+
+class ScoreCache:
+    """SQLite-backed store of (score, analysis) per pair key."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite_util.ThreadLocalConnection(path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def get(self, key):
+        """Return (score, analysis) or None."""
+        conn = self._conn()
+        row = conn.execute('SELECT score, analysis FROM scores WHERE pair_key = ?', (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        with conn:
+            conn.execute('UPDATE scores SET used_at = ? WHERE pair_key = ?', (time.time(), key))
+        return row[0], json.loads(row[1])
+
+    def set(self, key, score, analysis):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO scores (pair_key, score, analysis, scored_at, used_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, score, json.dumps(analysis), now, now)
+            )
+        with self._lock:
+            self.stores += 1
+
+    def prune(self, max_age):
+        """Delete scores not used for max_age seconds (superseded hashes,
+        deleted users). Returns the number removed."""
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute('DELETE FROM scores WHERE used_at < ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,123 @@
+"""
+Serialization codecs for documents stored in object storage
+
+Every stored JSON document goes through encode()/decode(). The codec used
+to write an object is recorded in its metadata (x-amz-meta-codec), and
+objects without that metadata are sniffed by their magic bytes, so plain
+JSON written before codecs existed keeps loading unchanged.
+
+Codecs:
+    json        plain UTF-8 JSON (default)
+    json+gzip   gzip-compressed JSON (stdlib)
+    json+zstd   zstandard-compressed JSON (needs the `zstandard` package)
+
+JSON itself is produced with orjson when it is installed, falling back to
+the stdlib json module.
+"""
+
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from settings import setting
+
+
+METADATA_KEY = 'codec'
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def dumps(obj):
+    """Serialize to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _gzip_compress(plain):
+    return gzip.compress(plain, compresslevel=6)
+
+
+def _zstd_compress(plain):
+    return zstandard.ZstdCompressor(level=3).compress(plain)
+
+
+def _zstd_decompress(body):
+    return zstandard.ZstdDecompressor().decompress(body)
+
+
+# name -> (compress, decompress)
+CODECS = {
+    'json': (lambda plain: plain, lambda body: body),
+    'json+gzip': (_gzip_compress, gzip.decompress),
+}
+if zstandard is not None:
+    CODECS['json+zstd'] = (_zstd_compress, _zstd_decompress)
+
+
+def _default_codec():
+    name = setting('STORAGE_CODEC', 'json')
+    if name not in CODECS:
+        print(f"⚠️ Storage codec '{name}' unavailable, writing plain JSON")
+        return 'json'
+    return name
+
+
+DEFAULT_CODEC = _default_codec()
+
+
+def compress(plain, codec=None):
+    """Compress JSON bytes with codec. Returns (body, metadata)."""
+    codec = codec or DEFAULT_CODEC
+    body = CODECS[codec][0](plain)
+    return body, ({METADATA_KEY: codec} if codec != 'json' else {})
+
+
+def detect(body, metadata=None):
+    """Name the codec of a stored body from its metadata or magic bytes."""
+    name = (metadata or {}).get(METADATA_KEY)
+    if name:
+        return name
+    if body[:2] == _GZIP_MAGIC:
+        return 'json+gzip'
+    if body[:4] == _ZSTD_MAGIC:
+        return 'json+zstd'
+    return 'json'
+
+
+def decompress(body, metadata=None):
+    """Return the plain JSON bytes of a stored body."""
+    name = detect(body, metadata)
+    if name not in CODECS:
+        raise ValueError(f"Object written with codec '{name}' which is not available here")
+    return CODECS[name][1](body)
+
+
+def encode(obj, codec=None):
+    """Serialize obj for storage. Returns (body, metadata)."""
+    return compress(dumps(obj), codec)
+
+
+def decode(body, metadata=None):
+    return loads(decompress(body, metadata))
+
+
+def put_kwargs(metadata):
+    """Extra put_object arguments carrying the codec metadata."""
+    return {'Metadata': metadata} if metadata else {}
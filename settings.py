@@ -0,0 +1,20 @@
+"""
+Settings lookup for Love-Matcher modules
+
+config.py is optional here: the .env-driven scripts (migrate_data.py) run
+without one, so settings fall back to environment variables.
+"""
+
+import os
+
+try:
+    import config
+except ImportError:
+    config = None  # .env-driven scripts have no config.py
+
+
+def setting(name, default=None):
+    """Read a setting from config.py, falling back to the environment."""
+    if hasattr(config, name):
+        return getattr(config, name)
+    return os.getenv(name, default)
@@ -0,0 +1,191 @@
+"""
+Shared second-level cache for Love-Matcher storage reads
+
+Sits between each process's in-memory TTLCache and object storage so every
+Gunicorn worker (and every node pointed at the same Redis) shares one copy
+of hot documents. Writers publish the key they changed on an invalidation
+channel; every other process drops its in-memory copy when it hears it, so
+per-process TTLs can be long without serving stale pair/match state.
+
+Only writers overwrite an entry (set). Readers fill it with add, which
+keeps any entry already there: a read that raced a write may hold the
+older body, and must not replace the body the writer just stored.
+
+Two implementations share one interface:
+
+    get(key) -> (body_bytes, etag) or None
+    set(key, body_bytes, etag, ttl)
+    add(key, body_bytes, etag, ttl) -> True if stored (key was absent)
+    delete(key)
+    publish_invalidation(key)
+    subscribe(callback)          # callback(key) for other processes' writes
+
+RedisSharedCache needs the optional `redis` package. LocalSharedCache is an
+in-process stand-in with the same semantics, for tests and single-process
+runs.
+"""
+
+import threading
+import time
+import uuid
+
+from settings import setting
+
+SHARED_CACHE_URL = setting('SHARED_CACHE_URL')
+SHARED_CACHE_CHANNEL = setting('SHARED_CACHE_CHANNEL', 'love-matcher:invalidate')
+
+
+class LocalSharedCache:
+    """In-process stand-in for the shared cache and invalidation bus.
+
+    Several handles created with the same `bus` behave like separate
+    workers attached to one Redis.
+    """
+
+    def __init__(self, bus=None):
+        self.origin = uuid.uuid4().hex
+        self.bus = bus if bus is not None else {'entries': {}, 'subscribers': [], 'lock': threading.Lock()}
+
+    def get(self, key):
+        with self.bus['lock']:
+            item = self.bus['entries'].get(key)
+            if item is None:
+                return None
+            body, etag, expires_at = item
+            if time.time() >= expires_at:
+                del self.bus['entries'][key]
+                return None
+            return body, etag
+
+    def set(self, key, body, etag, ttl):
+        with self.bus['lock']:
+            self.bus['entries'][key] = (body, etag, time.time() + ttl)
+
+    def add(self, key, body, etag, ttl):
+        with self.bus['lock']:
+            item = self.bus['entries'].get(key)
+            if item is not None and time.time() < item[2]:
+                return False
+            self.bus['entries'][key] = (body, etag, time.time() + ttl)
+            return True
+
+    def delete(self, key):
+        with self.bus['lock']:
+            self.bus['entries'].pop(key, None)
+
+    def publish_invalidation(self, key):
+        with self.bus['lock']:
+            subscribers = list(self.bus['subscribers'])
+        for origin, callback in subscribers:
+            if origin != self.origin:
+                callback(key)
+
+    def subscribe(self, callback):
+        with self.bus['lock']:
+            self.bus['subscribers'].append((self.origin, callback))
+
+
+# HSET + EXPIRE only if the hash does not exist yet
+_ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'body', ARGV[1], 'etag', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class RedisSharedCache:
+    """Shared cache on Redis: one hash per key plus a pub/sub channel."""
+
+    def __init__(self, url, channel=SHARED_CACHE_CHANNEL, namespace='lm:'):
+        import redis
+        self.origin = uuid.uuid4().hex
+        self.channel = channel
+        self.namespace = namespace
+        self._redis = redis.Redis.from_url(url)
+        self._add = self._redis.register_script(_ADD_SCRIPT)
+        self._listener = None
+
+    def _k(self, key):
+        return f"{self.namespace}{key}"
+
+    def get(self, key):
+        try:
+            item = self._redis.hmget(self._k(key), 'body', 'etag')
+        except Exception as e:
+            print(f"⚠️ Shared cache read failed for {key}: {e}")
+            return None
+        if item[0] is None:
+            return None
+        return item[0], item[1].decode('utf-8') if item[1] else None
+
+    def set(self, key, body, etag, ttl):
+        try:
+            pipe = self._redis.pipeline()
+            pipe.hset(self._k(key), mapping={'body': body, 'etag': etag or ''})
+            pipe.expire(self._k(key), max(1, int(ttl)))
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Shared cache write failed for {key}: {e}")
+
+    def add(self, key, body, etag, ttl):
+        try:
+            return bool(self._add(keys=[self._k(key)], args=[body, etag or '', max(1, int(ttl))]))
+        except Exception as e:
+            print(f"⚠️ Shared cache write failed for {key}: {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self._redis.delete(self._k(key))
+        except Exception as e:
+            print(f"⚠️ Shared cache delete failed for {key}: {e}")
+
+    def publish_invalidation(self, key):
+        try:
+            self._redis.publish(self.channel, f"{self.origin} {key}")
+        except Exception as e:
+            print(f"⚠️ Invalidation publish failed for {key}: {e}")
+
+    def subscribe(self, callback):
+        def listen():
+            while True:
+                try:
+                    pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                    for message in pubsub.listen():
+                        origin, _, key = message['data'].decode('utf-8').partition(' ')
+                        if origin != self.origin:
+                            callback(key)
+                except Exception as e:
+                    print(f"⚠️ Invalidation listener error, reconnecting: {e}")
+                    time.sleep(1)
+
+        self._listener = threading.Thread(target=listen, name='cache-invalidations', daemon=True)
+        self._listener.start()
+
+
+def invalidate(cache, key):
+    """Drop key from the shared tier and tell every other process to drop
+    its own copy. A no-op when cache is None (no shared tier configured)."""
+    if cache is not None:
+        cache.delete(key)
+        cache.publish_invalidation(key)
+
+
+def from_config():
+    """Build the shared cache named by SHARED_CACHE_URL, or None if unset.
+
+    'local' selects LocalSharedCache; redis:// URLs select RedisSharedCache.
+    """
+    if not SHARED_CACHE_URL:
+        return None
+    if SHARED_CACHE_URL == 'local':
+        return LocalSharedCache()
+    try:
+        return RedisSharedCache(SHARED_CACHE_URL)
+    except ImportError:
+        print("⚠️ SHARED_CACHE_URL is set but the redis package is not installed; shared cache disabled")
+        return None
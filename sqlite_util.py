@@ -0,0 +1,29 @@
+"""
+Per-thread SQLite connections for the local caches and stores
+
+sqlite3 connections must not be shared across threads, so every local
+database (disk cache, score cache, embeddings, profile snapshot, object
+store) opens one connection per thread, in WAL mode so readers never block
+the writer.
+"""
+
+import sqlite3
+import threading
+
+
+class ThreadLocalConnection:
+    """Callable returning this thread's connection to the database at path."""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,393 @@
+"""
+Shared storage client for Love-Matcher
+
+Builds the DigitalOcean Spaces (S3-compatible) client once per process with
+consistent timeouts, adaptive retries and a connection pool sized to the
+caller's concurrency, and records per-call latency for every S3 operation.
+Used by the API server and all maintenance scripts.
+
+With STORAGE_BACKEND = 'sqlite' the same client interface is served by an
+embedded SQLite store (local_store.py) whose writes are mirrored to Spaces
+in the background.
+"""
+
+import hashlib
+import io
+import threading
+import time
+from collections import deque
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from settings import config, setting as _setting
+
+
+S3_PREFIX = _setting('S3_PREFIX', '')
+
+S3_CONNECT_TIMEOUT = getattr(config, 'S3_CONNECT_TIMEOUT', 3)
+S3_READ_TIMEOUT = getattr(config, 'S3_READ_TIMEOUT', 10)
+S3_MAX_ATTEMPTS = getattr(config, 'S3_MAX_ATTEMPTS', 5)
+S3_DEFAULT_POOL_CONNECTIONS = getattr(config, 'S3_MAX_POOL_CONNECTIONS', 32)
+
+
+def parse_do_url(url):
+    """Extract bucket name and region from a Digital Ocean Spaces URL."""
+    url = url.replace('https://', '').replace('http://', '')
+    parts = url.split('.')
+    if len(parts) >= 3 and 'digitaloceanspaces' in url:
+        bucket = parts[0]
+        region = parts[1]
+        return bucket, region
+    raise ValueError(f"Invalid Digital Ocean Spaces URL: {url}")
+
+
+DO_SPACES_URL = _setting('DO_SPACES_URL')
+DO_BUCKET, DO_REGION = parse_do_url(DO_SPACES_URL) if DO_SPACES_URL else (None, None)
+DO_ENDPOINT = f"https://{DO_REGION}.digitaloceanspaces.com"
+S3_BUCKET = DO_BUCKET or 'local'
+
+# Send If-Match / If-None-Match on versioned writes. Turned off for the
+# process automatically if the store rejects conditional PUTs.
+S3_CONDITIONAL_WRITES = getattr(config, 'S3_CONDITIONAL_WRITES', True)
+
+# Object key layout. 1: flat (profiles/{user}.json, topics/{user}/...).
+# 2: hash-sharded (profiles/{shard}/{user}.json, topics/{shard}/{user}/...)
+# so bulk jobs spread over 256 prefixes; reads fall back to layout 1 for
+# objects migrate_layout.py has not moved yet.
+STORAGE_KEY_LAYOUT = int(_setting('STORAGE_KEY_LAYOUT', 1))
+SHARDED_ROOTS = ('profiles/', 'topics/')
+
+# 'spaces' (default) or 'sqlite' for the embedded local store
+STORAGE_BACKEND = _setting('STORAGE_BACKEND', 'spaces')
+LOCAL_STORE_PATH = _setting('LOCAL_STORE_PATH', 'love_matcher.db')
+# Mirror local writes to Spaces when credentials are configured
+LOCAL_STORE_ARCHIVE = getattr(config, 'LOCAL_STORE_ARCHIVE', True)
+
+
+class StorageMetrics:
+    """Per-operation call counts, errors and latency (ms) for S3 calls."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, operation, elapsed_ms, error=False):
+        with self._lock:
+            op = self._ops.get(operation)
+            if op is None:
+                op = self._ops[operation] = {
+                    'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'recent': deque(maxlen=self.window),
+                }
+            op['calls'] += 1
+            if error:
+                op['errors'] += 1
+            op['total_ms'] += elapsed_ms
+            op['max_ms'] = max(op['max_ms'], elapsed_ms)
+            op['recent'].append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for name, op in self._ops.items():
+                recent = sorted(op['recent'])
+                out[name] = {
+                    'calls': op['calls'],
+                    'errors': op['errors'],
+                    'avg_ms': round(op['total_ms'] / op['calls'], 2),
+                    'p50_ms': round(_percentile(recent, 50), 2),
+                    'p95_ms': round(_percentile(recent, 95), 2),
+                    'max_ms': round(op['max_ms'], 2),
+                }
+            return out
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+metrics = StorageMetrics()
+
+
+def _instrument(client):
+    """Time every S3 API call made through client into `metrics`."""
+    def before_call(model, context, **kwargs):
+        context['lm_started'] = time.perf_counter()
+        context['lm_operation'] = model.name
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        started = context.get('lm_started')
+        if started is None:
+            return
+        status = getattr(http_response, 'status_code', 200)
+        # 304 Not Modified and 404 NoSuchKey are expected answers, not failures
+        metrics.record(model.name, (time.perf_counter() - started) * 1000,
+                       error=status >= 400 and status != 404)
+
+    def after_call_error(context, exception, **kwargs):
+        started = context.get('lm_started')
+        if started is None:
+            return
+        metrics.record(context.get('lm_operation', 'unknown'),
+                       (time.perf_counter() - started) * 1000, error=True)
+
+    client.meta.events.register('before-call.s3', before_call)
+    client.meta.events.register('after-call.s3', after_call)
+    client.meta.events.register('after-call-error.s3', after_call_error)
+    return client
+
+
+def make_client(access_key, secret_key, endpoint_url=None, region_name=None,
+                max_pool_connections=S3_DEFAULT_POOL_CONNECTIONS):
+    """Build a tuned, instrumented S3 client for explicit credentials."""
+    client_config = Config(
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'adaptive'},
+        max_pool_connections=max_pool_connections,
+    )
+    client = boto3.client(
+        's3',
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        endpoint_url=endpoint_url,
+        region_name=region_name,
+        config=client_config,
+    )
+    return _instrument(client)
+
+
+def shard_for(user_id):
+    return hashlib.md5(user_id.encode('utf-8')).hexdigest()[:2]
+
+
+def sharded_key(key):
+    """Layout-2 form of a logical key; keys outside SHARDED_ROOTS are unchanged.
+
+    profiles/{user}.json       -> profiles/{shard}/{user}.json
+    topics/{user}/{rest}       -> topics/{shard}/{user}/{rest}
+    """
+    for root in SHARDED_ROOTS:
+        if key.startswith(root):
+            rest = key[len(root):]
+            user_id = rest.split('/', 1)[0]
+            if root == 'profiles/':
+                if '/' in rest or not rest.endswith('.json'):
+                    return key
+                user_id = rest[:-len('.json')]
+            elif '/' not in rest:
+                return key
+            return f"{root}{shard_for(user_id)}/{rest}"
+    return key
+
+
+def logical_key(physical):
+    """Inverse of sharded_key; layout-1 keys are returned unchanged."""
+    for root in SHARDED_ROOTS:
+        if physical.startswith(root):
+            parts = physical[len(root):].split('/')
+            depth = 2 if root == 'profiles/' else 3
+            if len(parts) >= depth and len(parts[0]) == 2:
+                return root + '/'.join(parts[1:])
+    return physical
+
+
+def physical_key(key):
+    """Where key is written under the configured layout (without S3_PREFIX)."""
+    return sharded_key(key) if STORAGE_KEY_LAYOUT >= 2 else key
+
+
+def physical_keys(key):
+    """Every place key may live: the current location first, then legacy."""
+    current = physical_key(key)
+    return [current] if current == key else [current, key]
+
+
+def is_missing_key(e):
+    return e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404')
+
+
+def get_object(client, bucket, prefix, key, **kwargs):
+    """get_object for a logical key under the configured layout.
+
+    Falls back to the legacy location and copies what it finds there to
+    the current one (create-only, same bytes and therefore same ETag), so
+    versioned writes against it keep working. The copy is skipped when
+    conditional writes are off.
+    """
+    candidates = physical_keys(key)
+    if len(candidates) > 1:
+        # Retry the current location once at the end: a migration may have
+        # moved the object between our two lookups
+        lookups = candidates + candidates[:1]
+    else:
+        lookups = candidates
+    for attempt, physical in enumerate(lookups):
+        try:
+            response = client.get_object(Bucket=bucket, Key=f"{prefix}{physical}", **kwargs)
+        except ClientError as e:
+            if is_missing_key(e) and attempt < len(lookups) - 1:
+                continue
+            raise
+        if physical != candidates[0]:
+            _promote(client, bucket, f"{prefix}{candidates[0]}", response)
+        return response
+
+
+def _promote(client, bucket, target, response):
+    body = response['Body'].read()
+    response['Body'] = io.BytesIO(body)
+    try:
+        # Without conditional writes the copy could overwrite a newer object
+        # at the target; readers keep falling back to the legacy key instead
+        put_object_if_absent(client, Bucket=bucket, Key=target, Body=body,
+                             ContentType=response.get('ContentType') or 'application/json',
+                             Metadata=response.get('Metadata') or {})
+    except WriteConflict:
+        pass  # already written there by someone else
+    except Exception as e:
+        print(f"⚠️ Could not copy {target} to its sharded location: {e}")
+
+
+def iter_keys(client, bucket, prefix, root):
+    """Logical keys of every object under root, in either layout, yielded
+    page by page as the listing arrives (listing order, each key once)."""
+    seen = set()
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f"{prefix}{root}"):
+        for obj in page.get('Contents', []):
+            key = logical_key(obj['Key'][len(prefix):])
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+
+def list_keys(client, bucket, prefix, root):
+    """Sorted logical keys of every object under root, in either layout."""
+    return sorted(iter_keys(client, bucket, prefix, root))
+
+
+UNCONDITIONAL = object()  # expected_etag for writes that always win
+
+
+class WriteConflict(Exception):
+    """A versioned write lost: the object changed since it was read."""
+
+    def __init__(self, key):
+        super().__init__(f"{key} was modified concurrently")
+        self.key = key
+
+
+def _is_precondition_failed(e):
+    code = e.response.get('Error', {}).get('Code')
+    status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status == 412 or code in ('PreconditionFailed', 'ConditionalRequestConflict')
+
+
+def _is_conditional_unsupported(e):
+    code = e.response.get('Error', {}).get('Code')
+    status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status == 501 or code == 'NotImplemented'
+
+
+def put_object_versioned(client, expected_etag=UNCONDITIONAL, **params):
+    """put_object that only succeeds if the stored object is still the
+    version that was read.
+
+    expected_etag is the ETag seen at read time, None if the key did not
+    exist (create-only), or UNCONDITIONAL. Raises WriteConflict when another
+    writer got there first.
+    """
+    global S3_CONDITIONAL_WRITES
+    if expected_etag is UNCONDITIONAL or not S3_CONDITIONAL_WRITES:
+        return client.put_object(**params)
+    if expected_etag is None:
+        condition = {'IfNoneMatch': '*'}
+    else:
+        condition = {'IfMatch': expected_etag}
+    try:
+        return client.put_object(**condition, **params)
+    except ClientError as e:
+        if _is_precondition_failed(e):
+            raise WriteConflict(params.get('Key')) from e
+        if not _is_conditional_unsupported(e):
+            raise
+        print(f"⚠️ Storage does not support conditional writes, falling back to last-write-wins: {e}")
+        S3_CONDITIONAL_WRITES = False
+        return client.put_object(**params)
+
+
+def put_object_if_absent(client, **params):
+    """Create-only put that never degrades to last-write-wins.
+
+    Returns True once written and False, without writing, when the store
+    cannot enforce If-None-Match. Raises WriteConflict if the key exists.
+    """
+    global S3_CONDITIONAL_WRITES
+    if not S3_CONDITIONAL_WRITES:
+        return False
+    try:
+        client.put_object(IfNoneMatch='*', **params)
+        return True
+    except ClientError as e:
+        if _is_precondition_failed(e):
+            raise WriteConflict(params.get('Key')) from e
+        if not _is_conditional_unsupported(e):
+            raise
+        print(f"⚠️ Storage does not support conditional writes, falling back to last-write-wins: {e}")
+        S3_CONDITIONAL_WRITES = False
+        return False
+
+
+_client = None
+_client_lock = threading.Lock()
+archiver = None  # ObjectArchiver when the sqlite backend mirrors to Spaces
+
+
+def _make_spaces_client(max_pool_connections):
+    if not DO_BUCKET:
+        raise ValueError("DO_SPACES_URL is not configured")
+    return make_client(
+        _setting('DO_SPACES_KEY'),
+        _setting('DO_SPACES_SECRET'),
+        endpoint_url=DO_ENDPOINT,
+        region_name=DO_REGION,
+        max_pool_connections=max_pool_connections,
+    )
+
+
+def _make_local_store(max_pool_connections):
+    global archiver
+    from local_store import SQLiteObjectStore, ObjectArchiver
+    store = SQLiteObjectStore(
+        LOCAL_STORE_PATH,
+        endpoint_url=DO_ENDPOINT if DO_BUCKET else '',
+        metrics=metrics,
+    )
+    if LOCAL_STORE_ARCHIVE and DO_BUCKET:
+        archiver = ObjectArchiver(store, _make_spaces_client(max_pool_connections), DO_BUCKET).start()
+    return store
+
+
+def get_s3_client(max_pool_connections=None):
+    """Return the process-wide storage client, building it on first use.
+
+    max_pool_connections should cover every thread that may use the client
+    concurrently (request threads plus I/O pools); only the first call's
+    value takes effect.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                pool = max_pool_connections or S3_DEFAULT_POOL_CONNECTIONS
+                if STORAGE_BACKEND == 'sqlite':
+                    _client = _make_local_store(pool)
+                else:
+                    _client = _make_spaces_client(pool)
+    return _client
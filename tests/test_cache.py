@@ -0,0 +1,170 @@
+"""TTLCache expiry/eviction and SingleFlight coalescing."""
+
+import threading
+import time
+import types
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() as seen by cache.py."""
+    now = [1000.0]
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def make_cache(max_bytes=1000, ttl=10, negative_ttl=5, max_stale=None):
+    return cache.TTLCache(max_bytes, {'doc': ttl}, lambda key: 'doc',
+                          negative_ttl=negative_ttl, max_stale=max_stale)
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    c = make_cache(max_bytes=100)
+    c.set('a', 'A', 40)
+    c.set('b', 'B', 40)
+    assert c.get('a') == 'A'  # a is now the most recently used
+    c.set('c', 'C', 40)
+    assert c.get('b') is None
+    assert c.get('a') == 'A' and c.get('c') == 'C'
+    assert c.stats()['evictions'] == 1
+    assert c.stats()['bytes'] == 80
+
+
+def test_expired_entries_are_evicted_before_live_ones(clock):
+    c = make_cache(max_bytes=100, ttl=10)
+    c.set('old', 'O', 40)
+    clock[0] += 5
+    c.set('live', 'L', 40)
+    c.get('old')  # recently used, but expires first
+    clock[0] += 6
+    c.set('new', 'N', 40)
+    assert c.get('live') == 'L'
+    assert c.stats()['evictions'] == 0
+
+
+def test_oversized_value_is_not_cached(clock):
+    c = make_cache(max_bytes=100)
+    c.set('a', 'A', 40)
+    c.set('big', 'B', 101)
+    assert c.get('big') is None
+    assert c.get('a') == 'A'
+
+
+def test_expiry_without_etag_drops_entry(clock):
+    c = make_cache(ttl=10)
+    c.set('a', 'A', 10)
+    clock[0] += 9.9
+    assert c.get('a') == 'A'
+    clock[0] += 0.1
+    assert c.get('a') is None
+    assert c.get_stale('a') == (None, None, False)
+    assert c.stats()['entries'] == 0
+
+
+def test_expired_entry_with_etag_can_be_revalidated(clock):
+    c = make_cache(ttl=10)
+    c.set('a', 'A', 10, etag='"v1"')
+    clock[0] += 11
+    assert c.get_versioned('a') == (None, None)
+    assert c.get_stale('a') == ('A', '"v1"', False)
+    assert not c.revalidate('a', '"v2"')
+    assert c.revalidate('a', '"v1"')
+    assert c.get_versioned('a') == ('A', '"v1"')
+
+
+def test_stale_window_is_servable_until_it_closes(clock):
+    c = make_cache(ttl=10, max_stale={'doc': 5})
+    c.set('a', 'A', 10)
+    clock[0] += 12
+    assert c.get('a') is None
+    assert c.get_stale('a') == ('A', None, True)
+    clock[0] += 3
+    assert c.get_stale('a') == (None, None, False)
+
+
+def test_missing_entries_use_negative_ttl(clock):
+    c = make_cache(ttl=100, negative_ttl=5)
+    c.set_missing('gone')
+    assert c.get('gone') is cache.MISSING
+    assert c.stats()['negative_hits'] == 1
+    clock[0] += 5
+    assert c.get('gone') is None
+
+
+def test_backdated_entry_expires_on_its_original_clock(clock):
+    c = make_cache(ttl=10)
+    c.set('a', 'A', 10, stored_at=clock[0] - 10)
+    assert c.get('a') is None
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = cache.SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', fetch)))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        pass
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', fetch))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.1)  # let the followers start waiting on the leader
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert results == ['value'] * 4
+    assert len(calls) == 1
+    assert flight.stats()['coalesced'] == 3
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_waiter_runs_fn_itself_after_timeout():
+    flight = cache.SingleFlight(timeout=0.05)
+    stuck = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do('k', lambda: stuck.wait(5)))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        pass
+    assert flight.do('k', lambda: 'own') == 'own'
+    assert flight.stats()['timeouts'] == 1
+    stuck.set()
+    leader.join()
+
+
+def test_single_flight_shares_the_leaders_error():
+    flight = cache.SingleFlight(timeout=5)
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5)
+        raise ValueError('boom')
+
+    def call():
+        try:
+            flight.do('k', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        pass
+    follower = threading.Thread(target=call)
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+    assert flight.stats()['in_flight'] == 0
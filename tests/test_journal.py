@@ -0,0 +1,143 @@
+"""WriteJournal replay, ordering and torn-record handling, uploading to
+a SQLiteObjectStore."""
+
+import os
+
+import pytest
+
+import journal
+import local_store
+
+BUCKET = 'test'
+
+
+@pytest.fixture
+def remote(tmp_path):
+    return local_store.SQLiteObjectStore(str(tmp_path / 'remote.db'))
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'journal')
+
+
+def body_of(remote, key):
+    return remote.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+def drain(j):
+    while j.drain_once():
+        pass
+
+
+def newest_segment(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith('segment-'))[-1]
+
+
+def test_pending_writes_are_readable_until_uploaded(remote, directory):
+    j = journal.WriteJournal(directory, remote, BUCKET)
+    etag = j.put('k', b'v1', 'application/json', {'codec': 'json'})
+    assert j.get('k') == ('put', b'v1', {'codec': 'json'}, etag)
+    drain(j)
+    assert j.get('k') is None
+    response = remote.get_object(Bucket=BUCKET, Key='k')
+    assert response['Body'].read() == b'v1'
+    assert response['ETag'] == etag
+    assert response['Metadata'] == {'codec': 'json'}
+
+
+def test_writes_to_one_key_upload_the_newest(remote, directory):
+    j = journal.WriteJournal(directory, remote, BUCKET)
+    for i in range(5):
+        j.put('k', f"v{i}".encode())
+    j.delete('gone')
+    j.put('gone', b'back')
+    drain(j)
+    assert body_of(remote, 'k') == b'v4'
+    assert body_of(remote, 'gone') == b'back'
+    assert j.stats()['pending'] == 0
+
+
+def test_restart_replays_everything_after_the_checkpoint(remote, directory):
+    j = journal.WriteJournal(directory, remote, BUCKET, batch_size=2)
+    for key in ('a', 'b', 'c', 'd'):
+        j.put(key, key.encode())
+    assert j.drain_once()  # uploads a and b, then the process "dies"
+    j.stop(drain=False)
+
+    restarted = journal.WriteJournal(directory, remote, BUCKET)
+    assert restarted.replayed == 2
+    assert restarted.get('a') is None
+    assert restarted.get('c')[1] == b'c'
+    drain(restarted)
+    assert [body_of(remote, key) for key in 'abcd'] == [b'a', b'b', b'c', b'd']
+
+
+def test_torn_tail_is_discarded_and_appends_continue(remote, directory):
+    j = journal.WriteJournal(directory, remote, BUCKET)
+    j.put('a', b'complete')
+    j.stop(drain=False)
+    path = os.path.join(directory, newest_segment(directory))
+    torn = journal._encode('b', 'put', b'never acknowledged', None, None, 0.0)
+    with open(path, 'ab') as f:
+        f.write(torn[:len(torn) - 3])
+
+    restarted = journal.WriteJournal(directory, remote, BUCKET)
+    assert restarted.replayed == 1
+    assert restarted.get('b') is None
+    restarted.put('c', b'after')
+    drain(restarted)
+    assert body_of(remote, 'a') == b'complete'
+    assert body_of(remote, 'c') == b'after'
+    assert restarted.stats()['pending'] == 0
+
+
+def test_one_uploader_per_directory(remote, directory):
+    first = journal.WriteJournal(directory, remote, BUCKET)
+    second = journal.WriteJournal(directory, remote, BUCKET)
+    first.put('k', b'from first')
+    second.put('k', b'from second')
+    assert first.get('k')[1] == b'from second'  # sees the other process's write
+
+    assert first.drain_once()
+    second.put('j', b'queued')
+    assert not second.drain_once()  # first holds the uploader lock
+    assert second.stats()['pending'] == 1
+    first.stop(drain=False)
+
+    drain(second)  # takes over once first has gone
+    assert body_of(remote, 'k') == b'from second'
+    assert body_of(remote, 'j') == b'queued'
+
+
+def test_segments_roll_and_are_compacted(remote, directory, monkeypatch):
+    monkeypatch.setattr(journal, '_SEGMENT_BYTES', 200)
+    j = journal.WriteJournal(directory, remote, BUCKET)
+    for i in range(10):
+        j.put(f"k{i}", b'x' * 100)
+    assert j.stats()['segments'] > 1
+    drain(j)
+    assert j.stats()['segments'] == 1
+    assert all(body_of(remote, f"k{i}") == b'x' * 100 for i in range(10))
+
+    restarted = journal.WriteJournal(directory, remote, BUCKET)
+    assert restarted.replayed == 0
+
+
+def test_failed_upload_stays_queued(remote, directory):
+    class Flaky:
+        failures = 1
+
+        def put_object(self, **params):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError('remote down')
+            return remote.put_object(**params)
+
+    j = journal.WriteJournal(directory, Flaky(), BUCKET)
+    j.put('k', b'v')
+    with pytest.raises(ConnectionError):
+        j.drain_once()
+    assert j.get('k')[1] == b'v'
+    drain(j)
+    assert body_of(remote, 'k') == b'v'
@@ -0,0 +1,82 @@
+"""SQLiteObjectStore: S3 semantics the storage layer relies on."""
+
+import pytest
+from botocore.exceptions import ClientError
+
+import local_store
+import storage
+
+BUCKET = 'test'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return local_store.SQLiteObjectStore(str(tmp_path / 'objects.db'))
+
+
+def status(error):
+    return error.value.response['ResponseMetadata']['HTTPStatusCode']
+
+
+def test_if_none_match_star_is_create_only(store):
+    store.put_object(Bucket=BUCKET, Key='k', Body=b'one', IfNoneMatch='*')
+    with pytest.raises(ClientError) as e:
+        store.put_object(Bucket=BUCKET, Key='k', Body=b'two', IfNoneMatch='*')
+    assert status(e) == 412
+    assert store.get_object(Bucket=BUCKET, Key='k')['Body'].read() == b'one'
+
+
+def test_if_match_requires_the_current_etag(store):
+    etag = store.put_object(Bucket=BUCKET, Key='k', Body=b'one')['ETag']
+    with pytest.raises(ClientError) as e:
+        store.put_object(Bucket=BUCKET, Key='missing', Body=b'x', IfMatch=etag)
+    assert status(e) == 412
+    store.put_object(Bucket=BUCKET, Key='k', Body=b'two', IfMatch=etag)
+    with pytest.raises(ClientError) as e:
+        store.put_object(Bucket=BUCKET, Key='k', Body=b'three', IfMatch=etag)
+    assert status(e) == 412
+    assert store.get_object(Bucket=BUCKET, Key='k')['Body'].read() == b'two'
+
+
+def test_failed_precondition_queues_nothing_for_the_archiver(store):
+    store.put_object(Bucket=BUCKET, Key='k', Body=b'one')
+    with pytest.raises(ClientError):
+        store.put_object(Bucket=BUCKET, Key='k', Body=b'two', IfNoneMatch='*')
+    assert store.outbox_stats()['pending'] == 1
+
+
+def test_get_if_none_match_reports_not_modified(store):
+    etag = store.put_object(Bucket=BUCKET, Key='k', Body=b'one', Metadata={'codec': 'json'})['ETag']
+    with pytest.raises(ClientError) as e:
+        store.get_object(Bucket=BUCKET, Key='k', IfNoneMatch=etag)
+    assert status(e) == 304
+    response = store.get_object(Bucket=BUCKET, Key='k', IfNoneMatch='"other"')
+    assert response['Metadata'] == {'codec': 'json'}
+
+
+def test_missing_keys_look_like_s3(store):
+    with pytest.raises(ClientError) as e:
+        store.get_object(Bucket=BUCKET, Key='nope')
+    assert storage.is_missing_key(e.value)
+    with pytest.raises(ClientError) as e:
+        store.head_object(Bucket=BUCKET, Key='nope')
+    assert storage.is_missing_key(e.value)
+
+
+def test_listing_paginates_in_key_order(store):
+    keys = [f"p/{i:03d}" for i in range(25)]
+    for key in reversed(keys):
+        store.put_object(Bucket=BUCKET, Key=key, Body=b'x')
+    store.put_object(Bucket=BUCKET, Key='q/other', Body=b'x')
+    pages = list(store.get_paginator('list_objects_v2').paginate(Bucket=BUCKET, Prefix='p/', MaxKeys=10))
+    assert [len(page['Contents']) for page in pages] == [10, 10, 5]
+    assert [obj['Key'] for page in pages for obj in page['Contents']] == keys
+
+
+def test_delete_objects_removes_and_queues_each_key(store):
+    for key in ('a', 'b', 'c'):
+        store.put_object(Bucket=BUCKET, Key=key, Body=b'x')
+    store.outbox_done([row[0] for row in store.outbox_batch()])
+    store.delete_objects(Bucket=BUCKET, Delete={'Objects': [{'Key': 'a'}, {'Key': 'b'}], 'Quiet': True})
+    assert storage.list_keys(store, BUCKET, '', '') == ['c']
+    assert [(row[2], row[3]) for row in store.outbox_batch()] == [('a', 'delete'), ('b', 'delete')]
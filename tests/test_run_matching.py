@@ -0,0 +1,87 @@
+"""PairScores ordering/reuse and LLMScheduler limits."""
+
+import random
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('config', reason='run_matching needs config.py')
+import run_matching  # noqa: E402
+
+
+def profile(user_id):
+    return {'user_id': user_id}
+
+
+@pytest.fixture
+def scorer(monkeypatch):
+    """Deterministic stand-in for the LLM scorer that finishes out of order."""
+    calls = []
+
+    def score(profile1, profile2):
+        calls.append((profile1['user_id'], profile2['user_id']))
+        time.sleep(random.uniform(0, 0.01))
+        pair = sorted((profile1['user_id'], profile2['user_id']))
+        return sum(map(ord, ''.join(pair))) % 100, {'pair': pair}
+
+    monkeypatch.setattr(run_matching, 'calculate_compatibility_score', score)
+    return calls
+
+
+def test_score_many_returns_results_in_candidate_order(scorer):
+    scores = run_matching.PairScores(workers=8)
+    try:
+        candidates = [profile(f"c{i}") for i in range(30)]
+        results = scores.score_many(profile('me'), candidates)
+    finally:
+        scores.close()
+    assert [analysis['pair'] for _, analysis in results] == [sorted(('me', c['user_id'])) for c in candidates]
+    assert len(scorer) == 30
+
+
+def test_reverse_pair_reuses_the_first_score(scorer):
+    scores = run_matching.PairScores(workers=4)
+    try:
+        first = scores.score_many(profile('a'), [profile('b'), profile('c'), profile('b')])
+        second = scores.score(profile('b'), profile('a'))
+    finally:
+        scores.close()
+    assert first[0] == first[2] == second
+    assert len(scorer) == 2
+    assert scores.stats()['reused'] == 1
+    assert scores.stats()['pairs_scored'] == 2
+
+
+def test_scheduler_halves_on_rate_limit_and_recovers():
+    scheduler = run_matching.LLMScheduler(8)
+    scheduler.acquire()
+    scheduler.release(0.1, rate_limited=True)
+    assert scheduler.limit == 4
+    for _ in range(4):
+        scheduler.acquire()
+        scheduler.release(0.1)
+    assert scheduler.limit == 5
+    stats = scheduler.stats()
+    assert stats['rate_limited'] == 1
+    assert stats['min_concurrency'] == 4
+    assert stats['llm_calls'] == 5
+
+
+def test_scheduler_blocks_at_the_limit():
+    scheduler = run_matching.LLMScheduler(2)
+    scheduler.acquire()
+    scheduler.acquire()
+    entered = threading.Event()
+
+    def third():
+        scheduler.acquire()
+        entered.set()
+
+    t = threading.Thread(target=third)
+    t.start()
+    assert not entered.wait(0.1)
+    scheduler.release(0.1)
+    assert entered.wait(1)
+    t.join()
+    assert scheduler.in_flight == 2
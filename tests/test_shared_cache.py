@@ -0,0 +1,50 @@
+"""LocalSharedCache semantics shared with the Redis implementation."""
+
+import types
+
+import pytest
+
+import shared_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_entries_expire(clock):
+    c = shared_cache.LocalSharedCache()
+    c.set('k', b'body', '"e1"', ttl=10)
+    assert c.get('k') == (b'body', '"e1"')
+    clock[0] += 10
+    assert c.get('k') is None
+
+
+def test_add_never_replaces_a_live_entry(clock):
+    c = shared_cache.LocalSharedCache()
+    c.set('k', b'written', '"new"', ttl=10)
+    assert not c.add('k', b'read earlier', '"old"', ttl=10)
+    assert c.get('k') == (b'written', '"new"')
+    clock[0] += 10
+    assert c.add('k', b'fresh read', '"newer"', ttl=10)
+    assert c.get('k') == (b'fresh read', '"newer"')
+
+
+def test_handles_on_one_bus_share_entries_and_invalidations():
+    worker1 = shared_cache.LocalSharedCache()
+    worker2 = shared_cache.LocalSharedCache(bus=worker1.bus)
+    heard1, heard2 = [], []
+    worker1.subscribe(heard1.append)
+    worker2.subscribe(heard2.append)
+
+    worker1.set('k', b'body', None, ttl=10)
+    assert worker2.get('k') == (b'body', None)
+    shared_cache.invalidate(worker1, 'k')
+    assert worker2.get('k') is None
+    assert heard1 == [] and heard2 == ['k']  # publishers do not hear themselves
+
+
+def test_invalidate_without_a_shared_tier_is_a_no_op():
+    shared_cache.invalidate(None, 'k')
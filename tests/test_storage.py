@@ -0,0 +1,91 @@
+"""Key layout helpers and versioned writes, against SQLiteObjectStore."""
+
+import pytest
+
+import local_store
+import storage
+
+BUCKET = 'test'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return local_store.SQLiteObjectStore(str(tmp_path / 'objects.db'))
+
+
+@pytest.fixture
+def layout2(monkeypatch):
+    monkeypatch.setattr(storage, 'STORAGE_KEY_LAYOUT', 2)
+
+
+@pytest.mark.parametrize('key', [
+    'profiles/alice_example_com.json',
+    'topics/alice_example_com/values.json',
+    'topics/alice_example_com/nested/deep.json',
+])
+def test_sharded_key_round_trips(key):
+    physical = storage.sharded_key(key)
+    assert physical != key
+    assert physical.split('/')[1] == storage.shard_for('alice_example_com')
+    assert storage.logical_key(physical) == key
+    assert storage.sharded_key(storage.logical_key(physical)) == physical
+
+
+@pytest.mark.parametrize('key', [
+    'member_list.json',
+    'matches/alice_example_com.json',
+    'profiles/',
+    'profiles/alice_example_com/photo.jpg',
+    'topics/alice_example_com',
+])
+def test_keys_outside_the_layout_are_unchanged(key):
+    assert storage.sharded_key(key) == key
+    assert storage.logical_key(key) == key
+
+
+def test_physical_keys_follow_the_configured_layout(layout2):
+    key = 'profiles/bob.json'
+    assert storage.physical_keys(key) == [storage.sharded_key(key), key]
+    assert storage.physical_keys('member_list.json') == ['member_list.json']
+
+
+def test_list_keys_merges_both_layouts(store, layout2):
+    store.put_object(Bucket=BUCKET, Key='P/profiles/a.json', Body=b'{}')
+    store.put_object(Bucket=BUCKET, Key=f"P/{storage.sharded_key('profiles/a.json')}", Body=b'{}')
+    store.put_object(Bucket=BUCKET, Key=f"P/{storage.sharded_key('profiles/b.json')}", Body=b'{}')
+    assert storage.list_keys(store, BUCKET, 'P/', 'profiles/') == ['profiles/a.json', 'profiles/b.json']
+
+
+def test_versioned_write_detects_lost_update(store):
+    first = storage.put_object_versioned(store, None, Bucket=BUCKET, Key='k', Body=b'v1')
+    with pytest.raises(storage.WriteConflict):
+        storage.put_object_versioned(store, None, Bucket=BUCKET, Key='k', Body=b'again')
+    second = storage.put_object_versioned(store, first['ETag'], Bucket=BUCKET, Key='k', Body=b'v2')
+    with pytest.raises(storage.WriteConflict):
+        storage.put_object_versioned(store, first['ETag'], Bucket=BUCKET, Key='k', Body=b'stale')
+    assert store.get_object(Bucket=BUCKET, Key='k')['ETag'] == second['ETag']
+
+
+def test_put_if_absent_never_overwrites(store, monkeypatch):
+    assert storage.put_object_if_absent(store, Bucket=BUCKET, Key='k', Body=b'new')
+    with pytest.raises(storage.WriteConflict):
+        storage.put_object_if_absent(store, Bucket=BUCKET, Key='k', Body=b'old')
+    monkeypatch.setattr(storage, 'S3_CONDITIONAL_WRITES', False)
+    assert not storage.put_object_if_absent(store, Bucket=BUCKET, Key='other', Body=b'x')
+    assert store.get_object(Bucket=BUCKET, Key='k')['Body'].read() == b'new'
+
+
+def test_legacy_read_is_promoted_to_the_sharded_key(store, layout2):
+    store.put_object(Bucket=BUCKET, Key='P/profiles/a.json', Body=b'{"v": 1}')
+    response = storage.get_object(store, BUCKET, 'P/', 'profiles/a.json')
+    assert response['Body'].read() == b'{"v": 1}'
+    promoted = store.get_object(Bucket=BUCKET, Key=f"P/{storage.sharded_key('profiles/a.json')}")
+    assert promoted['ETag'] == response['ETag']
+
+
+def test_legacy_read_is_not_promoted_without_conditional_writes(store, layout2, monkeypatch):
+    monkeypatch.setattr(storage, 'S3_CONDITIONAL_WRITES', False)
+    store.put_object(Bucket=BUCKET, Key='P/profiles/a.json', Body=b'{"v": 1}')
+    assert storage.get_object(store, BUCKET, 'P/', 'profiles/a.json')['Body'].read() == b'{"v": 1}'
+    assert storage.list_keys(store, BUCKET, 'P/', 'profiles/') == ['profiles/a.json']
+    assert 'Contents' not in store.list_objects_v2(Bucket=BUCKET, Prefix=f"P/{storage.sharded_key('profiles/a.json')}")